@@ -1,4 +1,8 @@
 # api/config.py
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -9,6 +13,9 @@ class Settings(BaseSettings):
     # Le chiavi API sono la cosa più importante. Se mancano, l'app non deve partire.
     google_api_key: str = Field(..., env="GOOGLE_API_KEY")
     mistral_api_key: str = Field(..., env="MISTRAL_API_KEY")
+    # API key Google aggiuntive, separate da virgole: le richieste vengono distribuite
+    # su tutte, ciascuna con il proprio budget di rate limit.
+    google_api_keys: str = Field(default="", env="GOOGLE_API_KEYS")
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -16,5 +23,21 @@ class Settings(BaseSettings):
         extra='ignore'
     )
 
+    def all_google_api_keys(self) -> List[str]:
+        """La key principale seguita da quelle aggiuntive."""
+        return [self.google_api_key, *self.google_api_keys.split(",")]
+
 # Crea un'istanza singola della configurazione che verrà usata in tutta l'app
 settings = Settings()
+
+# Parametri di tuning non segreti (limiti, cache, OCR) letti da config.json.
+CONFIG_PATH = Path(__file__).resolve().parent.parent / "config.json"
+
+def load_app_config(path: Path = CONFIG_PATH) -> Dict[str, Any]:
+    """Carica config.json. Se il file manca, l'app parte con i valori di default."""
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+app_config = load_app_config()
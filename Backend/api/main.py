@@ -1,38 +1,255 @@
 import asyncio
+import json
+import os
+from functools import partial
+import time
 import uuid
 import zipfile
-from io import BytesIO
-from typing import List, Dict, OrderedDict, Literal
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from typing import List, Dict, OrderedDict, Literal, Tuple
 from pathlib import Path
 import logging
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Form
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Form, Header, Query
+from fastapi.responses import StreamingResponse, JSONResponse, Response, FileResponse
 from pydantic import BaseModel
 
 from api.models import ProcessChunksRequest, MultiProcessRequest, ChunkingResponse, ChunkingConfig
-from api.config import settings
-from src.text_processor import process_chunks_async
-from src.ocr_handler import process_pdf_to_markdown, TEMP_ATTACHMENT_DIR
-from src.text_normalizer import normalize_text
-from src.chunking_strategy import get_splitter
+from api.config import settings, app_config
+from src.text_processor import ProcessingOptions, process_chunks_async, unit_content_key
+from src.llm_handler import LLMClientPool, compile_prompt, make_llm_factory
+from src.job_events import JobEventBus, JobProgress, TERMINAL_STATUSES
+from src.job_store import JobStore, ACTIVE_STATUSES, FINISHED_STATUSES, STALE_JOB_DETAIL, iter_gzip_file
+from src.job_scheduler import JobScheduler, JobCancelledError
+from src.rate_limiter import RateLimiter
+from src.llm_router import LLMRouter
+from src.retry import RetryPolicy
+from src.token_estimator import TokenEstimatorRegistry
+from src.llm_cache import ResponseCache
+from src.request_dedup import DedupStats, SingleFlight
+from src.ocr_handler import (
+    process_pdf_to_markdown_async, cleanup_attachment_dirs, remove_request_attachments, make_ocr_provider_factory,
+    OCR_CACHE_DIR, OCROptions, BLOB_STORE
+)
+from src.ocr_cache import OCRCache
+from src.cpu_pool import CPUPool, SplitterSpec
+from src.zip_stream import ZipEntry, ArchiveSpool, iter_zip, collect_attachment_entries, write_archive
+from src.metrics import REGISTRY, ERRORS, JOBS, current_job_id, observe_stage, stage_timer, timed_iter, track_job, forget_job
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
 # Stato dei Job
 class JobStatus(BaseModel):
-    status: Literal["pending", "processing", "completed", "failed"]
+    status: Literal["pending", "processing", "completed", "failed", "cancelled"]
     detail: str | None = None
 
-JOBS: Dict[str, Dict] = {}
+# Job persistenti (SQLite + output compressi su disco), condivisi tra tutti i worker.
+JOB_STORE = JobStore.from_config(app_config.get("job_store", {}))
+JOB_STORE_EVICTION_INTERVAL = app_config.get("job_store", {}).get("eviction_interval_minutes", 10) * 60
+# Ogni processo conferma a intervalli regolari di essere vivo per i job che esegue.
+JOB_STORE_HEARTBEAT_INTERVAL = app_config.get("job_store", {}).get("heartbeat_seconds", 60)
 
-async def universal_background_processor_async(job_id: str, request: MultiProcessRequest):
-    logger.info(f"Job {job_id}: Inizio Universal Processing per {len(request.files_to_process)} file.")
-    JOBS[job_id]['status'] = 'processing'
+# Eventi di avanzamento dei job (SSE e long-polling su /results).
+JOB_EVENTS = JobEventBus()
+
+# Scheduler delle chiamate LLM: coda limitata, rotazione equa tra job e priorità.
+SCHEDULER = JobScheduler.from_config(app_config.get("scheduler", {}))
+
+async def set_job_status(job_id: str, status: str, detail: str | None = None, from_statuses=ACTIVE_STATUSES) -> bool:
+    """Transizione atomica di stato; pubblica l'evento solo se la transizione è avvenuta."""
+    version = await asyncio.to_thread(JOB_STORE.transition, job_id, from_statuses, status, detail)
+    if version is None:
+        logger.warning(f"Job {job_id}: transizione a '{status}' ignorata (stato corrente non compatibile).")
+        return False
+    job = await asyncio.to_thread(JOB_STORE.get, job_id)
+    await JOB_EVENTS.publish(job_id, "status", version, {"status": status, "detail": job['detail']})
+    return True
+
+def count_llm_units(request: MultiProcessRequest) -> int:
+    """Numero di chiamate (chunk, prompt) che il job dovrà eseguire."""
+    if request.save_chunks_mode:
+        return 0
+    return sum(
+        sum(1 for chunk in file_task.chunks if chunk.strip()) * len(file_task.prompts)
+        for file_task in request.files_to_process
+    )
+
+def request_attachments(request: MultiProcessRequest) -> List[str]:
+    """Cartelle allegati dei file della richiesta (prodotte da /chunk per i PDF)."""
+    return [file_task.attachment_path for file_task in request.files_to_process if file_task.attachment_path]
+
+def collect_reusable_results(
+    parent_job_id: str, parent_request: MultiProcessRequest, request: MultiProcessRequest
+) -> Dict[int, Dict[Tuple[int, str], str]]:
+    """
+    Per ogni file di `request`, i risultati riusciti del job padre riutilizzabili: quelli delle
+    unità con lo stesso contenuto (chunk, prompt formattato, modello e temperatura), ovunque
+    si trovassero nel padre. Le unità nuove o modificate restano da elaborare.
+    """
+    by_content: Dict[str, str] = {}
+    for file_idx, file_task in enumerate(parent_request.files_to_process):
+        model_config = file_task.llm_config.dict()
+        for (chunk_idx, prompt_name), result in JOB_STORE.completed_units(parent_job_id, file_idx).items():
+            if chunk_idx <= len(file_task.chunks) and prompt_name in file_task.prompts:
+                content_key = unit_content_key(model_config, file_task.prompts[prompt_name], file_task.chunks[chunk_idx - 1])
+                by_content[content_key] = result
+
+    reusable: Dict[int, Dict[Tuple[int, str], str]] = {}
+    for file_idx, file_task in enumerate(request.files_to_process):
+        model_config = file_task.llm_config.dict()
+        reusable[file_idx] = {
+            (chunk_idx, prompt_name): by_content[content_key]
+            for chunk_idx, chunk in enumerate(file_task.chunks, start=1) if chunk.strip()
+            for prompt_name, prompt_text in file_task.prompts.items()
+            if (content_key := unit_content_key(model_config, prompt_text, chunk)) in by_content
+        }
+    return reusable
+
+def make_progress_callback(job_id: str, file_idx: int, file_name: str, progress: JobProgress):
+    """
+    Crea la callback che salva il checkpoint di ogni risultato, aggiorna i contatori
+    e pubblica un evento di avanzamento.
+    """
+    async def on_result(key, response: str, failed: bool):
+        chunk_idx, prompt_name = key
+        await asyncio.to_thread(JOB_STORE.save_unit, job_id, file_idx, chunk_idx, prompt_name, response, failed)
+        progress.record(failed)
+        version = await asyncio.to_thread(JOB_STORE.update_progress, job_id, progress.as_dict())
+        if version is None:
+            # Il job è stato annullato (anche da un altro worker): fermiamo le chiamate residue.
+            SCHEDULER.cancel(job_id)
+            return
+        await JOB_EVENTS.publish(job_id, "progress", version, {
+            "file_name": file_name,
+            "chunk_idx": chunk_idx,
+            "prompt_name": prompt_name,
+            "failed": failed,
+            "markdown": response,
+            "progress": progress.as_dict(),
+        })
+    return on_result
+
+# Servizi LLM e OCR: quelli reali (Gemini, Mistral) o quelli simulati per benchmark e test.
+PROVIDERS_CONFIG = app_config.get("providers", {})
+
+# Client LLM condivisi da tutti i job del processo, per (modello, temperatura, API key).
+LLM_POOL = LLMClientPool(factory=make_llm_factory(PROVIDERS_CONFIG))
+
+# Rate limiter condiviso da tutti i job del processo (RPM/TPM/concorrenza per modello).
+RATE_LIMITER = RateLimiter.from_config(app_config.get("rate_limits", {}))
+
+# Distribuzione delle richieste su tutte le API key Google e sui modelli di riserva.
+LLM_ROUTER = LLMRouter.from_config(
+    settings.all_google_api_keys(), app_config.get("llm_routing", {}), rate_limiter=RATE_LIMITER, llm_pool=LLM_POOL
+)
+
+# Retry con backoff esponenziale e jitter per gli errori temporanei delle chiamate LLM.
+RETRY_POLICY = RetryPolicy.from_dict(app_config.get("retries", {}))
+
+# Limiti delle richieste raggruppate (batch_mode): elementi e token di input per richiesta.
+BATCHING_CONFIG = app_config.get("batching", {})
+
+# Stimatori locali dei token per modello: chunking a budget di token e stime per il rate limiter.
+TOKEN_ESTIMATORS = TokenEstimatorRegistry.from_config(app_config.get("token_estimation", {}))
+
+# Cache persistente delle risposte LLM (None se disabilitata in config.json).
+LLM_CACHE = ResponseCache.from_config(app_config.get("llm_cache", {}))
+# Deduplicazione delle unità identiche nel job e delle richieste identiche in corso tra job.
+REQUEST_DEDUP_CONFIG = app_config.get("request_dedup", {})
+IN_FLIGHT_REQUESTS = SingleFlight.from_config(REQUEST_DEDUP_CONFIG)
+
+# Opzioni di elaborazione comuni a tutti i job: i dati del job e del file vengono aggiunti con replace().
+PROCESSING_OPTIONS = ProcessingOptions(
+    rate_limiter=RATE_LIMITER,
+    cache=LLM_CACHE,
+    scheduler=SCHEDULER,
+    retry_policy=RETRY_POLICY,
+    batch_max_items=BATCHING_CONFIG.get("max_items", 8),
+    batch_max_tokens=BATCHING_CONFIG.get("max_input_tokens", 12000),
+    dedup_units=REQUEST_DEDUP_CONFIG.get("within_job", True),
+    coalescer=IN_FLIGHT_REQUESTS,
+    llm_pool=LLM_POOL,
+    router=LLM_ROUTER,
+)
+
+# Cache dei risultati OCR: ri-chunkare lo stesso PDF non richiede un nuovo OCR.
+OCR_CACHE = OCRCache.from_config(app_config.get("ocr_cache", {}), default_dir=OCR_CACHE_DIR)
+
+# Thread pool limitato per l'OCR: le chiamate a Mistral sono bloccanti e non devono
+# fermare l'event loop. Il numero di worker limita anche i PDF processati in parallelo.
+OCR_EXECUTOR = ThreadPoolExecutor(
+    max_workers=app_config.get("ocr_config", {}).get("max_concurrent_files", 4),
+    thread_name_prefix="ocr"
+)
+OCR_OPTIONS = OCROptions.from_dict(app_config.get("ocr_config", {}))
+OCR_PROVIDER_FACTORY = make_ocr_provider_factory(PROVIDERS_CONFIG)
+
+# Archivi ZIP dei risultati: durante la generazione restano in memoria sotto questa soglia.
+ZIP_SPILL_THRESHOLD = int(app_config.get("results", {}).get("zip_spill_threshold_mb", 16) * 1024 * 1024)
+
+# Pool di processi per il lavoro CPU-bound (normalizzazione, chunking, archivi ZIP): i worker
+# partono all'avvio con llama_index già importato e lo splitter di default pronto.
+CPU_POOL_CONFIG = app_config.get("cpu_pool", {})
+CPU_POOL = CPUPool.from_config(CPU_POOL_CONFIG, warm_spec=SplitterSpec.from_config(app_config.get("chunking_config", {})))
+
+def needs_archive(job: Dict) -> bool:
+    """Se i risultati del job si scaricano come ZIP (più file, allegati o save_chunks_mode)."""
+    return len(job['meta'].get("outputs", [])) > 1 or bool(job['meta'].get("attachments")) or bool(job['meta'].get('save_chunks_mode'))
+
+def archive_entries(job: Dict) -> List[ZipEntry]:
+    """Voci dell'archivio dei risultati; sono serializzabili, quindi vanno bene anche per un worker."""
+    # `size` è la dimensione non compressa dall'indice degli output (decide lo ZIP64); se manca si
+    # assume il caso peggiore.
+    entries = [
+        ZipEntry(arcname=filename, blocks=partial(iter_gzip_file, stored_path), size=item.get("size", zipfile.ZIP64_LIMIT))
+        for (filename, stored_path), item in zip(JOB_STORE.list_outputs(job), job['meta'].get("outputs", []))
+    ]
+    entries.extend(collect_attachment_entries(job['meta'].get("attachments", [])))
+    return entries
+
+async def prebuild_archive(job_id: str) -> None:
+    """
+    Prepara l'archivio ZIP di un job appena completato nel pool di processi, così il primo
+    download non comprime nulla (e la compressione non occupa i thread del server).
+    """
+    job = await asyncio.to_thread(JOB_STORE.get, job_id)
+    if job is None or not needs_archive(job):
+        return
+    try:
+        with stage_timer("zip_build"):
+            entries = await asyncio.to_thread(archive_entries, job)
+            await CPU_POOL.run(write_archive, entries, JOB_STORE.archive_path(job_id))
+    except Exception as e:
+        logger.error(f"Job {job_id}: preparazione dell'archivio ZIP fallita, verrà generato al download: {e}", exc_info=True)
+
+async def universal_background_processor_async(job_id: str, request: MultiProcessRequest, resume: bool = False):
+    """
+    Esegue il job. Con `resume` riusa i checkpoint delle unità già riuscite
+    e rielabora solo quelle fallite o mai completate.
+    """
+    logger.info(f"Job {job_id}: Inizio Universal Processing per {len(request.files_to_process)} file (ripresa: {resume}).")
+    completed_by_file: Dict[int, Dict] = {}
+    if resume:
+        for file_idx in range(len(request.files_to_process)):
+            completed_by_file[file_idx] = await asyncio.to_thread(JOB_STORE.completed_units, job_id, file_idx)
+    already_done = sum(len(completed) for completed in completed_by_file.values())
+    if not await set_job_status(job_id, 'processing', from_statuses=("pending",)):
+        # Annullato mentre era ancora in attesa (es. durante il caricamento dei checkpoint):
+        # nessuna chiamata LLM deve partire.
+        logger.info(f"Job {job_id}: annullato prima dell'avvio.")
+        return
+    # Con `include_timings` i tempi per fase del job finiscono nel campo `progress` di /status.
+    timings = track_job(job_id) if request.include_timings else None
+    dedup_stats = DedupStats()
+    progress = JobProgress(count_llm_units(request) - already_done, timings=timings, dedup=dedup_stats)
+    job_context = current_job_id.set(job_id)
+    await asyncio.to_thread(JOB_STORE.update_progress, job_id, progress.as_dict())
     try:
-        processed_outputs: Dict[str, bytes] = {}
+        # Contenuto di ogni output: i byte, o il file su disco in cui è stato scritto man mano.
+        processed_outputs: Dict[str, bytes | Path] = {}
         attachment_paths: List[str] = []
 
         if getattr(request, 'save_chunks_mode', False):
@@ -50,7 +267,11 @@ async def universal_background_processor_async(job_id: str, request: MultiProces
                     attachment_paths.append(file_task.attachment_path)  # type: ignore[arg-type]
         else:
             tasks = []
-            for file_task in request.files_to_process:
+            job_options = replace(
+                PROCESSING_OPTIONS, job_id=job_id, priority=request.priority, bypass_cache=request.bypass_cache,
+                batch_mode=request.batch_mode, dedup_stats=dedup_stats
+            )
+            for file_idx, file_task in enumerate(request.files_to_process):
                 if file_task.prompts:
                     task = process_chunks_async(
                         chunks=file_task.chunks,
@@ -58,7 +279,14 @@ async def universal_background_processor_async(job_id: str, request: MultiProces
                         prompts=OrderedDict(file_task.prompts),
                         model_config=file_task.llm_config.dict(),
                         order_mode=file_task.order_mode,
-                        google_api_key=settings.google_api_key
+                        google_api_key=settings.google_api_key,
+                        options=replace(
+                            job_options,
+                            on_result=make_progress_callback(job_id, file_idx, file_task.file_name, progress),
+                            completed_results=completed_by_file.get(file_idx),
+                            token_estimator=TOKEN_ESTIMATORS.for_model(file_task.llm_config.model_name),
+                            output_path=JOB_STORE.partial_output_path(job_id, file_idx)
+                        )
                     )
                     tasks.append(task)
                 else:
@@ -72,134 +300,550 @@ async def universal_background_processor_async(job_id: str, request: MultiProces
             if tasks:
                 results = await asyncio.gather(*tasks)
                 for output_filename, output_content in results:
-                    processed_outputs[output_filename] = output_content.encode('utf-8')
+                    if isinstance(output_content, Path):
+                        processed_outputs[output_filename] = output_content
+                    else:
+                        processed_outputs[output_filename] = output_content.encode('utf-8')
 
-        JOBS[job_id]['status'] = 'completed'
-        JOBS[job_id]['result'] = {
-            "markdown": processed_outputs,
-            "attachments": attachment_paths
-        }
+        with stage_timer("save_outputs"):
+            await asyncio.to_thread(JOB_STORE.save_outputs, job_id, processed_outputs)
+        await asyncio.to_thread(JOB_STORE.update_meta, job_id, attachments=attachment_paths, saved_calls=dedup_stats.as_dict())
+        await asyncio.to_thread(JOB_STORE.update_progress, job_id, progress.as_dict())
+        await set_job_status(job_id, 'completed')
         logger.info(f"Job {job_id}: Universal Processing completato.")
+        if CPU_POOL.enabled and CPU_POOL_CONFIG.get("prebuild_archives", True):
+            await prebuild_archive(job_id)
 
+    except JobCancelledError:
+        logger.info(f"Job {job_id}: annullato.")
+        # Di solito lo stato è già stato aggiornato da DELETE /jobs/{job_id}.
+        if (await asyncio.to_thread(JOB_STORE.get, job_id))['status'] in ACTIVE_STATUSES:
+            await set_job_status(job_id, 'cancelled', "Job annullato dall'utente.")
     except Exception as e:
         logger.error(f"Job {job_id}: ERRORE CRITICO. Dettagli: {e}", exc_info=True)
-        JOBS[job_id]['status'] = 'failed'
-        JOBS[job_id]['detail'] = f"Errore durante il processamento: {type(e).__name__}"
+        await set_job_status(job_id, 'failed', f"Errore durante il processamento: {type(e).__name__}")
+    finally:
+        SCHEDULER.release(job_id)
+        forget_job(job_id)
+        current_job_id.reset(job_context)
+
+
+async def heartbeat_jobs_periodically():
+    """Tiene in vita i job di questo processo: solo quelli di un processo morto vengono marcati come falliti."""
+    while True:
+        try:
+            await asyncio.to_thread(JOB_STORE.heartbeat)
+        except Exception as e:
+            logger.error(f"Errore durante l'heartbeat dei job: {e}", exc_info=True)
+        await asyncio.sleep(JOB_STORE_HEARTBEAT_INTERVAL)
 
+async def evict_expired_jobs_periodically():
+    """Elimina a intervalli regolari i job scaduti e le cartelle allegati orfane."""
+    while True:
+        try:
+            for job_id, version in await asyncio.to_thread(JOB_STORE.fail_stale):
+                await JOB_EVENTS.publish(job_id, "status", version, {"status": "failed", "detail": STALE_JOB_DETAIL})
+            expired = await asyncio.to_thread(JOB_STORE.evict_expired)
+            for job_id in expired:
+                JOB_EVENTS.forget(job_id)
+            # Le cartelle ancora elencate negli allegati di un job restano finché il job esiste.
+            referenced = await asyncio.to_thread(JOB_STORE.referenced_attachments)
+            await asyncio.to_thread(cleanup_attachment_dirs, JOB_STORE.ttl_seconds, referenced)
+            # Immagini non più collegate a nessun job né alla cache OCR.
+            await asyncio.to_thread(BLOB_STORE.collect_garbage)
+        except Exception as e:
+            logger.error(f"Errore durante la pulizia dei job scaduti: {e}", exc_info=True)
+        await asyncio.sleep(JOB_STORE_EVICTION_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    heartbeat_task = asyncio.create_task(heartbeat_jobs_periodically())
+    eviction_task = asyncio.create_task(evict_expired_jobs_periodically())
+    # I worker del pool CPU si avviano in background: il server accetta subito le richieste.
+    warm_task = asyncio.create_task(CPU_POOL.warm())
+    yield
+    heartbeat_task.cancel()
+    eviction_task.cancel()
+    warm_task.cancel()
+    CPU_POOL.shutdown()
 
 # API Endpoints
-app = FastAPI(title="TextFlow V3 - Universal Control API")
+app = FastAPI(title="TextFlow V3 - Universal Control API", lifespan=lifespan)
+
+def build_splitter(max_words: int, min_words: int, max_tokens: int | None, min_tokens: int | None, model_name: str | None) -> SplitterSpec:
+    """
+    Configurazione dello splitter dai parametri del form e da `chunking_config` di config.json,
+    in forma serializzabile per i worker del pool CPU.
+    """
+    chunking_config = ChunkingConfig(
+        max_words=max_words, min_words=min_words, max_tokens=max_tokens, min_tokens=min_tokens,
+        model_name=model_name or app_config.get("model_config", {}).get("model_name")
+    )
+    # Le opzioni non esposte nel form (es. sentence_splitter) arrivano da config.json.
+    spec = SplitterSpec.from_config(
+        {**app_config.get("chunking_config", {}), **chunking_config.dict(exclude_none=True)},
+        token_estimator=TOKEN_ESTIMATORS.for_model(chunking_config.model_name)
+    )
+    spec.build()  # Una configurazione non valida fallisce qui, non nel worker.
+    return spec
+
+async def chunk_upload(file: UploadFile, splitter_spec: SplitterSpec, normalize_text_flag: bool, request_id: str) -> ChunkingResponse:
+    """
+    OCR (per i PDF) o decodifica, normalizzazione e chunking di un singolo file.
+    I file di testo vengono letti a blocchi dallo spool su disco di Starlette e decodificati
+    in modo incrementale; normalizzazione e chunking girano nel pool CPU (in un thread per
+    gli input piccoli), così i file di un upload multiplo usano core diversi.
+    """
+    file_name = file.filename
+    logger.info(f"Chunking in corso per: {file_name}")
+    attachment_path = None
+
+    if Path(file_name).suffix.lower() == '.pdf':
+        with stage_timer("upload_read"):
+            pdf_bytes = await file.read()
+        content_str, attachment_path_obj = await process_pdf_to_markdown_async(
+            pdf_bytes=pdf_bytes,
+            file_name=file_name,
+            job_id=request_id,
+            mistral_api_key=settings.mistral_api_key,
+            ocr_cache=OCR_CACHE,
+            executor=OCR_EXECUTOR,
+            options=OCR_OPTIONS,
+            provider_factory=OCR_PROVIDER_FACTORY
+        )
+        attachment_path = str(attachment_path_obj)
+        chunks, timings = await CPU_POOL.split_text(content_str, normalize_text_flag, splitter_spec)
+    else:
+        # Lettura e normalizzazione avvengono nella stessa passata: con la normalizzazione
+        # attiva la fase misurata è "normalize" (lettura inclusa).
+        try:
+            chunks, timings = await CPU_POOL.split_upload(file.file, file.size, normalize_text_flag, splitter_spec)
+        except UnicodeDecodeError:
+            ERRORS.inc(stage="upload_read", kind="UnicodeDecodeError")
+            raise HTTPException(status_code=400, detail=f"Impossibile decodificare il file '{file_name}' come UTF-8.")
+
+    for stage, seconds in timings.items():
+        observe_stage(stage, seconds)
+    return ChunkingResponse(file_name=file_name, chunks=chunks, attachment_path=attachment_path)
 
 @app.post("/chunk", tags=["1. Chunking"], response_model=List[ChunkingResponse])
 async def chunk_files(
     files: List[UploadFile] = File(...),
     max_words: int = Form(1000),
     min_words: int = Form(300),
-    normalize_text_flag: bool = Form(True)
+    normalize_text_flag: bool = Form(True),
+    max_tokens: int | None = Form(None),
+    min_tokens: int | None = Form(None),
+    model_name: str | None = Form(None)
 ):
     if not files:
         raise HTTPException(status_code=400, detail="Nessun file fornito.")
-    
-    responses = []
-    chunking_config = ChunkingConfig(max_words=max_words, min_words=min_words)
-    splitter = get_splitter(chunking_config.dict())
-    
+
+    splitter_spec = build_splitter(max_words, min_words, max_tokens, min_tokens, model_name)
     # ID unico per questa richiesta di chunking per raggruppare gli allegati
     request_id = str(uuid.uuid4())
 
-    for file in files:
-        file_bytes = await file.read()
-        file_name = file.filename
-        logger.info(f"Chunking in corso per: {file_name}")
+    # Tutti i file della richiesta vengono processati in concorrenza; l'ordine delle risposte
+    # resta quello dell'upload. L'OCR è limitato dal numero di worker di OCR_EXECUTOR.
+    # Il primo file che fallisce annulla gli altri: nessun OCR o chunking prosegue dopo la
+    # risposta d'errore e gli allegati già estratti vengono eliminati.
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(chunk_upload(file, splitter_spec, normalize_text_flag, request_id)) for file in files]
+    except BaseException as error:
+        await asyncio.to_thread(remove_request_attachments, request_id)
+        if isinstance(error, BaseExceptionGroup):
+            raise error.exceptions[0] from None
+        raise
+    return [task.result() for task in tasks]
 
-        content_str = ""
-        attachment_path = None
+@app.post("/chunk/stream", tags=["1. Chunking"])
+async def chunk_files_stream(
+    files: List[UploadFile] = File(...),
+    max_words: int = Form(1000),
+    min_words: int = Form(300),
+    normalize_text_flag: bool = Form(True),
+    max_tokens: int | None = Form(None),
+    min_tokens: int | None = Form(None),
+    model_name: str | None = Form(None)
+):
+    """
+    Come /chunk, ma risponde in NDJSON: una riga per file appena il suo chunking è concluso
+    (in ordine di completamento, con `file_index` = posizione nell'upload). Un file che
+    non si riesce a processare produce una riga con `error` invece dei chunk.
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="Nessun file fornito.")
 
-        if Path(file_name).suffix.lower() == '.pdf':
-            content_str, attachment_path_obj = process_pdf_to_markdown(
-                pdf_bytes=file_bytes, 
-                file_name=file_name, 
-                job_id=request_id, 
-                mistral_api_key=settings.mistral_api_key
-            )
-            attachment_path = str(attachment_path_obj)
-        else:
-            try:
-                content_str = file_bytes.decode("utf-8")
-            except UnicodeDecodeError:
-                raise HTTPException(status_code=400, detail=f"Impossibile decodificare il file '{file_name}' come UTF-8.")
+    splitter_spec = build_splitter(max_words, min_words, max_tokens, min_tokens, model_name)
+    request_id = str(uuid.uuid4())
 
-        if normalize_text_flag:
-            content_str = normalize_text(content_str)
+    async def chunk_indexed(file_index: int, file: UploadFile) -> Dict:
+        try:
+            response = await chunk_upload(file, splitter_spec, normalize_text_flag, request_id)
+            return {"file_index": file_index, **response.model_dump()}
+        except HTTPException as e:
+            return {"file_index": file_index, "file_name": file.filename, "error": e.detail}
+        except Exception as e:
+            logger.error(f"Chunking di '{file.filename}' fallito: {e}", exc_info=True)
+            return {"file_index": file_index, "file_name": file.filename, "error": f"Errore durante il chunking: {type(e).__name__}"}
 
-        chunks = splitter.split(content_str)
-        responses.append(ChunkingResponse(file_name=file_name, chunks=chunks, attachment_path=attachment_path))
+    async def ndjson_lines():
+        tasks = [asyncio.create_task(chunk_indexed(index, file)) for index, file in enumerate(files)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done, ensure_ascii=False) + "\n"
+        finally:
+            # Client disconnesso: i file non ancora conclusi non servono più.
+            for task in tasks:
+                task.cancel()
 
-    return responses
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+def validate_process_request(request: MultiProcessRequest) -> None:
+    if not request.files_to_process:
+        raise HTTPException(status_code=400, detail="La lista dei file da processare è vuota.")
+    # Template compilati e validati una volta per job: un prompt non valido non diventa un job fallito.
+    for file_task in request.files_to_process:
+        for prompt_name, prompt_text in (file_task.prompts or {}).items():
+            try:
+                compile_prompt(prompt_text)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Prompt '{prompt_name}' di '{file_task.file_name}': {e}")
 
 @app.post("/process", tags=["2. Processing"], status_code=202)
 async def start_universal_processing_job(
     background_tasks: BackgroundTasks,
     request: MultiProcessRequest
 ):
-    if not request.files_to_process:
-        raise HTTPException(status_code=400, detail="La lista dei file da processare è vuota.")
+    validate_process_request(request)
 
     job_id = str(uuid.uuid4())
-    JOBS[job_id] = {"status": "pending", "detail": f"Job creato per {len(request.files_to_process)} file.", "request_save_chunks_mode": getattr(request, 'save_chunks_mode', False)}
+    await asyncio.to_thread(
+        JOB_STORE.create, job_id,
+        detail=f"Job creato per {len(request.files_to_process)} file.",
+        # Gli allegati sono registrati subito: la pulizia periodica non li elimina mentre il job esiste.
+        meta={"save_chunks_mode": getattr(request, 'save_chunks_mode', False), "attachments": request_attachments(request)}
+    )
+    # La richiesta resta su disco per poter riprendere il job con POST /jobs/{job_id}/resume.
+    await asyncio.to_thread(JOB_STORE.save_request, job_id, request.model_dump_json())
     background_tasks.add_task(universal_background_processor_async, job_id, request)
     logger.info(f"Nuovo job universale creato con ID: {job_id}")
     return {"job_id": job_id, "status": "pending"}
 
+@app.post("/jobs/{job_id}/resume", tags=["2. Processing"], status_code=202)
+async def resume_job(background_tasks: BackgroundTasks, job_id: str):
+    """
+    Riprende un job terminato (fallito, annullato o completato con chunk in errore):
+    vengono rielaborate solo le unità (chunk, prompt) senza un risultato valido, mentre
+    le altre vengono riprese dai checkpoint. Gli output sono ricompilati per intero.
+    """
+    job = await asyncio.to_thread(JOB_STORE.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job ID non trovato.")
+    if job['status'] in ACTIVE_STATUSES:
+        raise HTTPException(status_code=409, detail="Il job è ancora in esecuzione.")
+    if job['meta'].get('save_chunks_mode'):
+        raise HTTPException(status_code=400, detail="Un job in save_chunks_mode non ha chiamate da riprendere.")
+
+    request_json = await asyncio.to_thread(JOB_STORE.load_request, job_id)
+    if request_json is None:
+        raise HTTPException(status_code=400, detail="Richiesta originale non disponibile: impossibile riprendere il job.")
+    request = MultiProcessRequest.model_validate_json(request_json)
+
+    units = await asyncio.to_thread(JOB_STORE.count_units, job_id)
+    remaining_units = count_llm_units(request) - (units['saved'] - units['failed'])
+    if job['status'] == 'completed' and remaining_units <= 0:
+        raise HTTPException(status_code=409, detail="Il job è già completo: non ci sono unità da rielaborare.")
+
+    if not await set_job_status(job_id, 'pending', "Ripresa del job in corso.", from_statuses=FINISHED_STATUSES):
+        raise HTTPException(status_code=409, detail="Il job è stato ripreso da un'altra richiesta.")
+    # L'archivio ZIP già generato non corrisponde più ai nuovi output.
+    await asyncio.to_thread(JOB_STORE.archive_path(job_id).unlink, missing_ok=True)
+    background_tasks.add_task(universal_background_processor_async, job_id, request, True)
+    logger.info(f"Job {job_id}: ripresa con {remaining_units} unità da rielaborare.")
+    return {"job_id": job_id, "status": "pending", "units_to_process": remaining_units}
+
+@app.post("/jobs/{job_id}/revise", tags=["2. Processing"], status_code=202)
+async def revise_job(background_tasks: BackgroundTasks, job_id: str, request: MultiProcessRequest):
+    """
+    Crea una revisione di un job terminato a partire dalla richiesta aggiornata (es. dopo aver
+    corretto alcuni chunk nell'editor): le unità (chunk, prompt) con lo stesso contenuto del job
+    padre ne riprendono il risultato, e l'LLM viene chiamato solo per quelle nuove o modificate.
+    Il job padre resta invariato; la revisione ha un nuovo job_id.
+    """
+    parent = await asyncio.to_thread(JOB_STORE.get, job_id)
+    if not parent:
+        raise HTTPException(status_code=404, detail="Job ID non trovato.")
+    if parent['status'] in ACTIVE_STATUSES:
+        raise HTTPException(status_code=409, detail="Il job è ancora in esecuzione.")
+    validate_process_request(request)
+
+    parent_json = await asyncio.to_thread(JOB_STORE.load_request, job_id)
+    if parent_json is None:
+        raise HTTPException(status_code=400, detail="Richiesta originale non disponibile: impossibile creare una revisione.")
+    parent_request = MultiProcessRequest.model_validate_json(parent_json)
+    reusable = {}
+    if not request.save_chunks_mode and not parent_request.save_chunks_mode:
+        reusable = await asyncio.to_thread(collect_reusable_results, job_id, parent_request, request)
+    units_reused = sum(len(results) for results in reusable.values())
+
+    revision_id = str(uuid.uuid4())
+    await asyncio.to_thread(
+        JOB_STORE.create, revision_id,
+        detail=f"Revisione del job {job_id}: {units_reused} unità riprese.",
+        meta={"save_chunks_mode": request.save_chunks_mode, "parent_job_id": job_id, "attachments": request_attachments(request)}
+    )
+    await asyncio.to_thread(JOB_STORE.save_request, revision_id, request.model_dump_json())
+    # I risultati ripresi diventano checkpoint della revisione: il job parte come una ripresa.
+    for file_idx, results in reusable.items():
+        if results:
+            await asyncio.to_thread(JOB_STORE.save_units, revision_id, file_idx, results)
+    background_tasks.add_task(universal_background_processor_async, revision_id, request, True)
+    units_to_process = count_llm_units(request) - units_reused
+    logger.info(f"Job {revision_id}: revisione di {job_id}, {units_reused} unità riprese e {units_to_process} da elaborare.")
+    return {
+        "job_id": revision_id,
+        "parent_job_id": job_id,
+        "status": "pending",
+        "units_reused": units_reused,
+        "units_to_process": units_to_process,
+    }
+
+def job_status_payload(job: Dict) -> Dict:
+    payload = {"job_id": job['job_id'], "status": job['status'], "detail": job['detail']}
+    if job['progress']:
+        payload["progress"] = job['progress']
+    return payload
+
+def job_etag(job: Dict) -> str:
+    return f'W/"{job["job_id"]}-{job["version"]}"'
+
+async def wait_for_job_change(job_id: str, since_version: int, timeout: float) -> None:
+    """
+    Attende che la versione del job superi `since_version`. Gli eventi dello stesso processo
+    svegliano subito l'attesa; per i job eseguiti da un altro worker si ricontrolla lo store.
+    """
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+        if await asyncio.to_thread(JOB_STORE.version, job_id) > since_version:
+            return
+        await JOB_EVENTS.wait_for_event(job_id, min(remaining, 1.0))
+
+@app.get("/jobs/{job_id}/events", tags=["3. Results"])
+async def stream_job_events(job_id: str):
+    """
+    Stream Server-Sent Events con l'avanzamento del job: un evento `progress` per ogni
+    (file, chunk, prompt) completato, con contatori, ETA e il markdown parziale,
+    e un evento `status` a ogni cambio di stato. Lo stream si chiude a job terminato.
+    Se il job gira su un altro worker arrivano solo snapshot periodici dello stato.
+    """
+    job = await asyncio.to_thread(JOB_STORE.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job ID non trovato.")
+
+    def format_sse(event: Dict) -> str:
+        return f"event: {event['type']}\nid: {event['version']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    async def event_generator():
+        # Ci iscriviamo prima di leggere lo stato, così non perdiamo eventi intermedi.
+        subscription = JOB_EVENTS.subscribe(job_id)
+        try:
+            current = await asyncio.to_thread(JOB_STORE.get, job_id)
+            last_version = current['version']
+            yield format_sse({"type": "snapshot", **job_status_payload(current), "version": last_version})
+            if current['status'] in TERMINAL_STATUSES:
+                return
+            idle_seconds = 0.0
+            while True:
+                event = await subscription.next_event(timeout=1.0)
+                if event is not None:
+                    idle_seconds = 0.0
+                    last_version = max(last_version, event["version"])
+                    yield format_sse(event)
+                    if event["type"] == "status" and event.get("status") in TERMINAL_STATUSES:
+                        return
+                    continue
+
+                current = await asyncio.to_thread(JOB_STORE.get, job_id)
+                if current is None:
+                    return
+                if current['version'] > last_version:
+                    last_version = current['version']
+                    yield format_sse({"type": "snapshot", **job_status_payload(current), "version": last_version})
+                    if current['status'] in TERMINAL_STATUSES:
+                        return
+                    idle_seconds = 0.0
+                    continue
+
+                idle_seconds += 1.0
+                if idle_seconds >= 15:
+                    # Commento SSE usato come heartbeat per tenere aperta la connessione.
+                    idle_seconds = 0.0
+                    yield ": keep-alive\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/results/{job_id}", tags=["3. Results"])
-async def get_job_results(job_id: str):
-    job = JOBS.get(job_id)
+async def get_job_results(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=60, description="Long-poll: secondi di attesa di un cambiamento del job."),
+    if_none_match: str | None = Header(None)
+):
+    job = await asyncio.to_thread(JOB_STORE.get, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job ID non trovato.")
 
     status = job['status']
     if status in ["pending", "processing"]:
-        return JSONResponse(content={"job_id": job_id, "status": status, "detail": job.get('detail')})
+        if wait and if_none_match == job_etag(job):
+            await wait_for_job_change(job_id, job['version'], wait)
+            job = await asyncio.to_thread(JOB_STORE.get, job_id)
+            status = job['status']
+        if status in ["pending", "processing"]:
+            etag = job_etag(job)
+            if if_none_match == etag:
+                return Response(status_code=304, headers={"ETag": etag})
+            return JSONResponse(content=job_status_payload(job), headers={"ETag": etag})
 
     if status == "failed":
-        raise HTTPException(status_code=500, detail=job.get('detail', 'Job fallito senza dettagli.'))
+        raise HTTPException(status_code=500, detail=job.get('detail') or 'Job fallito senza dettagli.')
 
-    job_result = job.get('result')
-    if not job_result:
-        raise HTTPException(status_code=500, detail="Job completato ma senza risultati.")
+    if status == "cancelled":
+        raise HTTPException(status_code=409, detail=job.get('detail') or 'Job annullato.')
 
-    processed_outputs = job_result.get("markdown", {})
-    attachment_paths = job_result.get("attachments", [])
+    processed_outputs = JOB_STORE.list_outputs(job)
+    attachment_paths = job['meta'].get("attachments", [])
+    if not processed_outputs and not attachment_paths:
+        raise HTTPException(status_code=500, detail="Job completato ma senza risultati.")
 
     # Se c'è un solo file markdown e nessun allegato, restituisci solo il markdown (solo se non in save_chunks_mode)
-    if len(processed_outputs) == 1 and not attachment_paths and not JOBS[job_id].get('request_save_chunks_mode'):
-        filename, content = list(processed_outputs.items())[0]
-        return StreamingResponse(BytesIO(content), media_type="text/markdown", headers={"Content-Disposition": f"attachment; filename=\"{filename}\""})
+    if len(processed_outputs) == 1 and not attachment_paths and not job['meta'].get('save_chunks_mode'):
+        filename, stored_path = processed_outputs[0]
+        return StreamingResponse(JOB_STORE.iter_output(stored_path), media_type="text/markdown", headers={"Content-Disposition": f"attachment; filename=\"{filename}\""})
     
     # Altrimenti, crea sempre uno ZIP
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        # Aggiungi i file markdown
-        for filename, content in processed_outputs.items():
-            zf.writestr(filename, content)
-        
-        # Aggiungi gli allegati
-        if attachment_paths:
-            allegati_root = Path("Allegati")
-            for path_str in attachment_paths:
-                path = Path(path_str)
-                if path.is_dir():
-                    for file_path in path.rglob('*'):
-                        if file_path.is_file():
-                            # Crea il percorso relativo per lo zip
-                            arcname = allegati_root / path.name / file_path.name
-                            zf.write(file_path, arcname=str(arcname))
-    
-    zip_buffer.seek(0)
-    
-    # Pulizia delle cartelle temporanee degli allegati per questo job
-    unique_job_ids = {Path(p).parts[-2] for p in attachment_paths if len(Path(p).parts) > 1}
-    for req_id in unique_job_ids:
-        shutil.rmtree(TEMP_ATTACHMENT_DIR / req_id, ignore_errors=True)
+    zip_headers = {"Content-Disposition": "attachment; filename=\"processed_documents.zip\""}
+    archive_path = JOB_STORE.archive_path(job_id)
+    if await asyncio.to_thread(archive_path.exists):
+        return FileResponse(archive_path, media_type="application/zip", headers=zip_headers)
+
+    # Elencare gli allegati tocca il disco: fuori dall'event loop.
+    entries = await asyncio.to_thread(archive_entries, job)
+
+    def stream_archive():
+        # Il primo download comprime e trasmette le voci una alla volta; intanto l'archivio
+        # viene salvato nello store, così i download successivi non devono rigenerarlo.
+        spool = ArchiveSpool(archive_path, ZIP_SPILL_THRESHOLD)
+        completed = False
+        try:
+            for block in timed_iter(iter_zip(entries), "zip_build"):
+                spool.write(block)
+                yield block
+            spool.finish()
+            completed = True
+        finally:
+            if not completed:
+                spool.discard()
+
+    return StreamingResponse(stream_archive(), media_type="application/zip", headers=zip_headers)
+
+@app.get("/results/{job_id}/partial", tags=["3. Results"])
+async def get_partial_results(job_id: str, file_index: int = Query(0, ge=0, description="Posizione del file in `files_to_process`.")):
+    """
+    Markdown già composto di un file mentre il job è in corso: i risultati vengono scritti
+    nell'ordine finale (`order_mode`) appena è completo tutto ciò che li precede. Disponibile
+    anche per i job falliti o annullati; a job completato va usato /results.
+    """
+    job = await asyncio.to_thread(JOB_STORE.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job ID non trovato.")
+
+    def open_partial():
+        # Il file aperto resta leggibile anche se nel frattempo il job si completa e lo elimina.
+        opened = open(JOB_STORE.partial_output_path(job_id, file_index), "rb")
+        # Si invia solo la parte già scritta al momento della richiesta.
+        return opened, os.fstat(opened.fileno()).st_size
+
+    try:
+        # Apertura e fstat toccano il disco: fuori dall'event loop.
+        partial_file, size = await asyncio.to_thread(open_partial)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Nessun output parziale per questo file (job non avviato, già completato o file senza prompt).")
+
+    def iter_prefix():
+        remaining = size
+        with partial_file:
+            while remaining > 0 and (block := partial_file.read(min(256 * 1024, remaining))):
+                remaining -= len(block)
+                yield block
+
+    return StreamingResponse(
+        iter_prefix(), media_type="text/markdown; charset=utf-8",
+        headers={"Content-Length": str(size), "X-Job-Status": job['status']}
+    )
+
+@app.delete("/jobs/{job_id}", tags=["3. Results"])
+async def delete_job(job_id: str):
+    """
+    Annulla un job in corso: le chiamate LLM in coda e quelle già partite vengono interrotte
+    subito. Se il job è già terminato, ne elimina i risultati.
+    """
+    job = await asyncio.to_thread(JOB_STORE.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job ID non trovato.")
+
+    if job['status'] in ACTIVE_STATUSES:
+        await set_job_status(job_id, 'cancelled', "Job annullato dall'utente.")
+        # Se il job gira su un altro worker, se ne accorgerà al prossimo aggiornamento di avanzamento.
+        SCHEDULER.cancel(job_id)
+        return {"job_id": job_id, "status": "cancelled"}
+
+    await asyncio.to_thread(JOB_STORE.delete, job_id)
+    JOB_EVENTS.forget(job_id)
+    return {"job_id": job_id, "status": "deleted"}
+
+@app.get("/metrics", tags=["4. Monitoring"])
+async def get_metrics():
+    """Metriche in formato testo Prometheus: durata delle fasi, chiamate in corso, job per stato, errori e retry."""
+    counts = await asyncio.to_thread(JOB_STORE.count_by_status)
+    # Gli stati senza job non compaiono nel GROUP BY: vanno riportati a zero esplicitamente.
+    for status in ACTIVE_STATUSES + FINISHED_STATUSES:
+        JOBS.set(counts.get(status, 0), status=status)
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/stats/jobs", tags=["4. Monitoring"])
+async def get_job_stats():
+    """Numero di job nello store per stato, occupazione dello scheduler e del pool CPU."""
+    return {"jobs": await asyncio.to_thread(JOB_STORE.count_by_status), "scheduler": SCHEDULER.stats(), "cpu_pool": CPU_POOL.stats()}
+
+@app.get("/stats/rate-limits", tags=["4. Monitoring"])
+async def get_rate_limit_stats():
+    """Stato corrente del rate limiter: RPM effettivo, 429 ricevuti e attesa media in coda."""
+    return RATE_LIMITER.stats()
+
+@app.get("/stats/api-keys", tags=["4. Monitoring"])
+async def get_api_key_stats():
+    """Utilizzo per API key: richieste, errori di quota, passaggi a un'altra key o modello."""
+    return LLM_ROUTER.stats()
+
+@app.get("/stats/llm-clients", tags=["4. Monitoring"])
+async def get_llm_client_stats():
+    """Client LLM nel pool condiviso: creazioni, riusi e latenza di creazione risparmiata."""
+    return LLM_POOL.stats()
 
-    return StreamingResponse(zip_buffer, media_type="application/zip", headers={"Content-Disposition": "attachment; filename=\"processed_documents.zip\""})
+@app.get("/stats/cache", tags=["4. Monitoring"])
+async def get_cache_stats():
+    """Contatori hit/miss e occupazione delle cache (risposte LLM e risultati OCR), dell'archivio immagini e delle richieste LLM condivise tra job."""
+    return {
+        "llm": {"enabled": True, **LLM_CACHE.stats()} if LLM_CACHE else {"enabled": False},
+        "ocr": {"enabled": True, **OCR_CACHE.stats()} if OCR_CACHE else {"enabled": False},
+        "attachments": await asyncio.to_thread(BLOB_STORE.stats),
+        "in_flight_requests": IN_FLIGHT_REQUESTS.stats() if IN_FLIGHT_REQUESTS else {"enabled": False},
+    }
@@ -5,11 +5,20 @@ class LLMConfig(BaseModel):
     """Configurazione per il Large Language Model."""
     model_name: str = Field(default="models/gemini-1.5-flash-latest")
     temperature: float = Field(default=0.7, ge=0.0, le=1.0)
+    # Modelli da usare, nell'ordine, quando il modello principale ha esaurito la quota
+    # su tutte le API key. Se vuota si usano quelli di `llm_routing` in config.json.
+    fallback_models: List[str] = Field(default_factory=list)
 
 class ChunkingConfig(BaseModel):
-    """Configurazione per la strategia di divisione del testo."""
+    """
+    Configurazione per la strategia di divisione del testo.
+    Con `max_tokens` i limiti diventano token stimati per `model_name` invece di parole.
+    """
     max_words: int = Field(default=1000, gt=0)
     min_words: int = Field(default=300, gt=0)
+    max_tokens: Optional[int] = Field(default=None, gt=0)
+    min_tokens: Optional[int] = Field(default=None, ge=0)
+    model_name: Optional[str] = None
 
 class ProcessChunksRequest(BaseModel):
     """
@@ -31,6 +40,16 @@ class MultiProcessRequest(BaseModel):
     """
     files_to_process: List[ProcessChunksRequest]
     save_chunks_mode: bool = False
+    # Ignora le risposte in cache e richiama sempre l'LLM (la cache viene comunque aggiornata).
+    bypass_cache: bool = False
+    # "interactive" per l'utente in attesa davanti alla UI, "bulk" per le elaborazioni massive.
+    priority: Literal["interactive", "bulk"] = "interactive"
+    # Raggruppa più richieste in una: "prompts" = tutti i prompt di un chunk insieme,
+    # "chunks" = più chunk brevi con lo stesso prompt. Le risposte non estratte vengono
+    # rielaborate singolarmente.
+    batch_mode: Literal["off", "prompts", "chunks"] = "off"
+    # Riporta nel progresso del job i tempi per fase (code, rate limiter, chiamate LLM, ...).
+    include_timings: bool = False
 
 class ChunkingResponse(BaseModel):
     """Il modello di risposta per un singolo file processato dall'endpoint di chunking."""
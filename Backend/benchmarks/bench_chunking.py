@@ -0,0 +1,112 @@
+"""
+Benchmark di `HierarchicalSplitter.split` su markdown sintetico (da 10 KB a 50 MB):
+misura tempo, throughput e picco di memoria (tracemalloc).
+
+Uso (dalla cartella Backend):
+    python -m benchmarks.bench_chunking
+    python -m benchmarks.bench_chunking --sizes 10KB 1MB --check-legacy
+    python -m benchmarks.bench_chunking --sentence-splitter native
+
+Con `--check-legacy` verifica che l'output coincida con quello dell'algoritmo originale
+(che è quadratico: conviene limitarlo a dimensioni fino a qualche MB).
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from typing import List
+
+from src.chunking_strategy import HierarchicalSplitter
+
+DEFAULT_SIZES = ["10KB", "100KB", "1MB", "10MB", "50MB"]
+WORDS = (
+    "analisi testo modello dati sistema processo risultato valore struttura metodo "
+    "funzione elemento relazione contesto esempio problema soluzione regola livello parte"
+).split()
+
+
+def parse_size(size: str) -> int:
+    units = {"KB": 1024, "MB": 1024 * 1024}
+    for suffix, factor in units.items():
+        if size.upper().endswith(suffix):
+            return int(float(size[:-len(suffix)]) * factor)
+    return int(size)
+
+
+def make_paragraph(rng: random.Random, num_words: int) -> str:
+    sentences = []
+    while num_words > 0:
+        length = min(num_words, rng.randint(8, 20))
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + ".")
+        num_words -= length
+    return " ".join(sentences)
+
+
+def make_markdown(target_bytes: int, seed: int = 42) -> str:
+    """
+    Markdown con molte sezioni piccole e annidate (il caso peggiore per l'aggregazione)
+    e, ogni tanto, una sezione lunga che richiede la divisione semantica.
+    """
+    rng = random.Random(seed)
+    parts: List[str] = []
+    size = 0
+    section = 0
+    while size < target_bytes:
+        section += 1
+        level = rng.choice((1, 2, 2, 3, 3, 3, 4))
+        words = rng.randint(1200, 2000) if section % 40 == 0 else rng.randint(5, 80)
+        part = f"{'#' * level} Sezione {section}\n\n{make_paragraph(rng, words)}\n\n"
+        parts.append(part)
+        size += len(part.encode("utf-8"))
+    return "".join(parts)
+
+
+def measure(splitter, text: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = splitter.split(text)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return chunks, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--max-words", type=int, default=1000)
+    parser.add_argument("--min-words", type=int, default=300)
+    parser.add_argument("--sentence-splitter", choices=["llama_index", "native"], default="llama_index")
+    parser.add_argument("--check-legacy", action="store_true", help="confronta l'output con l'algoritmo originale")
+    args = parser.parse_args()
+
+    splitter = HierarchicalSplitter(
+        max_words=args.max_words, min_words=args.min_words, sentence_splitter=args.sentence_splitter
+    )
+    legacy = None
+    if args.check_legacy:
+        from benchmarks.legacy_splitter import LegacyHierarchicalSplitter
+        legacy = LegacyHierarchicalSplitter(max_words=args.max_words, min_words=args.min_words)
+
+    # Riscaldamento: il primo uso del SentenceSplitter carica il tokenizer.
+    splitter.split(make_markdown(parse_size("20KB"), seed=0))
+
+    print(f"{'dimensione':>10} {'chunk':>7} {'tempo (s)':>10} {'MB/s':>8} {'picco MB':>9} {'legacy (s)':>11}")
+    for size in args.sizes:
+        text = make_markdown(parse_size(size))
+        megabytes = len(text.encode("utf-8")) / (1024 * 1024)
+        chunks, elapsed, peak = measure(splitter, text)
+        legacy_column = ""
+        if legacy is not None:
+            legacy_chunks, legacy_elapsed, _ = measure(legacy, text)
+            if legacy_chunks != chunks:
+                raise SystemExit(f"Output diverso dall'algoritmo originale per {size}!")
+            legacy_column = f"{legacy_elapsed:.3f}"
+        print(
+            f"{size:>10} {len(chunks):>7} {elapsed:>10.3f} {megabytes / elapsed:>8.2f} "
+            f"{peak / (1024 * 1024):>9.1f} {legacy_column:>11}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Benchmark end-to-end del flusso /chunk -> /process -> /results su un corpus sintetico
+(markdown e PDF), con i provider simulati (`src/fake_providers.py`): nessuna quota
+Gemini/Mistral consumata. Riporta job/minuto, latenza per job (p50/p95/p99, totale e
+per fase) e picco di memoria del processo.
+
+Di default avvia l'app in questo processo (uvicorn su una porta locale) con i provider
+"fake" e i parametri indicati; con `--url` pilota un server già avviato (in quel caso la
+configurazione dei provider è quella del server e la memoria non viene misurata).
+
+Uso (dalla cartella Backend):
+    python -m benchmarks.bench_end_to_end
+    python -m benchmarks.bench_end_to_end --jobs 50 --concurrency 8 --rpm 300 --rate-limit-rate 0.05
+    python -m benchmarks.bench_end_to_end --pdfs-per-job 1 --pdf-pages 20 --batch-mode prompts
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import resource
+import socket
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.bench_chunking import make_markdown, parse_size
+
+PROMPT_TEMPLATES = [
+    "Riassumi il testo seguente in italiano.\n\n{text_chunk}",
+    "Estrai i concetti chiave del testo seguente come elenco puntato.\n\n{text_chunk}",
+    "Scrivi tre domande di verifica sul testo seguente.\n\n{text_chunk}",
+    "Traduci in inglese il testo seguente.\n\n{text_chunk}",
+]
+
+
+def make_pdf(num_pages: int, title: str) -> bytes:
+    """PDF con pagine vuote: il contenuto lo genera l'OCR simulato."""
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    for _ in range(num_pages):
+        writer.add_blank_page(width=595, height=842)
+    writer.add_metadata({"/Title": title})
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentile con il metodo nearest-rank."""
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), round(q / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss è in KB su Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class JobRunner:
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.prompts = {f"prompt_{idx + 1}": PROMPT_TEMPLATES[idx % len(PROMPT_TEMPLATES)] for idx in range(args.prompts)}
+
+    def make_files(self, job_idx: int):
+        files = []
+        for file_idx in range(self.args.files_per_job):
+            text = make_markdown(self.args.file_size, seed=job_idx * 1000 + file_idx)
+            files.append(("files", (f"doc_{job_idx}_{file_idx}.md", text.encode("utf-8"), "text/markdown")))
+        for file_idx in range(self.args.pdfs_per_job):
+            pdf = make_pdf(self.args.pdf_pages, f"job {job_idx} pdf {file_idx}")
+            files.append(("files", (f"scan_{job_idx}_{file_idx}.pdf", pdf, "application/pdf")))
+        return files
+
+    async def run(self, job_idx: int) -> Dict:
+        start = time.perf_counter()
+        response = await self.client.post("/chunk", files=self.make_files(job_idx))
+        response.raise_for_status()
+        chunked = response.json()
+        chunked_at = time.perf_counter()
+
+        payload = {
+            "files_to_process": [
+                {
+                    "file_name": item["file_name"],
+                    "chunks": item["chunks"],
+                    "prompts": self.prompts,
+                    "llm_config": {"model_name": self.args.model},
+                    "attachment_path": item.get("attachment_path"),
+                }
+                for item in chunked
+            ],
+            "batch_mode": self.args.batch_mode,
+            "bypass_cache": True,
+        }
+        response = await self.client.post("/process", json=payload)
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        submitted_at = time.perf_counter()
+
+        etag: Optional[str] = None
+        while True:
+            headers = {"If-None-Match": etag} if etag else {}
+            response = await self.client.get(f"/results/{job_id}", params={"wait": 30}, headers=headers)
+            if response.status_code == 304:
+                continue
+            response.raise_for_status()
+            if response.headers.get("content-type", "").startswith("application/json"):
+                etag = response.headers.get("etag")
+                continue
+            break
+        finished_at = time.perf_counter()
+        return {
+            "total": finished_at - start,
+            "chunk": chunked_at - start,
+            "process": finished_at - submitted_at,
+            "chunks": sum(len(item["chunks"]) for item in chunked),
+            "result_bytes": len(response.content),
+        }
+
+
+async def run_benchmark(base_url: str, args: argparse.Namespace) -> None:
+    timeout = httpx.Timeout(120.0)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        runner = JobRunner(client, args)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        failures: List[str] = []
+
+        async def one(job_idx: int) -> Optional[Dict]:
+            async with semaphore:
+                try:
+                    return await runner.run(job_idx)
+                except Exception as e:
+                    failures.append(f"job {job_idx}: {e}")
+                    return None
+
+        start = time.perf_counter()
+        results = [r for r in await asyncio.gather(*(one(idx) for idx in range(args.jobs))) if r]
+        elapsed = time.perf_counter() - start
+
+    print(f"Job completati: {len(results)}/{args.jobs} in {elapsed:.1f}s "
+          f"({len(results) / elapsed * 60:.1f} job/min, concorrenza {args.concurrency})")
+    if results:
+        units = sum(r["chunks"] for r in results) * args.prompts
+        print(f"Unità LLM (chunk x prompt): {units} ({units / elapsed * 60:.0f}/min)")
+        for stage in ("total", "chunk", "process"):
+            values = [r[stage] for r in results]
+            print(
+                f"  {stage:8s} p50 {percentile(values, 50):7.2f}s  p95 {percentile(values, 95):7.2f}s  "
+                f"p99 {percentile(values, 99):7.2f}s  media {statistics.mean(values):7.2f}s"
+            )
+    for failure in failures[:10]:
+        print(f"  ERRORE {failure}")
+
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def configure_app(args: argparse.Namespace, work_dir: str) -> None:
+    """Configura l'app (prima dell'import di api.main) con i provider simulati e uno store temporaneo."""
+    os.environ.setdefault("GOOGLE_API_KEY", "fake-google-key")
+    os.environ.setdefault("MISTRAL_API_KEY", "fake-mistral-key")
+    from api.config import app_config
+    latency = {"distribution": args.latency_distribution, "mean_ms": args.llm_latency_ms, "stddev_ms": args.llm_stddev_ms}
+    app_config["providers"] = {
+        "llm": "fake",
+        "ocr": "fake",
+        "fake_llm": {
+            "latency": latency,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+            "quota_rpm": args.quota_rpm,
+            "seed": 1,
+        },
+        "fake_ocr": {"latency": {**latency, "mean_ms": args.ocr_latency_ms, "stddev_ms": args.ocr_latency_ms / 3}},
+    }
+    rate_limits = app_config.setdefault("rate_limits", {})
+    rate_limits["default"] = {**rate_limits.get("default", {}), "rpm": args.rpm}
+    rate_limits.pop("models", None)
+    app_config["llm_cache"] = {"enabled": False}
+    app_config["ocr_cache"] = {"enabled": False}
+    app_config["job_store"] = {**app_config.get("job_store", {}), "root_dir": os.path.join(work_dir, "jobs")}
+
+
+async def run_in_process(args: argparse.Namespace) -> None:
+    import uvicorn
+    with tempfile.TemporaryDirectory(prefix="textflow_bench_") as work_dir:
+        configure_app(args, work_dir)
+        from api.main import app
+
+        port = find_free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+        rss_before = peak_rss_mb()
+        try:
+            await run_benchmark(f"http://127.0.0.1:{port}", args)
+        finally:
+            server.should_exit = True
+            await server_task
+        print(f"Picco di memoria (RSS del processo): {peak_rss_mb():.0f} MB (all'avvio {rss_before:.0f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Server già avviato da pilotare (es. http://localhost:8000).")
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4, help="Job eseguiti in parallelo dai client.")
+    parser.add_argument("--files-per-job", type=int, default=2)
+    parser.add_argument("--file-size", type=parse_size, default=parse_size("30KB"))
+    parser.add_argument("--pdfs-per-job", type=int, default=0)
+    parser.add_argument("--pdf-pages", type=int, default=5)
+    parser.add_argument("--prompts", type=int, default=2)
+    parser.add_argument("--model", default="models/gemini-flash-lite-latest")
+    parser.add_argument("--batch-mode", choices=["off", "prompts", "chunks"], default="off")
+    parser.add_argument("--rpm", type=float, default=600, help="Budget RPM del rate limiter dell'app.")
+    parser.add_argument("--latency-distribution", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-stddev-ms", type=float, default=300)
+    parser.add_argument("--ocr-latency-ms", type=float, default=400, help="Latenza OCR simulata per pagina.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilità di errore 503 per chiamata.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Probabilità di 429 per chiamata.")
+    parser.add_argument("--quota-rpm", type=float, default=0, help="Quota RPM simulata lato server (0 = nessuna).")
+    args = parser.parse_args()
+
+    # I log per chunk dell'app falserebbero le misure.
+    logging.disable(logging.INFO)
+    if args.url:
+        asyncio.run(run_benchmark(args.url, args))
+    else:
+        asyncio.run(run_in_process(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Latenza risparmiata dal pool di client LLM (`LLMClientPool`) e dai template compilati
+una volta sola (`compile_prompt`).
+
+- Template: formattazione di un prompt creando un `PromptTemplate` a ogni chiamata
+  (comportamento originale) rispetto al template compilato e riusato.
+- Client (solo con GOOGLE_API_KEY impostata): per ogni "file" crea un client nuovo e fa
+  una richiesta, oppure prende il client dal pool e fa la stessa richiesta. La differenza
+  comprende la lettura dei metadati del modello e l'apertura della connessione.
+
+Uso (dalla cartella Backend):
+    python -m benchmarks.bench_llm_pool
+    GOOGLE_API_KEY=... python -m benchmarks.bench_llm_pool --files 10 --model models/gemini-flash-lite-latest
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from llama_index.core import PromptTemplate
+
+from src.llm_handler import LLMClientPool, call_llm_async, compile_prompt, get_llm
+
+PROMPT = "Riassumi in italiano il testo seguente, mantenendo i termini tecnici.\n\n{text_chunk}"
+CHUNK = "Il sistema elabora i documenti in blocchi indipendenti. " * 150
+
+
+def bench_templates(calls: int) -> None:
+    start = time.perf_counter()
+    for _ in range(calls):
+        PromptTemplate(PROMPT).format(text_chunk=CHUNK)
+    per_call_new = (time.perf_counter() - start) / calls
+
+    compile_prompt.cache_clear()
+    start = time.perf_counter()
+    for _ in range(calls):
+        compile_prompt(PROMPT).format(text_chunk=CHUNK)
+    per_call_compiled = (time.perf_counter() - start) / calls
+
+    print(f"Template nuovo a ogni chiamata: {per_call_new * 1e6:8.1f} µs/chiamata")
+    print(f"Template compilato una volta:   {per_call_compiled * 1e6:8.1f} µs/chiamata")
+
+
+async def first_request_latencies(files: int, model_config, api_key: str, pooled: bool):
+    pool = LLMClientPool()
+    latencies = []
+    for _ in range(files):
+        start = time.perf_counter()
+        llm = await asyncio.to_thread(pool.get if pooled else get_llm, model_config, api_key)
+        await call_llm_async(llm, "Rispondi solo con OK.")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_clients(files: int, model_name: str, api_key: str) -> None:
+    model_config = {"model_name": model_name, "temperature": 0.0}
+    for label, pooled in (("client nuovo per file", False), ("client dal pool", True)):
+        latencies = asyncio.run(first_request_latencies(files, model_config, api_key, pooled))
+        print(
+            f"{label:22s}: prima richiesta per file media {statistics.mean(latencies) * 1000:7.0f} ms, "
+            f"mediana {statistics.median(latencies) * 1000:7.0f} ms (su {files} file)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--files", type=int, default=5)
+    parser.add_argument("--model", default="models/gemini-flash-lite-latest")
+    args = parser.parse_args()
+
+    bench_templates(args.calls)
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if api_key:
+        bench_clients(args.files, args.model, api_key)
+    else:
+        print("GOOGLE_API_KEY non impostata: benchmark dei client saltato.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark di `normalize_text` (passata unica riga per riga) rispetto alla versione
+originale a più passate: tempo, throughput e picco di memoria (tracemalloc) su testo
+sintetico in stile OCR, con verifica che l'output sia identico.
+
+Uso (dalla cartella Backend):
+    python -m benchmarks.bench_normalizer
+    python -m benchmarks.bench_normalizer --sizes 1MB 100MB
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from benchmarks.bench_chunking import WORDS, make_paragraph, parse_size
+from benchmarks.legacy_normalizer import legacy_normalize_text
+from src.text_normalizer import normalize_text
+
+DEFAULT_SIZES = ["1MB", "10MB", "50MB"]
+
+
+def make_ocr_text(target_bytes: int, seed: int = 3) -> str:
+    """Testo con titoli in maiuscolo, numerazioni, tag <br>, righe vuote e paragrafi."""
+    rng = random.Random(seed)
+    lines = []
+    size = 0
+    while size < target_bytes:
+        kind = rng.random()
+        if kind < 0.05:
+            line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))).upper()
+        elif kind < 0.10:
+            line = f"{rng.randint(1, 9)}.{rng.randint(1, 9)} {make_paragraph(rng, rng.randint(2, 8))}"
+        elif kind < 0.15:
+            line = ""
+        elif kind < 0.20:
+            line = f"{make_paragraph(rng, 10)}<br>{make_paragraph(rng, 10)}<BR/>"
+        else:
+            line = make_paragraph(rng, rng.randint(10, 60))
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+
+def measure(function, text: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    output = function(text)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return output, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES)
+    args = parser.parse_args()
+
+    mb = 1024 * 1024
+    print(f"{'dimensione':>10} {'nuova (s)':>10} {'MB/s':>7} {'picco MB':>9} {'originale (s)':>14} {'MB/s':>7} {'picco MB':>9}")
+    for size in args.sizes:
+        text = make_ocr_text(parse_size(size))
+        megabytes = len(text.encode("utf-8")) / mb
+        output, elapsed, peak = measure(normalize_text, text)
+        legacy_output, legacy_elapsed, legacy_peak = measure(legacy_normalize_text, text)
+        if output != legacy_output:
+            raise SystemExit(f"Output diverso dalla versione originale per {size}!")
+        del output, legacy_output
+        print(
+            f"{size:>10} {elapsed:>10.3f} {megabytes / elapsed:>7.1f} {peak / mb:>9.1f} "
+            f"{legacy_elapsed:>14.3f} {megabytes / legacy_elapsed:>7.1f} {legacy_peak / mb:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark della divisione dei blocchi giganti (`HierarchicalSplitter._split_semantically`):
+confronta il percorso originale (SentenceSplitter e Document nuovi per ogni blocco),
+il SentenceSplitter riusato con `split_text` e il packer nativo senza llama_index.
+
+Uso (dalla cartella Backend):
+    python -m benchmarks.bench_semantic_split --blocks 200 --words 3000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.bench_chunking import make_paragraph
+from benchmarks.legacy_splitter import LegacyHierarchicalSplitter
+from src.chunking_strategy import HierarchicalSplitter
+
+
+def make_giant_blocks(num_blocks: int, words: int, seed: int = 7):
+    rng = random.Random(seed)
+    blocks = []
+    for index in range(num_blocks):
+        paragraphs = []
+        remaining = words
+        while remaining > 0:
+            length = min(remaining, rng.randint(40, 250))
+            paragraphs.append(make_paragraph(rng, length))
+            remaining -= length
+        blocks.append((f"## Capitolo {index + 1}", "\n\n".join(paragraphs)))
+    return blocks
+
+
+def run(splitter, blocks):
+    start = time.perf_counter()
+    sub_blocks = [splitter._split_semantically(content, header) for header, content in blocks]
+    return time.perf_counter() - start, sub_blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=200)
+    parser.add_argument("--words", type=int, default=3000, help="parole per blocco gigante")
+    args = parser.parse_args()
+
+    blocks = make_giant_blocks(args.blocks, args.words)
+    candidates = {
+        "originale (nuovo splitter per blocco)": LegacyHierarchicalSplitter(),
+        "llama_index riusato (split_text)": HierarchicalSplitter(sentence_splitter="llama_index"),
+        "nativo": HierarchicalSplitter(sentence_splitter="native"),
+    }
+    # Riscaldamento (caricamento del tokenizer, import).
+    for splitter in candidates.values():
+        run(splitter, blocks[:2])
+
+    reference = None
+    print(f"{'percorso':<40} {'tempo (s)':>10} {'ms/blocco':>10} {'sotto-blocchi':>14} {'parole/sotto-blocco':>20}")
+    for name, splitter in candidates.items():
+        elapsed, sub_blocks = run(splitter, blocks)
+        flat = [content for block in sub_blocks for _, content in block]
+        if reference is None:
+            reference = sub_blocks
+        elif splitter.sentence_splitter == "llama_index" and sub_blocks != reference:
+            raise SystemExit("Il SentenceSplitter riusato produce sotto-blocchi diversi dall'originale!")
+        mean_words = statistics.mean(len(content.split()) for content in flat)
+        print(f"{name:<40} {elapsed:>10.3f} {elapsed / len(blocks) * 1000:>10.2f} {len(flat):>14} {mean_words:>20.0f}")
+
+
+if __name__ == "__main__":
+    main()
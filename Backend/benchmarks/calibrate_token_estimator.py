@@ -0,0 +1,62 @@
+"""
+Taratura dello stimatore locale dei token (`src/token_estimator.py`) per un modello Gemini.
+Conta i token reali di alcuni testi campione con `count_tokens` dell'API, adatta `scale`
+e stampa l'errore per campione e la voce da copiare in `token_estimation.models` di config.json.
+Mostra anche quanti chunk produce lo splitter a parole rispetto a quello a token.
+
+Uso (dalla cartella Backend, con GOOGLE_API_KEY impostata):
+    python -m benchmarks.calibrate_token_estimator --model models/gemini-flash-lite-latest docs/*.md
+"""
+import argparse
+import json
+import os
+import statistics
+from pathlib import Path
+
+from api.config import app_config
+from src.chunking_strategy import HierarchicalSplitter
+from src.token_estimator import TokenEstimatorRegistry
+
+
+def count_tokens(model_name: str, texts):
+    from google import genai
+    client = genai.Client(api_key=os.environ["GOOGLE_API_KEY"])
+    return [client.models.count_tokens(model=model_name, contents=text).total_tokens for text in texts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", type=Path)
+    parser.add_argument("--model", default=app_config.get("model_config", {}).get("model_name"))
+    parser.add_argument("--max-tokens", type=int, default=4000)
+    args = parser.parse_args()
+
+    registry = TokenEstimatorRegistry.from_config(app_config.get("token_estimation", {}))
+    estimator = registry.for_model(args.model)
+
+    # Campioni di dimensione simile a un chunk, così la taratura riflette l'uso reale.
+    samples = []
+    for path in args.files:
+        text = path.read_text(encoding="utf-8")
+        samples.extend(HierarchicalSplitter(max_words=1000, min_words=300).split(text))
+    actual = count_tokens(args.model, samples)
+
+    tuned = estimator.calibrated(zip(samples, actual))
+    errors_before = [abs(estimator.estimate(t) - a) / a for t, a in zip(samples, actual) if a]
+    errors_after = [abs(tuned.estimate(t) - a) / a for t, a in zip(samples, actual) if a]
+    print(f"Campioni: {len(samples)}, token reali totali: {sum(actual)}")
+    print(f"Errore medio prima: {statistics.mean(errors_before):.1%}  dopo: {statistics.mean(errors_after):.1%}")
+    print(f"Errore massimo dopo: {max(errors_after):.1%}")
+    print("Voce per config.json:")
+    print(json.dumps({args.model: {"scale": tuned.scale}}, indent=2))
+
+    full_text = "\n\n".join(path.read_text(encoding="utf-8") for path in args.files)
+    by_words = HierarchicalSplitter().split(full_text)
+    by_tokens = HierarchicalSplitter(max_tokens=args.max_tokens, token_estimator=tuned).split(full_text)
+    for label, chunks in (("parole (1000/300)", by_words), (f"token ({args.max_tokens})", by_tokens)):
+        tokens = [tuned.estimate(chunk) for chunk in chunks]
+        print(f"Chunk a {label}: {len(chunks)}, token stimati medi {statistics.mean(tokens):.0f}, massimo {max(tokens)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Literal
+
+from .llm_handler import format_prompt
+
+BatchMode = Literal["off", "prompts", "chunks"]
+
+# Segnaposto inserito nei template al posto del testo, che compare una sola volta nella richiesta.
+TEXT_REFERENCE = "[vedi il testo {text_id} riportato sopra]"
+RESPONSE_PATTERN = re.compile(r"<<<RISPOSTA (\d+)>>>\s*(.*?)\s*<<<FINE RISPOSTA \1>>>", re.DOTALL)
+
+BATCH_INSTRUCTIONS = (
+    "Devi svolgere più compiti indipendenti. I testi di riferimento sono riportati una sola volta, "
+    "delimitati da <<<TESTO Tn>>> e <<<FINE TESTO Tn>>>; i compiti sono delimitati da <<<COMPITO k>>> "
+    "e <<<FINE COMPITO k>>>.\n"
+    "Svolgi ogni compito separatamente, come se fosse l'unica richiesta, e riporta la risposta al compito k "
+    "esattamente tra le righe <<<RISPOSTA k>>> e <<<FINE RISPOSTA k>>>, senza aggiungere altro testo "
+    "fuori dai delimitatori."
+)
+
+
+@dataclass
+class BatchItem:
+    """Una coppia (chunk, prompt) da inserire in una richiesta raggruppata."""
+    chunk_idx: int
+    prompt_name: str
+    prompt_text: str
+    chunk: str
+
+    @property
+    def key(self):
+        return self.chunk_idx, self.prompt_name
+
+
+def build_batch_prompt(items: List[BatchItem]) -> str:
+    """
+    Costruisce un'unica richiesta con sezioni delimitate. Ogni testo compare una sola
+    volta anche se più prompt lo usano (modalità "prompts").
+    """
+    text_ids: Dict[int, str] = {}
+    text_sections = []
+    for item in items:
+        if item.chunk_idx not in text_ids:
+            text_id = f"T{len(text_ids) + 1}"
+            text_ids[item.chunk_idx] = text_id
+            text_sections.append(f"<<<TESTO {text_id}>>>\n{item.chunk}\n<<<FINE TESTO {text_id}>>>")
+
+    task_sections = []
+    for number, item in enumerate(items, start=1):
+        task = format_prompt(item.prompt_text, TEXT_REFERENCE.format(text_id=text_ids[item.chunk_idx]))
+        task_sections.append(f"<<<COMPITO {number}>>>\n{task}\n<<<FINE COMPITO {number}>>>")
+
+    return "\n\n".join([BATCH_INSTRUCTIONS, *text_sections, *task_sections])
+
+
+def parse_batch_response(response: str, num_items: int) -> Dict[int, str]:
+    """
+    Estrae le risposte (indice 0-based → testo) dalla risposta raggruppata.
+    Le risposte mancanti, vuote o duplicate non vengono restituite: il chiamante
+    le rielabora con richieste singole.
+    """
+    found: Dict[int, str] = {}
+    duplicated = set()
+    for match in RESPONSE_PATTERN.finditer(response):
+        index = int(match.group(1)) - 1
+        if not 0 <= index < num_items:
+            continue
+        if index in found:
+            duplicated.add(index)
+        found[index] = match.group(2)
+    return {index: text for index, text in found.items() if text and index not in duplicated}
+
+
+def group_items(
+    items: Iterable[BatchItem], mode: BatchMode, max_items: int, max_tokens: int, count_tokens: Callable[[str], int]
+) -> Iterator[List[BatchItem]]:
+    """
+    Raggruppa le coppie (chunk, prompt), nell'ordine in cui arrivano:
+    - "prompts": tutti i prompt dello stesso chunk insieme;
+    - "chunks": chunk consecutivi con lo stesso prompt, finché stanno in `max_tokens`.
+    Ogni gruppo ha al massimo `max_items` elementi.
+    """
+    if mode == "off":
+        for item in items:
+            yield [item]
+        return
+
+    if mode == "prompts":
+        group: List[BatchItem] = []
+        for item in items:
+            if group and (item.chunk_idx != group[0].chunk_idx or len(group) >= max_items):
+                yield group
+                group = []
+            group.append(item)
+        if group:
+            yield group
+        return
+
+    # mode == "chunks": un gruppo aperto per ogni prompt.
+    open_groups: Dict[str, List[BatchItem]] = {}
+    open_tokens: Dict[str, int] = {}
+    for item in items:
+        tokens = count_tokens(item.chunk)
+        group = open_groups.get(item.prompt_name)
+        if group and (len(group) >= max_items or open_tokens[item.prompt_name] + tokens > max_tokens):
+            yield group
+            group = None
+        if not group:
+            open_groups[item.prompt_name] = group = []
+            open_tokens[item.prompt_name] = 0
+        group.append(item)
+        open_tokens[item.prompt_name] += tokens
+    for group in open_groups.values():
+        if group:
+            yield group
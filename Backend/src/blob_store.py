@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict
+
+from .ocr_cache import link_or_copy
+
+logger = logging.getLogger(__name__)
+
+# Caratteri dell'hash usati nel nome del file collegato nella cartella del job.
+LINKED_NAME_HASH_CHARS = 20
+
+
+class BlobStore:
+    """
+    Archivio di file indirizzati per contenuto (SHA-256), in `<root>/<aa>/<hash>.<ext>`.
+    Un contenuto viene scritto una sola volta, anche se compare in molte pagine o in molti
+    upload (loghi, decorazioni); le cartelle dei job ricevono solo hard link. Un blob che
+    non ha più link (tutti i job che lo usavano sono stati eliminati) viene rimosso da
+    `collect_garbage`.
+    """
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, digest: str, ext: str) -> Path:
+        return self.root / digest[:2] / f"{digest}.{ext}"
+
+    def put(self, data: bytes, ext: str) -> Path:
+        """Salva il contenuto (se non è già presente) e restituisce il percorso del blob."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest, ext)
+        if path.exists():
+            # Aggiorna il timestamp: un blob appena riusato non va rimosso da `collect_garbage`.
+            os.utime(path)
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Scrittura atomica: un blob visibile è sempre completo.
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def link_into(self, blob_path: Path, target_dir: Path) -> str:
+        """Collega il blob in `target_dir` con un nome breve derivato dall'hash; restituisce il nome."""
+        digest, _, ext = blob_path.name.partition(".")
+        filename = f"{digest[:LINKED_NAME_HASH_CHARS]}.{ext}"
+        link_or_copy(blob_path, Path(target_dir) / filename)
+        return filename
+
+    def collect_garbage(self, min_age_seconds: float = 3600) -> int:
+        """
+        Elimina i blob senza altri link (nessuna cartella di job o voce di cache li usa più).
+        `min_age_seconds` protegge i blob appena scritti e non ancora collegati.
+        """
+        cutoff = time.time() - min_age_seconds
+        removed = 0
+        for path in self.root.glob("*/*"):
+            try:
+                stat = path.stat()
+                if stat.st_nlink <= 1 and stat.st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            logger.info(f"Blob store: eliminati {removed} file non più collegati.")
+        return removed
+
+    def stats(self) -> Dict:
+        files = [path for path in self.root.glob("*/*") if not path.name.startswith(".")]
+        return {"blobs": len(files), "size_bytes": sum(path.stat().st_size for path in files)}
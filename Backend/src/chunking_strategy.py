@@ -1,9 +1,156 @@
+import math
 import re
-from typing import List, Dict, Tuple
+from functools import lru_cache
+from typing import List, Dict, Literal, Optional, Tuple
 from abc import ABC, abstractmethod
 from collections import deque
-from llama_index.core import Document
-from llama_index.core.node_parser import SentenceSplitter as LlamaSentenceSplitter
+
+from .token_estimator import TokenEstimator
+
+WORD_PATTERN = re.compile(r'\b\w+\b')
+HEADER_PATTERN = re.compile(r'^(#{1,6})\s')
+BLOCK_BOUNDARY_PATTERN = re.compile(r'(?m)(?=^#{1,6}\s)')
+# Separatore tra blocchi dello stesso chunk. Non contiene caratteri di parola, quindi il
+# numero di parole di un chunk è la somma di quelle dei suoi blocchi.
+BLOCK_SEPARATOR = "\n\n"
+
+PARAGRAPH_PATTERN = re.compile(r'\n\s*\n')
+SENTENCE_END_PATTERN = re.compile(r'(?<=[.!?…;:])\s+')
+
+SentenceSplitterKind = Literal["llama_index", "native"]
+
+
+def estimate_tokens(text: str) -> int:
+    """Stima grossolana dei token (circa 4 caratteri per token)."""
+    return (len(text) + 3) // 4
+
+
+def _char_word_cost(word: str) -> float:
+    # Parola più lo spazio che la separa: sommati, non superano mai estimate_tokens del pezzo.
+    return (len(word) + 1) / 4
+
+
+class EstimatorTokenizer:
+    """
+    Tokenizer per il SentenceSplitter di llama_index che conta i token con un `TokenEstimator`
+    (per eccesso) invece che con tiktoken: così i limiti dello splitter sono nella stessa
+    unità del budget `max_tokens`.
+    """
+    def __init__(self, token_estimator: TokenEstimator):
+        self.token_estimator = token_estimator
+
+    def __call__(self, text: str) -> List[None]:
+        return [None] * math.ceil(self.token_estimator.estimate_raw(text))
+
+
+class NativeSentencePacker:
+    """
+    Alternativa leggera al SentenceSplitter di llama_index, senza tokenizer né dipendenze:
+    divide il testo in paragrafi e, se serve, in frasi (o a parole per frasi enormi), poi
+    li impacchetta in chunk di al massimo `chunk_size` token stimati, ripetendo in testa
+    a ogni chunk le ultime frasi del precedente fino a `chunk_overlap` token.
+    Stessa interfaccia di `split_text` del SentenceSplitter. Con `token_estimator`
+    i token vengono stimati con i coefficienti del modello invece che a caratteri
+    (con `estimate_raw`, additiva: la somma delle unità è la stima del chunk).
+    """
+    def __init__(self, chunk_size: int = 1024, chunk_overlap: int = 200, token_estimator: Optional[TokenEstimator] = None):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        if token_estimator is not None:
+            self._count = self._word_cost = token_estimator.estimate_raw
+        else:
+            self._count, self._word_cost = estimate_tokens, _char_word_cost
+
+    def _units(self, text: str) -> List[Tuple[str, float, bool]]:
+        """Unità indivisibili: (testo, token stimati, inizio di paragrafo)."""
+        units = []
+        count = self._count
+        for paragraph in PARAGRAPH_PATTERN.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            paragraph_tokens = count(paragraph)
+            if paragraph_tokens <= self.chunk_size:
+                units.append((paragraph, paragraph_tokens, True))
+                continue
+            first = True
+            for sentence in SENTENCE_END_PATTERN.split(paragraph):
+                if not sentence:
+                    continue
+                sentence_tokens = count(sentence)
+                if sentence_tokens <= self.chunk_size:
+                    units.append((sentence, sentence_tokens, first))
+                    first = False
+                    continue
+                # Frase più lunga di un chunk: la spezziamo a parole.
+                for piece in self._wrap_words(sentence):
+                    units.append((piece, count(piece), first))
+                    first = False
+        return units
+
+    def _wrap_words(self, sentence: str) -> List[str]:
+        """Spezza una frase in pezzi di al massimo `chunk_size` token, sommando il costo delle parole."""
+        pieces, current, tokens = [], [], 0.0
+        for word in sentence.split():
+            cost = self._word_cost(word)
+            if current and tokens + cost > self.chunk_size:
+                pieces.append(" ".join(current))
+                current, tokens = [], 0.0
+            current.append(word)
+            tokens += cost
+        if current:
+            pieces.append(" ".join(current))
+        return pieces
+
+    @staticmethod
+    def _join(units: List[Tuple[str, float, bool]]) -> str:
+        parts = []
+        for index, (unit_text, _, paragraph_start) in enumerate(units):
+            if index:
+                parts.append("\n\n" if paragraph_start else " ")
+            parts.append(unit_text)
+        return "".join(parts)
+
+    def split_text(self, text: str) -> List[str]:
+        chunks = []
+        current: List[Tuple[str, float, bool]] = []
+        current_tokens = 0
+        for unit in self._units(text):
+            if current and current_tokens + unit[1] > self.chunk_size:
+                chunks.append(self._join(current))
+                # Sovrapposizione: le ultime unità del chunk appena chiuso, entro chunk_overlap
+                # e lasciando spazio all'unità corrente.
+                overlap, overlap_tokens = [], 0
+                for previous in reversed(current):
+                    if overlap_tokens + previous[1] > self.chunk_overlap or overlap_tokens + previous[1] + unit[1] > self.chunk_size:
+                        break
+                    overlap.insert(0, previous)
+                    overlap_tokens += previous[1]
+                current, current_tokens = overlap, overlap_tokens
+            current.append(unit)
+            current_tokens += unit[1]
+        if current:
+            chunks.append(self._join(current))
+        return chunks
+
+
+@lru_cache(maxsize=64)
+def get_sentence_splitter(kind: SentenceSplitterKind, chunk_size: int, chunk_overlap: int,
+                          token_estimator: Optional[TokenEstimator] = None):
+    """
+    Restituisce (e riusa) lo splitter di frasi per una configurazione: crearne uno nuovo
+    per ogni blocco gigante ricaricava ogni volta il tokenizer di llama_index.
+    Con `token_estimator` entrambi gli splitter misurano `chunk_size` in token stimati.
+    """
+    if kind == "native":
+        return NativeSentencePacker(chunk_size=chunk_size, chunk_overlap=chunk_overlap, token_estimator=token_estimator)
+    if kind != "llama_index":
+        raise ValueError(f"Splitter di frasi sconosciuto: '{kind}'")
+    from llama_index.core.node_parser import SentenceSplitter as LlamaSentenceSplitter
+    if token_estimator is not None:
+        return LlamaSentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                     tokenizer=EstimatorTokenizer(token_estimator))
+    return LlamaSentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
 class BaseTextSplitter(ABC):
     """Classe base astratta per gli splitter di testo."""
@@ -17,40 +164,64 @@ class BaseTextSplitter(ABC):
 
     def _word_count(self, text: str) -> int:
         """Conta il numero di parole in un testo."""
-        return len(re.findall(r'\b\w+\b', text))
+        return len(WORD_PATTERN.findall(text))
 
 class HierarchicalSplitter(BaseTextSplitter):
     """
     Uno splitter avanzato che aggrega il testo in modo gerarchico.
+    Di default i limiti sono in parole (`max_words`/`min_words`); con `max_tokens`
+    i chunk vengono riempiti fino al budget di token stimato con `token_estimator`
+    (tarato sul modello che riceverà i chunk).
     """
     def __init__(self,
                  max_words: int = 1000,
                  min_words: int = 300,
                  chunk_size: int = 1024,
-                 chunk_overlap: int = 200):
+                 chunk_overlap: int = 200,
+                 sentence_splitter: SentenceSplitterKind = "llama_index",
+                 max_tokens: Optional[int] = None,
+                 min_tokens: Optional[int] = None,
+                 token_estimator: Optional[TokenEstimator] = None):
         super().__init__()
         self.max_words = max_words
         self.min_words = min_words
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.sentence_splitter = sentence_splitter
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens if min_tokens is not None else (max_tokens // 3 if max_tokens else None)
+        self.token_estimator = token_estimator or TokenEstimator()
+
+    @property
+    def token_mode(self) -> bool:
+        return self.max_tokens is not None
+
+    def _measure(self, text: str) -> float:
+        """Dimensione di un blocco nell'unità dei limiti: token stimati o parole."""
+        return self.token_estimator.estimate_raw(text) if self.token_mode else self._word_count(text)
 
     def _get_header_level(self, text: str) -> int:
         """Estrae il livello di un header Markdown (es. ## -> 2)."""
-        match = re.match(r'^(#{1,6})\s', text)
+        match = HEADER_PATTERN.match(text)
         return len(match.group(1)) if match else float('inf')
 
     def _split_semantically(self, text: str, header: str) -> List[Tuple[int, str]]:
         """Divide semanticamente un blocco di testo, restituendo sotto-blocchi."""
-        semantic_splitter = LlamaSentenceSplitter(
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap,
-        )
-        nodes = semantic_splitter.get_nodes_from_documents([Document(text=text)])
-        
+        if self.token_mode:
+            # Ogni sotto-blocco deve stare nel budget insieme alla sua intestazione.
+            header_tokens = int(self.token_estimator.estimate_raw(f"{header.strip()} - Parte 999")) + 1
+            chunk_size = max(self.max_tokens - header_tokens, self.max_tokens // 2, 1)
+            semantic_splitter = get_sentence_splitter(
+                self.sentence_splitter, chunk_size, min(self.chunk_overlap, chunk_size // 5), self.token_estimator
+            )
+        else:
+            semantic_splitter = get_sentence_splitter(self.sentence_splitter, self.chunk_size, self.chunk_overlap)
+        # split_text restituisce gli stessi testi dei nodi di get_nodes_from_documents
+        # (il Document non ha metadati), senza costruire Document e nodi.
         sub_blocks = []
         part_counter = 1
-        for node in nodes:
-            content = node.get_content().strip()
+        for split in semantic_splitter.split_text(text):
+            content = split.strip()
             if content:
                 context_header = f"{header.strip()} - Parte {part_counter}"
                 sub_blocks.append((self._get_header_level(header), f"{context_header}\n\n{content}"))
@@ -58,82 +229,104 @@ class HierarchicalSplitter(BaseTextSplitter):
         return sub_blocks
 
     def split(self, text: str) -> List[str]:
+        """
+        Divide il testo in chunk. La dimensione di ogni blocco (parole o token stimati) viene
+        calcolata una sola volta e i chunk vengono tenuti come liste di blocchi con il totale corrente:
+        le stringhe si costruiscono solo alla finalizzazione, quindi il costo è lineare
+        nella lunghezza del testo.
+        """
         if not text or not text.strip():
             return []
 
-        # 1. Pre-divisione in blocchi atomici
-        raw_splits = re.split(r'(?m)(?=^#{1,6}\s)', text)
+        # 1. Pre-divisione in blocchi atomici: (livello, contenuto, già diviso semanticamente)
         initial_blocks = deque()
-        for split in raw_splits:
+        for split in BLOCK_BOUNDARY_PATTERN.split(text):
             if split.strip():
                 level = self._get_header_level(split)
-                initial_blocks.append((level, split.strip()))
+                initial_blocks.append((level, split.strip(), False))
 
         if not initial_blocks:
             return [text] if self._word_count(text) > 0 else []
 
         # 2. Aggregazione Gerarchica con logica di finalizzazione robusta
-        temp_chunks = []
-        current_chunk_content = ""
+        max_size = self.max_tokens if self.token_mode else self.max_words
+        min_size = self.min_tokens if self.token_mode else self.min_words
+        temp_chunks: List[Tuple[str, float]] = []
+        current_parts: List[str] = []
+        current_size = 0
         current_chunk_level = float('inf')
 
+        def finalize_current():
+            if current_parts:
+                temp_chunks.append((BLOCK_SEPARATOR.join(current_parts), current_size))
+
         while initial_blocks:
-            block_level, block_content = initial_blocks.popleft()
+            block_level, block_content, already_split = initial_blocks.popleft()
+            block_size = self._measure(block_content)
 
-            # Gestione blocco gigante che deve essere diviso subito
-            is_giant_block = self._word_count(block_content) > self.max_words
-            if (not current_chunk_content and is_giant_block) or (current_chunk_content and is_giant_block):
+            # Gestione blocco gigante che deve essere diviso subito. Un sotto-blocco prodotto
+            # dalla divisione semantica non viene diviso di nuovo: darebbe lo stesso risultato
+            # all'infinito (succede quando il limite massimo è minore di chunk_size).
+            if block_size > max_size and not already_split:
                 # Finalizza il chunk corrente prima di processare quello gigante
-                if current_chunk_content:
-                    temp_chunks.append(current_chunk_content)
-                    current_chunk_content = ""
-                
-                header = block_content.split('\n')[0]
-                content = '\n'.join(block_content.split('\n')[1:])
+                finalize_current()
+                current_parts, current_size = [], 0
+
+                header, _, content = block_content.partition('\n')
                 sub_blocks = self._split_semantically(content, header)
-                for sub_block in reversed(sub_blocks):
-                    initial_blocks.appendleft(sub_block)
+                for sub_level, sub_content in reversed(sub_blocks):
+                    initial_blocks.appendleft((sub_level, sub_content, True))
                 continue
 
-            potential_new_size = self._word_count(current_chunk_content + "\n\n" + block_content)
-
             # Se il nuovo blocco è gerarchicamente inferiore e ci sta, lo aggiungiamo
-            if block_level > current_chunk_level and potential_new_size <= self.max_words:
-                current_chunk_content += "\n\n" + block_content
+            if block_level > current_chunk_level and current_size + block_size <= max_size:
+                if not current_parts:
+                    # Dopo un blocco gigante il livello del chunk precedente resta valido:
+                    # come nella versione originale, il nuovo chunk inizia con il separatore.
+                    current_parts.append("")
+                current_parts.append(block_content)
+                current_size += block_size
             else:
                 # Altrimenti, finalizziamo il chunk corrente e ne iniziamo uno nuovo
-                if current_chunk_content:
-                    temp_chunks.append(current_chunk_content)
-                
-                current_chunk_content = block_content
+                finalize_current()
+                current_parts, current_size = [block_content], block_size
                 current_chunk_level = block_level
-        
+
         # Aggiungi l'ultimo chunk rimasto
-        if current_chunk_content:
-            temp_chunks.append(current_chunk_content)
+        finalize_current()
 
         # 3. Passata finale di accorpamento per gestire i chunk troppo piccoli
         if not temp_chunks:
             return []
 
-        final_chunks = []
-        for chunk in temp_chunks:
-            # Se è il primo chunk o se il chunk precedente è abbastanza grande, aggiungilo
-            if not final_chunks or self._word_count(final_chunks[-1]) >= self.min_words:
-                final_chunks.append(chunk)
+        merged: List[List[str]] = []
+        last_size = 0
+        for chunk, size in temp_chunks:
+            # Se è il primo chunk o se il chunk precedente è abbastanza grande, aggiungilo.
+            # A budget di token il massimo è un limite rigido anche per gli accorpamenti.
+            if not merged or last_size >= min_size or (self.token_mode and last_size + size > max_size):
+                merged.append([chunk])
+                last_size = size
             # Altrimenti, se il chunk precedente era troppo piccolo, unisci questo ad esso
             else:
-                final_chunks[-1] += "\n\n" + chunk
-                
-        return final_chunks
+                merged[-1].append(chunk)
+                last_size += size
+
+        return [BLOCK_SEPARATOR.join(parts) for parts in merged]
 
-def get_splitter(chunking_config: Dict) -> BaseTextSplitter:
+def get_splitter(chunking_config: Dict, token_estimator: Optional[TokenEstimator] = None) -> BaseTextSplitter:
     """
     Factory function che restituisce lo splitter gerarchico configurato.
+    Se `chunking_config` contiene `max_tokens` lo splitter lavora a budget di token,
+    stimati con `token_estimator`.
     """
     return HierarchicalSplitter(
         max_words=chunking_config.get('max_words', 1000),
         min_words=chunking_config.get('min_words', 300),
         chunk_size=chunking_config.get('chunk_size', 1024),
-        chunk_overlap=chunking_config.get('chunk_overlap', 200)
+        chunk_overlap=chunking_config.get('chunk_overlap', 200),
+        sentence_splitter=chunking_config.get('sentence_splitter', 'llama_index'),
+        max_tokens=chunking_config.get('max_tokens'),
+        min_tokens=chunking_config.get('min_tokens'),
+        token_estimator=token_estimator
     )
\ No newline at end of file
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from .chunking_strategy import BaseTextSplitter, get_sentence_splitter, get_splitter
+from .ingest import read_text_upload
+from .text_normalizer import normalize_text
+from .token_estimator import TokenEstimator
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Risultato del chunking: i chunk e la durata (secondi) di ogni fase, per le metriche.
+ChunkingResult = Tuple[List[str], Dict[str, float]]
+
+
+@dataclass(frozen=True)
+class SplitterSpec:
+    """
+    Configurazione dello splitter in forma serializzabile: viaggia verso i processi worker,
+    che ricostruiscono (e riusano) lo splitter invece di ricevere l'oggetto.
+    """
+    config_json: str
+    token_estimator: Optional[TokenEstimator] = None
+
+    @classmethod
+    def from_config(cls, chunking_config: Dict, token_estimator: Optional[TokenEstimator] = None) -> "SplitterSpec":
+        return cls(json.dumps(chunking_config, sort_keys=True), token_estimator)
+
+    def build(self) -> BaseTextSplitter:
+        return _build_splitter(self)
+
+
+@lru_cache(maxsize=32)
+def _build_splitter(spec: SplitterSpec) -> BaseTextSplitter:
+    return get_splitter(json.loads(spec.config_json), token_estimator=spec.token_estimator)
+
+
+# --- Funzioni eseguite nei worker (o in un thread, se il pool è disattivato) ---
+
+def split_text(text: str, normalize: bool, spec: SplitterSpec) -> ChunkingResult:
+    """Normalizzazione (se richiesta) e chunking di un testo già in memoria (es. l'OCR di un PDF)."""
+    timings = {}
+    if normalize:
+        start = time.perf_counter()
+        text = normalize_text(text)
+        timings["normalize"] = time.perf_counter() - start
+    start = time.perf_counter()
+    chunks = spec.build().split(text)
+    timings["split"] = time.perf_counter() - start
+    return chunks, timings
+
+
+def split_text_file(path: str, normalize: bool, spec: SplitterSpec) -> ChunkingResult:
+    """Come `split_text`, per un testo che il processo principale ha scritto su disco."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        text = f.read()
+    return split_text(text, normalize, spec)
+
+
+def split_stream(fileobj: BinaryIO, normalize: bool, spec: SplitterSpec) -> ChunkingResult:
+    """
+    Lettura, decodifica, normalizzazione e chunking di un file di testo. La fase "normalize"
+    comprende la lettura (con la normalizzazione disattivata è "upload_read").
+    """
+    start = time.perf_counter()
+    text = read_text_upload(fileobj, normalize)
+    timings = {"normalize" if normalize else "upload_read": time.perf_counter() - start}
+    start = time.perf_counter()
+    chunks = spec.build().split(text)
+    timings["split"] = time.perf_counter() - start
+    return chunks, timings
+
+
+def split_file(path: str, normalize: bool, spec: SplitterSpec) -> ChunkingResult:
+    with open(path, "rb") as f:
+        return split_stream(f, normalize, spec)
+
+
+# Barriera del warm-up, ricevuta da ogni worker all'avvio (le primitive di sincronizzazione
+# passano ai processi solo alla creazione, non come argomenti dei task).
+_warm_barrier = None
+
+
+def _init_worker(barrier, spec: Optional[SplitterSpec]) -> None:
+    """Initializer dei worker: importa llama_index e prepara lo splitter della configurazione di default."""
+    global _warm_barrier
+    _warm_barrier = barrier
+    if spec is None:
+        return
+    chunking_config = json.loads(spec.config_json)
+    if chunking_config.get("sentence_splitter", "llama_index") == "llama_index":
+        get_sentence_splitter("llama_index", chunking_config.get("chunk_size", 1024), chunking_config.get("chunk_overlap", 200))
+    spec.build()
+
+
+def _ping(timeout: float) -> int:
+    """
+    Task del warm-up: resta in attesa finché tutti i worker non ne eseguono uno. Così nessun
+    worker già pronto può prendersi i ping degli altri e il pool parte al completo.
+    """
+    try:
+        _warm_barrier.wait(timeout)
+    except threading.BrokenBarrierError:
+        pass
+    return os.getpid()
+
+
+class CPUPool:
+    """
+    Esegue il lavoro CPU-bound (normalizzazione, chunking, compressione degli archivi) in un
+    pool di processi, così un upload grande non blocca gli altri e più file usano più core.
+    Gli input sotto `min_input_bytes` restano in un thread: il passaggio al processo costa più
+    del lavoro. Upload e testi OCR vengono passati ai worker come file su disco, non come byte.
+    Con `workers = 0` tutto gira nei thread, come senza pool.
+
+    Ogni worker è un processo che importa llama_index (decine di MB di memoria): il pool è
+    per processo, quindi con `uvicorn --workers N` i processi sono N volte `workers`.
+    """
+    def __init__(
+        self, workers: int = 0, min_input_bytes: int = 256 * 1024, start_method: str = "forkserver",
+        spool_dir: Optional[str] = None, warm_spec: Optional[SplitterSpec] = None
+    ):
+        self.workers = workers
+        self.min_input_bytes = min_input_bytes
+        self.spool_dir = spool_dir
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.tasks = 0
+        self.inline_tasks = 0
+        if workers > 0:
+            if start_method not in multiprocessing.get_all_start_methods():
+                start_method = "spawn"
+            context = multiprocessing.get_context(start_method)
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(context.Barrier(workers), warm_spec),
+            )
+
+    @classmethod
+    def from_config(cls, config: Dict, warm_spec: Optional[SplitterSpec] = None) -> "CPUPool":
+        """
+        Dalla sezione `cpu_pool` di config.json (`workers` null = core disponibili meno uno, al
+        massimo 4). Con `enabled: true` all'avvio partono subito tutti i `workers` processi, per
+        ogni processo uvicorn: su macchine piccole conviene fissare `workers` o disattivare il pool.
+        """
+        enabled = config.get("enabled", True)
+        workers = config.get("workers") or max(1, min(4, (os.cpu_count() or 2) - 1))
+        return cls(
+            workers=workers if enabled else 0,
+            min_input_bytes=int(config.get("min_input_kb", 256) * 1024),
+            start_method=config.get("start_method", "forkserver"),
+            spool_dir=config.get("spool_dir"),
+            warm_spec=warm_spec,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self._executor is not None
+
+    async def warm(self, timeout: float = 120.0) -> None:
+        """Avvia subito tutti i worker (con llama_index già importato) invece che alla prima richiesta."""
+        if self._executor is None:
+            return
+        start = time.perf_counter()
+        pids = await asyncio.gather(*(self.run(_ping, timeout) for _ in range(self.workers)))
+        logger.info(f"Pool CPU pronto: {len(set(pids))} processi in {time.perf_counter() - start:.1f}s.")
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """Esegue `func(*args)` in un worker (in un thread se il pool è disattivato)."""
+        if self._executor is None:
+            self.inline_tasks += 1
+            return await asyncio.to_thread(func, *args)
+        self.tasks += 1
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def split_text(self, text: str, normalize: bool, spec: SplitterSpec) -> ChunkingResult:
+        """
+        Chunking di un testo in memoria (l'OCR di un PDF). Se va a un worker viene scritto in
+        un file temporaneo, come gli upload: il testo non viene serializzato verso il processo.
+        """
+        if self._executor is None or len(text) < self.min_input_bytes:
+            self.inline_tasks += 1
+            return await asyncio.to_thread(split_text, text, normalize, spec)
+        path = await asyncio.to_thread(self._spool_text, text)
+        try:
+            return await self.run(split_text_file, path, normalize, spec)
+        finally:
+            os.unlink(path)
+
+    async def split_upload(self, fileobj: BinaryIO, size: Optional[int], normalize: bool, spec: SplitterSpec) -> ChunkingResult:
+        """
+        Chunking di un upload (lo spool di Starlette). Se è grande viene copiato in un file
+        temporaneo che il worker legge da sé: nessun trasferimento del contenuto tra processi.
+        """
+        if self._executor is None or (size is not None and size < self.min_input_bytes):
+            self.inline_tasks += 1
+            return await asyncio.to_thread(split_stream, fileobj, normalize, spec)
+        path = await asyncio.to_thread(self._spool_upload, fileobj)
+        try:
+            return await self.run(split_file, path, normalize, spec)
+        finally:
+            os.unlink(path)
+
+    def _spool_upload(self, fileobj: BinaryIO) -> str:
+        fd, path = tempfile.mkstemp(prefix="textflow_upload_", dir=self.spool_dir)
+        try:
+            with os.fdopen(fd, "wb") as dest:
+                fileobj.seek(0)
+                shutil.copyfileobj(fileobj, dest, 1024 * 1024)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return path
+
+    def _spool_text(self, text: str) -> str:
+        fd, path = tempfile.mkstemp(prefix="textflow_text_", suffix=".md", dir=self.spool_dir)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as dest:
+                dest.write(text)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return path
+
+    def stats(self) -> Dict:
+        return {"workers": self.workers, "enabled": self.enabled, "tasks": self.tasks, "inline_tasks": self.inline_tasks}
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
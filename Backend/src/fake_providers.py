@@ -0,0 +1,190 @@
+# Provider locali che simulano Gemini (LLM) e Mistral (OCR) senza consumare quota:
+# latenza con distribuzione configurabile, errori temporanei e 429 iniettati, quota RPM
+# simulata. Servono per i benchmark e per provare le modifiche allo scheduling.
+# Si attivano con `providers.llm = "fake"` e/o `providers.ocr = "fake"` in config.json.
+import asyncio
+import collections
+import hashlib
+import io
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+FAKE_OCR_MODEL = "fake-ocr"
+TASK_PATTERN = re.compile(r"<<<COMPITO (\d+)>>>")
+# PNG 1x1: la stessa immagine compare in ogni pagina, come un logo.
+LOGO_PNG_BASE64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+FAKE_WORDS = (
+    "analisi sintesi documento sezione risultato metodo dato modello processo struttura "
+    "valore elemento contesto esempio problema soluzione livello parte regola testo"
+).split()
+
+
+class FakeProviderError(Exception):
+    """Errore simulato: il messaggio riproduce quelli dei servizi reali (429, 503)."""
+
+
+@dataclass
+class LatencyModel:
+    """
+    Distribuzione della latenza di una chiamata, in millisecondi:
+    "fixed" (sempre `mean_ms`), "uniform" o "lognormal" con media e deviazione standard date.
+    """
+    distribution: str = "lognormal"
+    mean_ms: float = 800.0
+    stddev_ms: float = 300.0
+    min_ms: float = 0.0
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LatencyModel":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+    def sample(self, rng: random.Random) -> float:
+        """Una latenza in secondi."""
+        if self.distribution == "fixed" or self.stddev_ms <= 0:
+            value = self.mean_ms
+        elif self.distribution == "uniform":
+            half_width = self.stddev_ms * math.sqrt(3)
+            value = rng.uniform(self.mean_ms - half_width, self.mean_ms + half_width)
+        elif self.distribution == "lognormal":
+            sigma2 = math.log(1 + (self.stddev_ms / self.mean_ms) ** 2)
+            value = rng.lognormvariate(math.log(self.mean_ms) - sigma2 / 2, math.sqrt(sigma2))
+        else:
+            raise ValueError(f"Distribuzione di latenza sconosciuta: '{self.distribution}'.")
+        return max(self.min_ms, value) / 1000.0
+
+
+@dataclass
+class FakeProviderOptions:
+    """Comportamento di un provider simulato (sezioni `providers.fake_llm` / `providers.fake_ocr`)."""
+    latency: LatencyModel = field(default_factory=LatencyModel)
+    # Probabilità che una chiamata fallisca con un errore temporaneo (503).
+    error_rate: float = 0.0
+    # Probabilità che una chiamata riceva un 429 anche sotto quota.
+    rate_limit_rate: float = 0.0
+    # Quota simulata lato server (richieste al minuto per client); 0 = nessuna quota.
+    quota_rpm: float = 0.0
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "FakeProviderOptions":
+        values = {k: v for k, v in data.items() if k in cls.__dataclass_fields__ and k != "latency"}
+        return cls(latency=LatencyModel.from_dict(data.get("latency", {})), **values)
+
+
+class _FaultInjector:
+    """Latenza, errori e quota RPM condivisi dalle chiamate di un client simulato (thread-safe)."""
+    def __init__(self, options: FakeProviderOptions):
+        self.options = options
+        self._rng = random.Random(options.seed)
+        self._lock = threading.Lock()
+        self._recent = collections.deque()
+
+    def next_call(self) -> float:
+        """Registra una chiamata: restituisce la latenza da simulare o solleva l'errore iniettato."""
+        with self._lock:
+            now = time.monotonic()
+            if self.options.quota_rpm > 0:
+                while self._recent and now - self._recent[0] > 60.0:
+                    self._recent.popleft()
+                if len(self._recent) >= self.options.quota_rpm:
+                    raise FakeProviderError("429 Resource exhausted: quota al minuto superata (simulato)")
+                self._recent.append(now)
+            roll = self._rng.random()
+            latency = self.options.latency.sample(self._rng)
+        if roll < self.options.rate_limit_rate:
+            raise FakeProviderError("429 Too Many Requests (simulato)")
+        if roll < self.options.rate_limit_rate + self.options.error_rate:
+            raise FakeProviderError("503 Service Unavailable (simulato)")
+        return latency
+
+
+@dataclass
+class FakeCompletion:
+    text: str
+
+
+def fake_answer(prompt: str, model_name: str) -> str:
+    """
+    Risposta deterministica (hash e ultime parole del prompt). Le richieste raggruppate ricevono
+    una risposta per compito, nel formato atteso da `parse_batch_response`.
+    """
+    tasks = TASK_PATTERN.findall(prompt)
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    summary = " ".join(prompt.split()[-12:])
+    if tasks:
+        return "\n".join(
+            f"<<<RISPOSTA {number}>>>\nRisposta simulata {number} ({model_name}, {digest}).\n<<<FINE RISPOSTA {number}>>>"
+            for number in tasks
+        )
+    return f"Risposta simulata ({model_name}, {digest}): {summary}"
+
+
+class FakeLLM:
+    """Sostituto di `Gemini` con la stessa interfaccia usata dall'app (`acomplete`, `complete`)."""
+    def __init__(self, model_name: str, options: Optional[FakeProviderOptions] = None):
+        self.model_name = model_name
+        self._faults = _FaultInjector(options or FakeProviderOptions())
+
+    async def acomplete(self, prompt: str) -> FakeCompletion:
+        latency = self._faults.next_call()
+        await asyncio.sleep(latency)
+        return FakeCompletion(fake_answer(prompt, self.model_name))
+
+    def complete(self, prompt: str) -> FakeCompletion:
+        latency = self._faults.next_call()
+        time.sleep(latency)
+        return FakeCompletion(fake_answer(prompt, self.model_name))
+
+
+@dataclass
+class FakeOCRImage:
+    id: str
+    image_base64: str
+
+
+@dataclass
+class FakeOCRPage:
+    markdown: str
+    images: List[FakeOCRImage]
+
+
+def count_pdf_pages(pdf_bytes: bytes) -> int:
+    """Pagine del PDF; se pypdf non lo legge, una pagina ogni 50 KB."""
+    try:
+        from pypdf import PdfReader
+        return max(1, len(PdfReader(io.BytesIO(pdf_bytes)).pages))
+    except Exception:
+        return max(1, len(pdf_bytes) // (50 * 1024))
+
+
+class FakeOCRProvider:
+    """
+    Sostituto dell'OCR di Mistral: restituisce per ogni pagina un markdown sintetico
+    (deterministico, derivato dal contenuto del PDF) con un titolo e un logo ripetuto.
+    La latenza simulata è per pagina.
+    """
+    model_name = FAKE_OCR_MODEL
+
+    def __init__(self, options: Optional[FakeProviderOptions] = None, words_per_page: int = 350):
+        self._faults = _FaultInjector(options or FakeProviderOptions())
+        self.words_per_page = words_per_page
+
+    def process(self, pdf_bytes: bytes, file_name: str) -> List[FakeOCRPage]:
+        num_pages = count_pdf_pages(pdf_bytes)
+        time.sleep(sum(self._faults.next_call() for _ in range(num_pages)))
+        rng = random.Random(hashlib.sha256(pdf_bytes).digest())
+        logo = f"data:image/png;base64,{LOGO_PNG_BASE64}"
+        pages = []
+        for page_idx in range(num_pages):
+            words = " ".join(rng.choice(FAKE_WORDS) for _ in range(self.words_per_page))
+            img_id = f"img-{page_idx}.png"
+            markdown = f"# PAGINA {page_idx + 1}\n\n![{img_id}]({img_id})\n\n{words.capitalize()}."
+            pages.append(FakeOCRPage(markdown, [FakeOCRImage(img_id, logo)]))
+        return pages
@@ -0,0 +1,35 @@
+import codecs
+from typing import BinaryIO, Iterator
+
+from .text_normalizer import DEFAULT_NORMALIZER
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def iter_decoded_blocks(fileobj: BinaryIO, encoding: str = "utf-8", block_size: int = READ_BLOCK_SIZE) -> Iterator[str]:
+    """
+    Legge un file binario (es. l'upload già riversato su disco da Starlette) a blocchi
+    e lo decodifica in modo incrementale: un carattere multibyte a cavallo tra due
+    blocchi viene ricomposto. Solleva UnicodeDecodeError se il contenuto non è valido.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="strict")
+    fileobj.seek(0)
+    while block := fileobj.read(block_size):
+        text = decoder.decode(block)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def read_text_upload(fileobj: BinaryIO, normalize: bool = True) -> str:
+    """
+    Restituisce il testo di un upload, normalizzato se richiesto, senza mai tenere in
+    memoria insieme i byte originali e il testo decodificato. Funzione bloccante:
+    dall'event loop va eseguita in un thread.
+    """
+    blocks = iter_decoded_blocks(fileobj)
+    if normalize:
+        return DEFAULT_NORMALIZER.normalize_blocks(blocks)
+    return "".join(blocks)
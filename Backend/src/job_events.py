@@ -0,0 +1,119 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from .metrics import JobTimings
+from .request_dedup import DedupStats
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class JobProgress:
+    """
+    Contatori di avanzamento di un job, con stima del tempo rimanente, le chiamate LLM
+    risparmiate dalla deduplicazione (`dedup`) e, se richiesti, i tempi per fase (`timings`).
+    """
+    def __init__(self, total_units: int, timings: Optional[JobTimings] = None, dedup: Optional[DedupStats] = None):
+        self.total_units = total_units
+        self.done_units = 0
+        self.failed_units = 0
+        self.started_at = time.monotonic()
+        self.timings = timings
+        self.dedup = dedup
+
+    def record(self, failed: bool = False) -> None:
+        self.done_units += 1
+        if failed:
+            self.failed_units += 1
+
+    def eta_seconds(self) -> Optional[float]:
+        if not self.done_units:
+            return None
+        elapsed = time.monotonic() - self.started_at
+        remaining = self.total_units - self.done_units
+        return round(elapsed / self.done_units * remaining, 1)
+
+    def as_dict(self) -> Dict:
+        progress = {
+            "total": self.total_units,
+            "done": self.done_units,
+            "failed": self.failed_units,
+            "eta_seconds": self.eta_seconds(),
+        }
+        if self.dedup is not None:
+            progress["saved_calls"] = self.dedup.as_dict()
+        if self.timings is not None:
+            progress["timings"] = self.timings.as_dict()
+        return progress
+
+
+class JobEventBus:
+    """
+    Distribuisce gli eventi dei job (avanzamento, cambi di stato) ai client in ascolto
+    nello stesso processo. La versione di ogni evento è quella del job store, così
+    ETag e long-polling restano coerenti anche tra worker diversi.
+    """
+    def __init__(self, max_queue_size: int = 1000):
+        self.max_queue_size = max_queue_size
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._conditions: Dict[str, asyncio.Condition] = {}
+
+    def _condition(self, job_id: str) -> asyncio.Condition:
+        if job_id not in self._conditions:
+            self._conditions[job_id] = asyncio.Condition()
+        return self._conditions[job_id]
+
+    async def publish(self, job_id: str, event_type: str, version: int, data: Dict) -> None:
+        event = {"type": event_type, "version": version, **data}
+        for queue in self._subscribers.get(job_id, []):
+            # Un client troppo lento perde gli eventi intermedi, non blocca il job.
+            if queue.qsize() < self.max_queue_size:
+                queue.put_nowait(event)
+        condition = self._condition(job_id)
+        async with condition:
+            condition.notify_all()
+
+    def subscribe(self, job_id: str) -> "JobSubscription":
+        """Registra subito un nuovo ascoltatore: nessun evento successivo va perso."""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        return JobSubscription(self, job_id, queue)
+
+    def _unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(job_id, [])
+        if queue in queues:
+            queues.remove(queue)
+        if not queues:
+            self._subscribers.pop(job_id, None)
+
+    async def wait_for_event(self, job_id: str, timeout: float) -> bool:
+        """Attende (al massimo `timeout` secondi) il prossimo evento del job in questo processo."""
+        condition = self._condition(job_id)
+        try:
+            async with condition:
+                await asyncio.wait_for(condition.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def forget(self, job_id: str) -> None:
+        """Libera lo stato di un job che non verrà più aggiornato."""
+        self._conditions.pop(job_id, None)
+
+
+class JobSubscription:
+    """Coda di eventi di un singolo client in ascolto su un job."""
+    def __init__(self, bus: JobEventBus, job_id: str, queue: asyncio.Queue):
+        self.bus = bus
+        self.job_id = job_id
+        self.queue = queue
+
+    async def next_event(self, timeout: float) -> Optional[Dict]:
+        """Restituisce il prossimo evento, o None se non arriva nulla entro `timeout` secondi."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.bus._unsubscribe(self.job_id, self.queue)
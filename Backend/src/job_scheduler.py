@@ -0,0 +1,227 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Literal, Optional, Set
+
+from .metrics import UNITS_INFLIGHT, current_job_id, observe_stage
+
+logger = logging.getLogger(__name__)
+
+Priority = Literal["interactive", "bulk"]
+WorkUnit = Callable[[], Awaitable[Any]]
+
+# Priorità del job a cui appartiene l'unità in esecuzione nel task corrente (per il rate limiter).
+current_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("current_priority", default="interactive")
+
+
+class JobCancelledError(Exception):
+    """Sollevata da `UnitBatch.wait()` quando il job viene annullato."""
+
+
+class UnitBatch:
+    """
+    Gruppo di unità di lavoro inviate insieme (tipicamente tutti i chunk×prompt di un file).
+    Le unità vengono create solo quando un worker è libero: l'iteratore non viene mai
+    consumato in anticipo, quindi un job enorme non alloca migliaia di coroutine pendenti.
+    """
+    def __init__(self, job: "_Job", units: Iterable[WorkUnit]):
+        self.job = job
+        self._units = iter(units)
+        self._results: Dict[int, Any] = {}
+        self._next_index = 0
+        self._in_flight = 0
+        self._exhausted = False
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def _pull(self) -> Optional[tuple]:
+        if self._exhausted:
+            return None
+        try:
+            unit = next(self._units)
+        except StopIteration:
+            self._exhausted = True
+            self._maybe_finish()
+            return None
+        index = self._next_index
+        self._next_index += 1
+        self._in_flight += 1
+        return index, unit
+
+    def _unit_done(self, index: int, result: Any) -> None:
+        self._in_flight -= 1
+        self._results[index] = result
+        self._maybe_finish()
+
+    def _unit_failed(self, error: BaseException) -> None:
+        self._in_flight -= 1
+        self._fail(error)
+
+    def _maybe_finish(self) -> None:
+        if self._exhausted and self._in_flight == 0 and not self._future.done():
+            self._future.set_result([self._results[i] for i in range(self._next_index)])
+
+    def _fail(self, error: BaseException) -> None:
+        self._exhausted = True
+        if not self._future.done():
+            self._future.set_exception(error)
+
+    async def wait(self) -> List[Any]:
+        """Attende tutte le unità e restituisce i risultati nell'ordine di invio."""
+        return await self._future
+
+
+class _Job:
+    def __init__(self, job_id: str, priority: Priority):
+        self.job_id = job_id
+        self.priority = priority
+        self.batches: Deque[UnitBatch] = deque()
+        self.tasks: Set[asyncio.Task] = set()
+        self.cancelled = False
+        # Da quando il job è in coda in attesa del suo turno (per la metrica `queue_wait`).
+        self.ready_since = time.monotonic()
+
+
+class JobScheduler:
+    """
+    Scheduler globale delle chiamate LLM con coda limitata e fairness tra i job.
+    Al massimo `max_concurrent_units` unità sono in esecuzione contemporaneamente;
+    la prossima unità viene scelta a rotazione tra i job (e, dentro un job, tra i suoi file),
+    dando precedenza ai job "interactive" ma servendo comunque un job "bulk" ogni
+    `interactive_weight` unità interattive, così nessuno resta fermo.
+    """
+    def __init__(self, max_concurrent_units: int = 28, interactive_weight: int = 3):
+        self.max_concurrent_units = max_concurrent_units
+        self.interactive_weight = interactive_weight
+        self._jobs: Dict[str, _Job] = {}
+        self._ready: Dict[str, Deque[_Job]] = {"interactive": deque(), "bulk": deque()}
+        self._interactive_streak = 0
+        self._work_available: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "JobScheduler":
+        """Costruisce lo scheduler dalla sezione `scheduler` di config.json."""
+        return cls(
+            max_concurrent_units=config.get("max_concurrent_units", 28),
+            interactive_weight=config.get("interactive_weight", 3),
+        )
+
+    def _ensure_dispatcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done() or self._loop is not loop:
+            self._loop = loop
+            self._work_available = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrent_units)
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    def submit(self, job_id: str, units: Iterable[WorkUnit], priority: Priority = "interactive") -> UnitBatch:
+        """Accoda un gruppo di unità per `job_id`. Va chiamato dall'event loop."""
+        self._ensure_dispatcher()
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = _Job(job_id, priority)
+            self._jobs[job_id] = job
+        batch = UnitBatch(job, units)
+        if job.cancelled:
+            batch._fail(JobCancelledError(job_id))
+            return batch
+        job.batches.append(batch)
+        if job not in self._ready[job.priority]:
+            job.ready_since = time.monotonic()
+            self._ready[job.priority].append(job)
+        self._work_available.set()
+        return batch
+
+    def cancel(self, job_id: str) -> bool:
+        """Annulla subito le unità in coda e quelle in esecuzione del job."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancelled = True
+        if job in self._ready[job.priority]:
+            self._ready[job.priority].remove(job)
+        for batch in job.batches:
+            batch._fail(JobCancelledError(job_id))
+        job.batches.clear()
+        for task in list(job.tasks):
+            task.cancel()
+        logger.info(f"Scheduler: job {job_id} annullato ({len(job.tasks)} chiamate in corso interrotte).")
+        return True
+
+    def release(self, job_id: str) -> None:
+        """Dimentica un job terminato (o annullato, così può essere ripreso in seguito)."""
+        job = self._jobs.get(job_id)
+        if job is not None and (job.cancelled or (not job.batches and not job.tasks)):
+            del self._jobs[job_id]
+
+    def _pick_job(self) -> Optional[_Job]:
+        interactive, bulk = self._ready["interactive"], self._ready["bulk"]
+        if interactive and (not bulk or self._interactive_streak < self.interactive_weight):
+            self._interactive_streak += 1
+            return interactive.popleft()
+        if bulk:
+            self._interactive_streak = 0
+            return bulk.popleft()
+        return None
+
+    def _next_unit(self) -> Optional[tuple]:
+        while True:
+            job = self._pick_job()
+            if job is None:
+                return None
+            while job.batches:
+                batch = job.batches[0]
+                pulled = batch._pull()
+                if pulled is None:
+                    job.batches.popleft()
+                    continue
+                # Rotazione tra i file del job e tra i job della stessa priorità.
+                job.batches.rotate(-1)
+                now = time.monotonic()
+                observe_stage("queue_wait", now - job.ready_since, job_id=job.job_id)
+                job.ready_since = now
+                self._ready[job.priority].append(job)
+                return job, batch, pulled
+            # Il job non ha più unità da distribuire: resta solo in attesa di quelle in corso.
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            await self._slots.acquire()
+            picked = self._next_unit()
+            while picked is None:
+                self._work_available.clear()
+                await self._work_available.wait()
+                picked = self._next_unit()
+            job, batch, (index, unit) = picked
+            task = asyncio.create_task(self._run_unit(job, batch, index, unit))
+            job.tasks.add(task)
+
+    async def _run_unit(self, job: _Job, batch: UnitBatch, index: int, unit: WorkUnit) -> None:
+        # Le fasi misurate durante l'unità (attesa nel rate limiter, chiamata LLM) vanno al suo job.
+        current_job_id.set(job.job_id)
+        current_priority.set(job.priority)
+        UNITS_INFLIGHT.inc()
+        try:
+            result = await unit()
+        except asyncio.CancelledError:
+            batch._unit_failed(JobCancelledError(job.job_id))
+        except Exception as e:
+            logger.error(f"Scheduler: unità del job {job.job_id} fallita: {e}", exc_info=True)
+            batch._unit_failed(e)
+        else:
+            batch._unit_done(index, result)
+        finally:
+            UNITS_INFLIGHT.dec()
+            job.tasks.discard(asyncio.current_task())
+            self._slots.release()
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrent_units": self.max_concurrent_units,
+            "in_flight": sum(len(job.tasks) for job in self._jobs.values()),
+            "queued_jobs": {priority: len(queue) for priority, queue in self._ready.items()},
+        }
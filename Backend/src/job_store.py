@@ -0,0 +1,348 @@
+import gzip
+import json
+import logging
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_STORE_DIR = Path("/tmp/textflow_jobs")
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+ACTIVE_STATUSES = ("pending", "processing")
+READ_BLOCK_SIZE = 256 * 1024
+STALE_JOB_DETAIL = "Job interrotto: il worker che lo eseguiva non risponde più."
+
+
+def iter_gzip_file(path: Path) -> Iterator[bytes]:
+    """Contenuto decompresso di un output salvato, a blocchi."""
+    with gzip.open(path, "rb") as f:
+        while block := f.read(READ_BLOCK_SIZE):
+            yield block
+
+
+class JobStore:
+    """
+    Archivio persistente dei job: metadati e stato in SQLite, output compressi con gzip
+    su disco (`<root>/<job_id>/outputs/`). Essendo condiviso tramite file, qualunque worker
+    uvicorn può rispondere per qualunque job. Le transizioni di stato sono atomiche
+    (`UPDATE ... WHERE status IN (...)`) e i job terminati scadono dopo `ttl_seconds`.
+    Ogni job attivo appartiene al processo che lo ha avviato (`worker_id`), che lo tiene in
+    vita con `heartbeat`: solo i job senza heartbeat per `stale_after_seconds` sono abbandonati.
+    """
+    def __init__(self, root: Path, ttl_seconds: float = 24 * 3600, stale_after_seconds: float = 3600):
+        self.root = Path(root)
+        self.ttl_seconds = ttl_seconds
+        self.stale_after_seconds = stale_after_seconds
+        self.worker_id = uuid.uuid4().hex
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.root / "jobs.sqlite3"), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " detail TEXT,"
+            " version INTEGER NOT NULL DEFAULT 1,"
+            " progress TEXT,"
+            " meta TEXT NOT NULL DEFAULT '{}',"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " finished_at REAL,"
+            " owner TEXT,"
+            " heartbeat_at REAL)"
+        )
+        # Archivi creati prima dell'heartbeat: i job esistenti restano senza proprietario.
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, finished_at)")
+        # Checkpoint dei singoli (file, chunk, prompt): permettono di riprendere un job
+        # rielaborando solo le unità fallite.
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS units ("
+            " job_id TEXT NOT NULL,"
+            " file_idx INTEGER NOT NULL,"
+            " chunk_idx INTEGER NOT NULL,"
+            " prompt_name TEXT NOT NULL,"
+            " failed INTEGER NOT NULL,"
+            " result TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, file_idx, chunk_idx, prompt_name))"
+        )
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "JobStore":
+        """Costruisce lo store dalla sezione `job_store` di config.json."""
+        return cls(
+            root=Path(config.get("root_dir", DEFAULT_JOB_STORE_DIR)),
+            ttl_seconds=float(config.get("ttl_hours", 24) * 3600),
+            stale_after_seconds=float(config.get("stale_after_minutes", 60) * 60),
+        )
+
+    def job_dir(self, job_id: str) -> Path:
+        return self.root / job_id
+
+    def _row_to_job(self, row: sqlite3.Row) -> Dict:
+        return {
+            "job_id": row["job_id"],
+            "status": row["status"],
+            "detail": row["detail"],
+            "version": row["version"],
+            "progress": json.loads(row["progress"]) if row["progress"] else None,
+            "meta": json.loads(row["meta"]),
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "finished_at": row["finished_at"],
+        }
+
+    def create(self, job_id: str, detail: str, meta: Dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, status, detail, meta, created_at, updated_at, owner, heartbeat_at)"
+                " VALUES (?, 'pending', ?, ?, ?, ?, ?, ?)",
+                (job_id, detail, json.dumps(meta), now, now, self.worker_id, now),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def version(self, job_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else 0
+
+    def transition(self, job_id: str, from_statuses: Iterable[str], to_status: str, detail: Optional[str] = None) -> Optional[int]:
+        """
+        Porta il job in `to_status` solo se si trova in uno degli stati `from_statuses`.
+        Restituisce la nuova versione, oppure None se la transizione non era valida.
+        Un job che torna attivo appartiene da quel momento a questo processo.
+        """
+        from_statuses = tuple(from_statuses)
+        now = time.time()
+        finished_at = now if to_status in FINISHED_STATUSES else None
+        owner = self.worker_id if to_status in ACTIVE_STATUSES else None
+        placeholders = ",".join("?" for _ in from_statuses)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET status = ?, detail = COALESCE(?, detail), version = version + 1,"
+                f" updated_at = ?, finished_at = ?, owner = COALESCE(?, owner), heartbeat_at = ?"
+                f" WHERE job_id = ? AND status IN ({placeholders})",
+                (to_status, detail, now, finished_at, owner, now, job_id, *from_statuses),
+            )
+            if cursor.rowcount != 1:
+                return None
+            return self._conn.execute("SELECT version FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+
+    def update_progress(self, job_id: str, progress: Dict) -> Optional[int]:
+        """
+        Aggiorna l'avanzamento di un job attivo e restituisce la nuova versione.
+        Restituisce None se il job non è più attivo (ad esempio è stato annullato da un altro worker).
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET progress = ?, version = version + 1, updated_at = ?"
+                " WHERE job_id = ? AND status IN ('pending', 'processing')",
+                (json.dumps(progress), time.time(), job_id),
+            )
+            if cursor.rowcount != 1:
+                return None
+            return self._conn.execute("SELECT version FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+
+    def update_meta(self, job_id: str, **values) -> None:
+        """Aggiorna alcune chiavi dei metadati del job (lettura e scrittura nella stessa transazione)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT meta FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                meta = json.loads(row[0]) if row else {}
+                meta.update(values)
+                self._conn.execute("UPDATE jobs SET meta = ?, updated_at = ? WHERE job_id = ?", (json.dumps(meta), time.time(), job_id))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # --- Checkpoint delle unità e richiesta originale ---
+
+    def save_unit(self, job_id: str, file_idx: int, chunk_idx: int, prompt_name: str, result: str, failed: bool) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO units (job_id, file_idx, chunk_idx, prompt_name, failed, result) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, file_idx, chunk_idx, prompt_name, int(failed), result),
+            )
+
+    def save_units(self, job_id: str, file_idx: int, results: Dict[Tuple[int, str], str]) -> None:
+        """Salva in un'unica transazione risultati riusciti di un file (es. quelli ripresi da un altro job)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO units (job_id, file_idx, chunk_idx, prompt_name, failed, result) VALUES (?, ?, ?, ?, 0, ?)",
+                    ((job_id, file_idx, chunk_idx, prompt_name, result) for (chunk_idx, prompt_name), result in results.items()),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def completed_units(self, job_id: str, file_idx: int) -> Dict[Tuple[int, str], str]:
+        """Risultati riusciti già salvati per un file del job, con chiave `(chunk_idx, prompt_name)`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_idx, prompt_name, result FROM units WHERE job_id = ? AND file_idx = ? AND failed = 0",
+                (job_id, file_idx),
+            ).fetchall()
+        return {(row[0], row[1]): row[2] for row in rows}
+
+    def count_units(self, job_id: str) -> Dict[str, int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(failed), 0) FROM units WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return {"saved": row[0], "failed": row[1]}
+
+    def save_request(self, job_id: str, request_json: str) -> None:
+        """Conserva la richiesta originale del job, necessaria per riprenderlo."""
+        job_dir = self.job_dir(job_id)
+        job_dir.mkdir(parents=True, exist_ok=True)
+        with gzip.open(job_dir / "request.json.gz", "wt", encoding="utf-8", compresslevel=6) as f:
+            f.write(request_json)
+
+    def load_request(self, job_id: str) -> Optional[str]:
+        path = self.job_dir(job_id) / "request.json.gz"
+        if not path.is_file():
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return f.read()
+
+    # --- Output su disco ---
+
+    def save_outputs(self, job_id: str, outputs: Dict[str, Union[bytes, Path]]) -> None:
+        """
+        Salva gli output compressi; il nome originale di ogni file resta nei metadati.
+        Un output può essere un file di testo già scritto su disco (es. l'output parziale di
+        `partial_output_path`): viene compresso a blocchi ed eliminato una volta registrato.
+        """
+        outputs_dir = self.job_dir(job_id) / "outputs"
+        outputs_dir.mkdir(parents=True, exist_ok=True)
+        index = []
+        for position, (filename, content) in enumerate(outputs.items()):
+            stored_name = f"{position:05d}.md.gz"
+            with gzip.open(outputs_dir / stored_name, "wb", compresslevel=6) as f:
+                if isinstance(content, Path):
+                    with open(content, "rb") as src:
+                        shutil.copyfileobj(src, f, READ_BLOCK_SIZE)
+                else:
+                    f.write(content)
+                size = f.tell()
+            index.append({"name": filename, "file": stored_name, "size": size})
+        self.update_meta(job_id, outputs=index)
+        for content in outputs.values():
+            if isinstance(content, Path):
+                content.unlink(missing_ok=True)
+
+    def partial_output_path(self, job_id: str, file_idx: int) -> Path:
+        """File (non compresso) in cui l'output di un file del job viene scritto mentre il job è in corso."""
+        return self.job_dir(job_id) / "partial" / f"{file_idx:05d}.md"
+
+    def list_outputs(self, job: Dict) -> List[Tuple[str, Path]]:
+        """Restituisce `(nome_file, percorso_compresso)` per ogni output del job."""
+        outputs_dir = self.job_dir(job["job_id"]) / "outputs"
+        return [(item["name"], outputs_dir / item["file"]) for item in job["meta"].get("outputs", [])]
+
+    def iter_output(self, stored_path: Path) -> Iterator[bytes]:
+        return iter_gzip_file(stored_path)
+
+    def read_output(self, stored_path: Path) -> bytes:
+        with gzip.open(stored_path, "rb") as f:
+            return f.read()
+
+    def archive_path(self, job_id: str) -> Path:
+        return self.job_dir(job_id) / "archive.zip"
+
+    def delete(self, job_id: str) -> bool:
+        """Elimina un job terminato con tutti i suoi file."""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM jobs WHERE job_id = ? AND status IN ({','.join('?' for _ in FINISHED_STATUSES)})",
+                (job_id, *FINISHED_STATUSES),
+            )
+            if cursor.rowcount == 1:
+                self._conn.execute("DELETE FROM units WHERE job_id = ?", (job_id,))
+        if cursor.rowcount != 1:
+            return False
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return True
+
+    # --- Scadenza ---
+
+    def heartbeat(self) -> int:
+        """Segnala che questo processo è vivo: i suoi job attivi non vengono considerati abbandonati."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('pending', 'processing')",
+                (time.time(), self.worker_id),
+            )
+        return cursor.rowcount
+
+    def fail_stale(self) -> List[Tuple[str, int]]:
+        """
+        Marca come falliti i job attivi il cui processo non manda heartbeat da più di
+        `stale_after_seconds` (ad esempio perché è stato riavviato). Un job solo lento, in
+        attesa dello scheduler o del rate limiter, ha un proprietario vivo e non viene toccato.
+        Restituisce (job_id, nuova versione) di ogni job fallito, per pubblicarne l'evento.
+        """
+        now = time.time()
+        cutoff = now - self.stale_after_seconds
+        stale_condition = "status IN ('pending', 'processing') AND COALESCE(heartbeat_at, updated_at) < ?"
+        failed = []
+        with self._lock:
+            candidates = [row[0] for row in self._conn.execute(f"SELECT job_id FROM jobs WHERE {stale_condition}", (cutoff,))]
+            for job_id in candidates:
+                # La condizione viene ricontrollata: un altro processo può aver ripreso il job nel frattempo.
+                cursor = self._conn.execute(
+                    f"UPDATE jobs SET status = 'failed', detail = ?, version = version + 1, updated_at = ?,"
+                    f" finished_at = ? WHERE job_id = ? AND {stale_condition}",
+                    (STALE_JOB_DETAIL, now, now, job_id, cutoff),
+                )
+                if cursor.rowcount == 1:
+                    version = self._conn.execute("SELECT version FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+                    failed.append((job_id, version))
+        if failed:
+            logger.warning(f"Job store: {len(failed)} job senza heartbeat marcati come falliti.")
+        return failed
+
+    def evict_expired(self) -> List[str]:
+        """Elimina i job terminati da più di `ttl_seconds` (metadati e file)."""
+        now = time.time()
+        with self._lock:
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT job_id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (now - self.ttl_seconds,)
+            )]
+            self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in expired])
+            self._conn.executemany("DELETE FROM units WHERE job_id = ?", [(job_id,) for job_id in expired])
+        for job_id in expired:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        if expired:
+            logger.info(f"Job store: eliminati {len(expired)} job scaduti.")
+        return expired
+
+    def referenced_attachments(self) -> Set[str]:
+        """Cartelle allegati usate dai job presenti nello store (`meta.attachments`)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT meta FROM jobs WHERE meta LIKE '%\"attachments\"%'").fetchall()
+        return {path for row in rows for path in json.loads(row[0]).get("attachments", [])}
+
+    def count_by_status(self) -> Dict[str, int]:
+        with self._lock:
+            return {row[0]: row[1] for row in self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
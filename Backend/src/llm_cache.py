@@ -0,0 +1,145 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path("/tmp/textflow_cache")
+
+
+def make_cache_key(model_name: str, temperature: float, formatted_prompt: str, text_chunk: str) -> str:
+    """Chiave content-addressed: SHA-256 di modello, temperatura, prompt formattato e chunk."""
+    payload = json.dumps([model_name, temperature, formatted_prompt, text_chunk], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache persistente su disco (SQLite) delle risposte dell'LLM.
+    Le voci scadono dopo `ttl_seconds` e, quando la dimensione totale supera
+    `max_bytes`, vengono eliminate quelle usate meno di recente. La dimensione totale è
+    tenuta aggiornata da trigger in una riga di `cache_meta`: nessuna scansione a ogni `set`,
+    e resta corretta anche con più processi sullo stesso file.
+    """
+    def __init__(self, db_path: Path, max_bytes: int = 256 * 1024 * 1024, ttl_seconds: float = 7 * 24 * 3600):
+        self.db_path = Path(db_path)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_created ON responses(created_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Cache create prima del contatore: il totale viene calcolato una volta sola.
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO cache_meta (name, value)"
+                    " SELECT 'total_size', COALESCE(SUM(size), 0) FROM responses"
+                )
+                self._conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS responses_size_insert AFTER INSERT ON responses BEGIN"
+                    " UPDATE cache_meta SET value = value + NEW.size WHERE name = 'total_size'; END"
+                )
+                self._conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS responses_size_delete AFTER DELETE ON responses BEGIN"
+                    " UPDATE cache_meta SET value = value - OLD.size WHERE name = 'total_size'; END"
+                )
+                self._conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS responses_size_update AFTER UPDATE OF size ON responses BEGIN"
+                    " UPDATE cache_meta SET value = value + NEW.size - OLD.size WHERE name = 'total_size'; END"
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional["ResponseCache"]:
+        """Costruisce la cache dalla sezione `llm_cache` di config.json (None se disabilitata)."""
+        if not config.get("enabled", True):
+            return None
+        cache_dir = Path(config.get("cache_dir", DEFAULT_CACHE_DIR))
+        return cls(
+            db_path=cache_dir / "llm_responses.sqlite3",
+            max_bytes=int(config.get("max_size_mb", 256) * 1024 * 1024),
+            ttl_seconds=float(config.get("ttl_hours", 168) * 3600),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            # Upsert (non INSERT OR REPLACE): la cancellazione implicita di REPLACE non attiva i trigger.
+            self._conn.execute(
+                "INSERT INTO responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET response = excluded.response, size = excluded.size,"
+                " created_at = excluded.created_at, accessed_at = excluded.accessed_at",
+                (key, response, size, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = self._total_size()
+        if total <= self.max_bytes:
+            return
+        # Eliminiamo le voci meno usate di recente finché non rientriamo nel budget.
+        to_free = total - self.max_bytes
+        freed = 0
+        keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+            keys.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        logger.info(f"Cache LLM: eliminate {len(keys)} voci ({freed} byte) per rispettare il limite di dimensione.")
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT value FROM cache_meta WHERE name = 'total_size'").fetchone()[0]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            size = self._total_size()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+        }
@@ -1,19 +1,133 @@
 import asyncio
-from llama_index.llms.gemini import Gemini
+import logging
+import threading
+import time
+from functools import lru_cache
+from llama_index.llms.google_genai import GoogleGenAI
 from llama_index.core import PromptTemplate
-from typing import Dict, Any
+from typing import Callable, Dict, Any, Tuple
 
-def get_llm(model_config: Dict[str, Any], google_api_key: str) -> Gemini:
-    """Inizializza e restituisce un'istanza del modello LLM di Gemini."""
+DEFAULT_MODEL_NAME = "models/gemini-1.5-flash-latest"
+DEFAULT_TEMPERATURE = 0.7
+# Unica variabile che i template dei prompt possono usare.
+TEXT_CHUNK_VARIABLE = "text_chunk"
+
+def get_llm(model_config: Dict[str, Any], google_api_key: str) -> GoogleGenAI:
+    """
+    Inizializza e restituisce un'istanza del modello LLM di Gemini. Ogni istanza ha il proprio
+    `google.genai.Client` con la propria API key: più key convivono nello stesso processo.
+    I tentativi sono gestiti da RetryPolicy e dal router (che cambia key), non dal client.
+    """
     if not google_api_key:
         raise ValueError("API key di Google non fornita.")
-    return Gemini(
-        model_name=model_config.get("model_name", "models/gemini-1.5-flash-latest"),
+    return GoogleGenAI(
+        model=model_config.get("model_name", DEFAULT_MODEL_NAME),
         api_key=google_api_key,
-        temperature=model_config.get("temperature", 0.7)
+        temperature=model_config.get("temperature", DEFAULT_TEMPERATURE),
+        max_retries=0,
     )
 
-def call_llm_with_prompt(llm: Gemini, prompt_template_str: str, text_chunk: str) -> str:
+# Crea un client LLM (con `acomplete`) per una configurazione del modello e una API key.
+LLMFactory = Callable[[Dict[str, Any], str], Any]
+
+def make_llm_factory(providers_config: Dict[str, Any]) -> LLMFactory:
+    """Provider LLM scelto in `providers.llm` di config.json: "gemini" (default) o "fake"."""
+    name = providers_config.get("llm", "gemini")
+    if name == "gemini":
+        return get_llm
+    if name == "fake":
+        from .fake_providers import FakeLLM, FakeProviderOptions
+        options = FakeProviderOptions.from_dict(providers_config.get("fake_llm", {}))
+        return lambda model_config, google_api_key: FakeLLM(model_config.get("model_name", DEFAULT_MODEL_NAME), options)
+    raise ValueError(f"Provider LLM sconosciuto: '{name}'.")
+
+class LLMClientPool:
+    """
+    Client LLM condivisi da tutti i job del processo, indicizzati per (modello, temperatura, API key).
+    Creare un client Gemini costa una richiesta di rete (metadati del modello) e una nuova
+    connessione: con il pool avviene una sola volta per combinazione, poi il client (e le sue
+    connessioni) viene riusato. I contatori permettono di stimare la latenza risparmiata.
+    """
+    def __init__(self, factory: LLMFactory = get_llm):
+        self._factory = factory
+        self._clients: Dict[Tuple[str, float, str], GoogleGenAI] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.creation_seconds = 0.0
+
+    @staticmethod
+    def key(model_config: Dict[str, Any], google_api_key: str) -> Tuple[str, float, str]:
+        return (
+            model_config.get("model_name", DEFAULT_MODEL_NAME),
+            float(model_config.get("temperature", DEFAULT_TEMPERATURE)),
+            google_api_key,
+        )
+
+    def get(self, model_config: Dict[str, Any], google_api_key: str) -> GoogleGenAI:
+        """Restituisce il client per la configurazione, creandolo solo alla prima richiesta. Bloccante."""
+        key = self.key(model_config, google_api_key)
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is not None:
+                self.reused += 1
+                return llm
+            start = time.perf_counter()
+            llm = self._factory(model_config, google_api_key)
+            self.creation_seconds += time.perf_counter() - start
+            self.created += 1
+            self._clients[key] = llm
+            logging.info(f"Creato client LLM per {key[0]} (temperatura {key[1]}), in {time.perf_counter() - start:.2f}s")
+            return llm
+
+    def get_existing(self, model_config: Dict[str, Any], google_api_key: str) -> GoogleGenAI | None:
+        """Come `get`, ma non crea mai il client (non bloccante): None se non esiste ancora."""
+        with self._lock:
+            llm = self._clients.get(self.key(model_config, google_api_key))
+            if llm is not None:
+                self.reused += 1
+            return llm
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            avg_creation = self.creation_seconds / self.created if self.created else 0.0
+            return {
+                "clients": len(self._clients),
+                "created": self.created,
+                "reused": self.reused,
+                "avg_creation_ms": round(avg_creation * 1000, 1),
+                # Ogni riuso evita una creazione: stima del tempo risparmiato.
+                "estimated_saved_ms": round(self.reused * avg_creation * 1000, 1),
+            }
+
+DEFAULT_LLM_POOL = LLMClientPool()
+
+@lru_cache(maxsize=512)
+def compile_prompt(prompt_template_str: str) -> PromptTemplate:
+    """
+    Compila e valida un template una sola volta: le chiamate successive con lo stesso
+    testo riusano lo stesso `PromptTemplate`. Solleva ValueError se il template non
+    può essere formattato; segnala i template che non usano `{text_chunk}`
+    (il chunk non verrebbe mai inviato al modello).
+    """
+    template = PromptTemplate(prompt_template_str)
+    try:
+        template.format(text_chunk="")
+    except Exception as e:
+        raise ValueError(f"Template del prompt non valido: {e}") from e
+    if TEXT_CHUNK_VARIABLE not in template.template_vars:
+        logging.warning(f"Il prompt non contiene {{{TEXT_CHUNK_VARIABLE}}}: il testo del chunk non verrà inviato.")
+    return template
+
+def format_prompt(prompt_template_str: str, text_chunk: str) -> str:
+    """Inserisce il chunk di testo nel template del prompt."""
+    return compile_prompt(prompt_template_str).format(text_chunk=text_chunk)
+
+def call_llm_with_prompt(llm: GoogleGenAI, prompt_template_str: str, text_chunk: str) -> str:
     """
     [DEPRECATA] Versione sincrona. Lasciamola per compatibilità o la buttiamo.
     """
@@ -27,14 +141,13 @@ def call_llm_with_prompt(llm: Gemini, prompt_template_str: str, text_chunk: str)
         raise e
 
 # --- NUOVA FUNZIONE ASINCRONA ---
-async def call_llm_with_prompt_async(llm: Gemini, prompt_template_str: str, text_chunk: str) -> str:
+async def call_llm_with_prompt_async(llm: GoogleGenAI, prompt_template_str: str, text_chunk: str) -> str:
     """
     Formatta un prompt con un chunk di testo e chiama l'LLM in modo ASINCRONO.
     Usa 'acomplete' invece di 'complete'.
     """
     try:
-        prompt_template = PromptTemplate(prompt_template_str)
-        formatted_prompt = prompt_template.format(text_chunk=text_chunk)
+        formatted_prompt = format_prompt(prompt_template_str, text_chunk)
         # La magia è qui: `await llm.acomplete()`
         response = await llm.acomplete(formatted_prompt)
         return response.text
@@ -42,3 +155,8 @@ async def call_llm_with_prompt_async(llm: Gemini, prompt_template_str: str, text
         print(f"Errore durante la chiamata asincrona all'LLM: {e}")
         # L'eccezione verrà gestita dal chiamante
         raise e
+
+async def call_llm_async(llm: GoogleGenAI, formatted_prompt: str) -> str:
+    """Chiama l'LLM in modo ASINCRONO con un prompt già completo (es. richieste raggruppate)."""
+    response = await llm.acomplete(formatted_prompt)
+    return response.text
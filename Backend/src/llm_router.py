@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from .llm_handler import DEFAULT_LLM_POOL, DEFAULT_MODEL_NAME, DEFAULT_TEMPERATURE, LLMClientPool
+from .rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LLMRoute:
+    """Una combinazione (modello, API key) su cui può essere inviata una richiesta."""
+    model_name: str
+    key_id: str
+    api_key: str = field(repr=False)
+
+
+@dataclass
+class KeyUsage:
+    """Contatori di utilizzo di una API key."""
+    requests: int = 0
+    successes: int = 0
+    quota_errors: int = 0
+    errors: int = 0
+    estimated_tokens: int = 0
+    failovers: int = 0
+    requests_by_model: Dict[str, int] = field(default_factory=dict)
+
+
+def parse_api_keys(keys: Iterable[str]) -> "OrderedDict[str, str]":
+    """Assegna alle API key (senza duplicati né vuote) gli id `key1`, `key2`, ... nell'ordine dato."""
+    unique = []
+    for key in keys:
+        key = key.strip()
+        if key and key not in unique:
+            unique.append(key)
+    return OrderedDict((f"key{idx}", key) for idx, key in enumerate(unique, start=1))
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Impronta non reversibile di una API key, da mostrare al posto della key."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class LLMRouter:
+    """
+    Distribuisce le richieste su più API key e modelli di riserva.
+
+    Per il modello richiesto sceglie la key con l'attesa stimata più breve nel rate limiter
+    (ogni coppia modello/key ha un budget separato). Una coppia che riceve un errore di quota
+    resta esclusa per `quota_cooldown_seconds`; se tutte le key del modello richiesto sono
+    esaurite si passa, nell'ordine, ai `fallback_models`.
+    """
+    def __init__(
+        self, api_keys: "OrderedDict[str, str]", fallback_models: Optional[List[str]] = None,
+        rate_limiter: Optional[RateLimiter] = None, llm_pool: Optional[LLMClientPool] = None,
+        quota_cooldown_seconds: float = 60.0
+    ):
+        if not api_keys:
+            raise ValueError("API key di Google non fornita.")
+        self.api_keys = api_keys
+        self.fallback_models = list(fallback_models or [])
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.llm_pool = llm_pool or DEFAULT_LLM_POOL
+        self.quota_cooldown_seconds = quota_cooldown_seconds
+        self._cooldown_until: Dict[LLMRoute, float] = {}
+        self._usage: Dict[str, KeyUsage] = {key_id: KeyUsage() for key_id in api_keys}
+
+    @classmethod
+    def from_config(
+        cls, api_keys: Iterable[str], config: Dict, rate_limiter: Optional[RateLimiter] = None,
+        llm_pool: Optional[LLMClientPool] = None
+    ) -> "LLMRouter":
+        """Costruisce il router dalla sezione `llm_routing` di config.json."""
+        return cls(
+            parse_api_keys(api_keys),
+            fallback_models=config.get("fallback_models", []),
+            rate_limiter=rate_limiter,
+            llm_pool=llm_pool,
+            quota_cooldown_seconds=config.get("quota_cooldown_seconds", 60.0),
+        )
+
+    @property
+    def multi_key(self) -> bool:
+        return len(self.api_keys) > 1
+
+    def limiter_key(self, route: LLMRoute) -> Optional[str]:
+        """Id della key per il rate limiter: con una sola key il budget resta quello del modello."""
+        return route.key_id if self.multi_key else None
+
+    def models_for(self, model_config: Dict[str, Any]) -> List[str]:
+        """Modello richiesto seguito dai modelli di riserva (quelli della richiesta o della configurazione)."""
+        requested = model_config.get("model_name", DEFAULT_MODEL_NAME)
+        fallbacks = model_config.get("fallback_models") or self.fallback_models
+        return list(OrderedDict.fromkeys([requested, *fallbacks]))
+
+    def _available(self, route: LLMRoute, now: float) -> bool:
+        return self._cooldown_until.get(route, 0.0) <= now
+
+    def pick(self, model_config: Dict[str, Any], exclude: Set[LLMRoute] = frozenset()) -> Optional[LLMRoute]:
+        """
+        Sceglie la coppia (modello, key) per la prossima richiesta, saltando quelle in `exclude`
+        e quelle in pausa per quota. Restituisce None se non ce n'è nessuna disponibile.
+        """
+        now = time.monotonic()
+        for model_name in self.models_for(model_config):
+            candidates = [
+                route for route in (LLMRoute(model_name, key_id, key) for key_id, key in self.api_keys.items())
+                if route not in exclude and self._available(route, now)
+            ]
+            if candidates:
+                return min(candidates, key=lambda route: (
+                    self.rate_limiter.estimated_wait(route.model_name, self.limiter_key(route)),
+                    self._usage[route.key_id].requests,
+                ))
+        return None
+
+    def pick_any(self, model_config: Dict[str, Any]) -> LLMRoute:
+        """Come `pick`, ma se tutto è in pausa restituisce la coppia del modello richiesto che si libera prima."""
+        route = self.pick(model_config)
+        if route is not None:
+            return route
+        model_name = self.models_for(model_config)[0]
+        routes = [LLMRoute(model_name, key_id, key) for key_id, key in self.api_keys.items()]
+        return min(routes, key=lambda route: self._cooldown_until.get(route, 0.0))
+
+    async def client(self, route: LLMRoute, model_config: Dict[str, Any]):
+        """Client LLM (dal pool condiviso) per la coppia scelta: ogni API key ha il proprio client."""
+        route_config = {
+            "model_name": route.model_name,
+            "temperature": model_config.get("temperature", DEFAULT_TEMPERATURE),
+        }
+        llm = self.llm_pool.get_existing(route_config, route.api_key)
+        if llm is None:
+            # La prima creazione del client fa una richiesta di rete: fuori dall'event loop.
+            llm = await asyncio.to_thread(self.llm_pool.get, route_config, route.api_key)
+        return llm
+
+    def record_request(self, route: LLMRoute, estimated_tokens: int) -> None:
+        usage = self._usage[route.key_id]
+        usage.requests += 1
+        usage.estimated_tokens += estimated_tokens
+        usage.requests_by_model[route.model_name] = usage.requests_by_model.get(route.model_name, 0) + 1
+
+    def record_success(self, route: LLMRoute) -> None:
+        self._usage[route.key_id].successes += 1
+
+    def record_error(self, route: LLMRoute, quota_exceeded: bool) -> None:
+        usage = self._usage[route.key_id]
+        if quota_exceeded:
+            usage.quota_errors += 1
+            self._cooldown_until[route] = time.monotonic() + self.quota_cooldown_seconds
+        else:
+            usage.errors += 1
+
+    def record_failover(self, route: LLMRoute, next_route: LLMRoute) -> None:
+        self._usage[route.key_id].failovers += 1
+        logger.warning(
+            f"Quota esaurita su {route.model_name} ({route.key_id}): "
+            f"la richiesta passa a {next_route.model_name} ({next_route.key_id})."
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Utilizzo per API key. Della key non viene mostrato nulla: solo l'id e un'impronta
+        (inizio dello SHA-256) per riconoscerla tra configurazioni diverse.
+        """
+        now = time.monotonic()
+        keys = {}
+        for key_id, key in self.api_keys.items():
+            usage = self._usage[key_id]
+            paused = {
+                route.model_name: round(until - now, 1)
+                for route, until in self._cooldown_until.items()
+                if route.key_id == key_id and until > now
+            }
+            keys[key_id] = {
+                "key_fingerprint": key_fingerprint(key),
+                "requests": usage.requests,
+                "successes": usage.successes,
+                "quota_errors": usage.quota_errors,
+                "errors": usage.errors,
+                "failovers": usage.failovers,
+                "estimated_tokens": usage.estimated_tokens,
+                "requests_by_model": dict(usage.requests_by_model),
+                "paused_models_seconds": paused,
+            }
+        return {"keys": keys, "fallback_models": self.fallback_models}
@@ -0,0 +1,249 @@
+import contextvars
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Limiti dei bucket (secondi): dalle operazioni CPU di pochi ms alle chiamate LLM lente.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return _escape_help(value).replace('"', '\\"')
+
+
+def _escape_help(text: str) -> str:
+    # Nelle righe HELP vanno escapati solo backslash e a capo (le virgolette restano).
+    return str(text).replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {_escape_help(self.documentation)}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Righe dei campioni nel formato testo di Prometheus."""
+        pass
+
+
+class Counter(_Metric):
+    """Contatore monotono, per combinazione di etichette."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Valore istantaneo (può salire e scendere)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Istogramma cumulativo con bucket fissi, come quelli di Prometheus."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per etichetta: conteggi per bucket (non cumulativi), somma e numero di osservazioni.
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, totals = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] += 1
+                    break
+            else:
+                counts[-1] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((key, (list(counts), list(totals))) for key, (counts, totals) in self._values.items())
+        for key, (counts, (total, count)) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {int(count)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Insieme delle metriche del processo, esposte in formato testo Prometheus (0.0.4)."""
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "textflow_stage_duration_seconds",
+    "Durata delle fasi di elaborazione (lettura upload, OCR, immagini, normalizzazione, split, code, LLM, ZIP).",
+    ["stage"],
+)
+LLM_INFLIGHT = REGISTRY.gauge("textflow_llm_inflight_calls", "Chiamate LLM in corso.")
+UNITS_INFLIGHT = REGISTRY.gauge("textflow_scheduler_inflight_units", "Unità di lavoro in esecuzione nello scheduler.")
+JOBS = REGISTRY.gauge("textflow_jobs", "Job nello store per stato.", ["status"])
+ERRORS = REGISTRY.counter("textflow_errors_total", "Errori per fase e tipo.", ["stage", "kind"])
+RETRIES = REGISTRY.counter("textflow_retries_total", "Nuovi tentativi per fase e motivo.", ["stage", "reason"])
+LLM_CALLS_SAVED = REGISTRY.counter(
+    "textflow_llm_calls_saved_total", "Chiamate LLM evitate: unità duplicate nel job o richieste identiche in corso.", ["reason"]
+)
+
+
+class JobTimings:
+    """Tempo totale e numero di osservazioni per fase, per un singolo job."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, List[float]] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            entry = self._stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                stage: {"seconds": round(total, 3), "count": int(count), "avg_seconds": round(total / count, 4)}
+                for stage, (total, count) in self._stages.items()
+            }
+
+
+# Job a cui attribuire le fasi osservate nel task corrente (impostato dallo scheduler per ogni unità).
+current_job_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_job_id", default=None)
+_job_timings: Dict[str, JobTimings] = {}
+
+
+def track_job(job_id: str) -> JobTimings:
+    """Attiva la raccolta dei tempi per fase del job."""
+    return _job_timings.setdefault(job_id, JobTimings())
+
+
+def forget_job(job_id: str) -> None:
+    _job_timings.pop(job_id, None)
+
+
+def observe_stage(stage: str, seconds: float, job_id: Optional[str] = None) -> None:
+    """Registra la durata di una fase nell'istogramma e, se il job è tracciato, nei suoi tempi."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _job_timings.get(job_id or current_job_id.get())
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Misura il blocco come fase `stage` (anche se il blocco contiene degli await)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def timed_iter(iterable: Iterable[T], stage: str) -> Iterator[T]:
+    """
+    Itera `iterable` misurando solo il tempo speso a produrre gli elementi (non quello del
+    consumatore, es. l'invio in rete); la durata viene registrata a iterazione conclusa.
+    """
+    elapsed = 0.0
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        observe_stage(stage, elapsed)
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PAGES_FILE = "pages.json"
+IMAGES_DIR = "images"
+# Dimensione della voce in byte, scritta insieme alla voce: evita di rileggere le immagini.
+SIZE_FILE = "size"
+# La pulizia libera spazio fino a questa frazione di `max_bytes`, non appena sotto il limite.
+LOW_WATER_RATIO = 0.9
+# Ogni quanti `put` l'indice viene riallineato al disco (voci scritte da altri processi).
+RESCAN_EVERY_PUTS = 64
+
+
+def pdf_content_hash(pdf_bytes: bytes) -> str:
+    """SHA-256 del contenuto del PDF: due upload identici condividono la stessa voce."""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    """Crea un hard link (istantaneo, nessuno spazio extra); se non è possibile, copia il file."""
+    if dst.exists():
+        return
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        # Creato nel frattempo da un altro thread: non va sovrascritto (potrebbe essere un link).
+        return
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class OCRCache:
+    """
+    Cache locale dei risultati OCR, indicizzata per (SHA-256 del PDF, modello OCR).
+    Ogni voce è una cartella con il markdown delle pagine (`pages.json`) e le
+    immagini estratte. Quando lo spazio occupato supera `max_bytes` vengono
+    eliminate le voci usate meno di recente (LRU, per mtime di `pages.json`).
+    Dimensioni e ultimi accessi sono tenuti in un indice in memoria: la cartella viene
+    riletta solo all'avvio, quando si supera il limite e ogni `RESCAN_EVERY_PUTS` scritture.
+    """
+    def __init__(self, cache_dir: Path, max_bytes: int = 2 * 1024 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries: Dict[Path, Tuple[float, int]] = {}
+        self._total = 0
+        self._puts_since_scan = 0
+        self._scans = 0
+        with self._lock:
+            self._rescan()
+
+    @classmethod
+    def from_config(cls, config: Dict, default_dir: Path) -> Optional["OCRCache"]:
+        """Costruisce la cache dalla sezione `ocr_cache` di config.json (None se disabilitata)."""
+        if not config.get("enabled", True):
+            return None
+        return cls(
+            cache_dir=Path(config.get("cache_dir", default_dir)),
+            max_bytes=int(config.get("max_size_mb", 2048) * 1024 * 1024),
+        )
+
+    def _entry_dir(self, pdf_hash: str, ocr_model: str) -> Path:
+        safe_model = "".join(c if c.isalnum() or c in "-_." else "_" for c in ocr_model)
+        return self.cache_dir / f"{pdf_hash}_{safe_model}"
+
+    def get(self, pdf_hash: str, ocr_model: str, target_dir: Path) -> Optional[List[Dict]]:
+        """
+        Se il PDF è in cache, collega le immagini in `target_dir` e restituisce le pagine
+        nel formato `[{"markdown": ..., "images": {img_id: nome_file}}]`.
+        """
+        entry = self._entry_dir(pdf_hash, ocr_model)
+        pages_file = entry / PAGES_FILE
+        try:
+            with open(pages_file, "r", encoding="utf-8") as f:
+                pages = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        target_dir.mkdir(parents=True, exist_ok=True)
+        images_dir = entry / IMAGES_DIR
+        for page in pages:
+            for filename in page["images"].values():
+                link_or_copy(images_dir / filename, target_dir / filename)
+        # Aggiorniamo il timestamp usato per l'LRU.
+        os.utime(pages_file)
+        with self._lock:
+            if entry in self._entries:
+                size = self._entries[entry][1]
+            else:
+                # Voce scritta da un altro processo dopo l'ultima scansione.
+                size = self._entry_size(entry)
+                self._total += size
+            self._entries[entry] = (time.time(), size)
+        return pages
+
+    def put(self, pdf_hash: str, ocr_model: str, pages: List[Dict], source_dir: Path) -> None:
+        """Salva le pagine OCR e le immagini (lette da `source_dir`) in una nuova voce."""
+        entry = self._entry_dir(pdf_hash, ocr_model)
+        if entry.exists():
+            return
+        # Scriviamo in una cartella temporanea e la rinominiamo: la voce appare in modo atomico.
+        staging = self.cache_dir / f".staging-{uuid.uuid4().hex}"
+        try:
+            (staging / IMAGES_DIR).mkdir(parents=True)
+            size = 0
+            for filename in {filename for page in pages for filename in page["images"].values()}:
+                link_or_copy(source_dir / filename, staging / IMAGES_DIR / filename)
+                size += (staging / IMAGES_DIR / filename).stat().st_size
+            pages_json = json.dumps(pages, ensure_ascii=False).encode("utf-8")
+            (staging / PAGES_FILE).write_bytes(pages_json)
+            size += len(pages_json)
+            (staging / SIZE_FILE).write_text(str(size))
+            os.rename(staging, entry)
+        except OSError as e:
+            logger.warning(f"Impossibile salvare il risultato OCR in cache: {e}")
+            return
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        with self._lock:
+            self._entries[entry] = (time.time(), size)
+            self._total += size
+            self._puts_since_scan += 1
+            self._evict()
+
+    def _entry_size(self, entry: Path) -> int:
+        try:
+            return int((entry / SIZE_FILE).read_text())
+        except (OSError, ValueError):
+            # Voce creata prima del file `size`.
+            return sum(f.stat().st_size for f in entry.rglob("*") if f.is_file())
+
+    def _rescan(self) -> None:
+        """Rilegge le voci dal disco (anche quelle scritte o eliminate da altri processi)."""
+        entries = {}
+        for entry in self.cache_dir.iterdir():
+            if entry.name.startswith("."):
+                continue
+            try:
+                entries[entry] = ((entry / PAGES_FILE).stat().st_mtime, self._entry_size(entry))
+            except OSError:
+                continue
+        self._entries = entries
+        self._total = sum(size for _, size in entries.values())
+        self._puts_since_scan = 0
+        self._scans += 1
+
+    def _evict(self) -> None:
+        if self._total <= self.max_bytes and self._puts_since_scan < RESCAN_EVERY_PUTS:
+            return
+        self._rescan()
+        if self._total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * LOW_WATER_RATIO)
+        for entry, (_, size) in sorted(self._entries.items(), key=lambda item: item[1][0]):
+            shutil.rmtree(entry, ignore_errors=True)
+            del self._entries[entry]
+            self._total -= size
+            logger.info(f"Cache OCR: eliminata la voce '{entry.name}' ({size} byte).")
+            if self._total <= target:
+                break
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries), "size_bytes": self._total,
+                "max_bytes": self.max_bytes, "scans": self._scans,
+            }
@@ -1,26 +1,162 @@
+import asyncio
 import logging
 import io
 import base64
 import re
 import binascii
+import shutil
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Any, Callable, Iterable, List, Dict, Optional, Protocol, Tuple
 
 from mistralai import Mistral, models
+from pypdf import PdfReader, PdfWriter
+
+from .blob_store import BlobStore
+from .metrics import ERRORS, RETRIES, stage_timer
+from .ocr_cache import OCRCache, pdf_content_hash
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 TEMP_ATTACHMENT_DIR = Path("/tmp/textflow_attachments")
 TEMP_ATTACHMENT_DIR.mkdir(exist_ok=True)
+OCR_CACHE_DIR = TEMP_ATTACHMENT_DIR / "_ocr_cache"
+# Archivio delle immagini indirizzato per contenuto: le cartelle dei job contengono solo link.
+BLOB_STORE = BlobStore(TEMP_ATTACHMENT_DIR / "_blobs")
+OCR_MODEL = "mistral-ocr-latest"
+
+@dataclass
+class OCROptions:
+    """Parametri per la divisione dei PDF grandi (sezione `ocr_config` di config.json)."""
+    max_chunk_size_mb: float = 40
+    max_pages_per_chunk: int = 100
+    max_parallel_parts: int = 4
+    max_retries: int = 2
+    retry_backoff_seconds: float = 2.0
+    image_workers: int = 4
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "OCROptions":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+class OCRProvider(Protocol):
+    """
+    Servizio OCR. `process` restituisce le pagine del PDF, ognuna con `markdown` e
+    `images` (oggetti con `id` e `image_base64`), come la risposta OCR di Mistral.
+    `model_name` distingue i risultati nella cache OCR.
+    """
+    model_name: str
+
+    def process(self, pdf_bytes: bytes, file_name: str) -> List[Any]: ...
+
+# Crea il provider OCR a partire dalla API key di Mistral.
+OCRProviderFactory = Callable[[str], OCRProvider]
+
+class MistralOCRProvider:
+    """OCR di Mistral: carica il PDF, esegue l'OCR con le immagini e rimuove il file caricato."""
+    model_name = OCR_MODEL
+
+    def __init__(self, mistral_api_key: str):
+        if not mistral_api_key:
+            raise ValueError("MISTRAL_API_KEY non configurata.")
+        self.client = Mistral(api_key=mistral_api_key)
+
+    def process(self, pdf_bytes: bytes, file_name: str) -> List[Any]:
+        # Carica il file e ottieni l'URL firmato
+        uploaded_file = self.client.files.upload(
+            file={"file_name": file_name, "content": pdf_bytes},
+            purpose="ocr"
+        )
+        try:
+            signed_url = self.client.files.get_signed_url(file_id=uploaded_file.id, expiry=1)
+
+            # Esegui l'OCR, questa volta chiedendo le immagini
+            ocr_response = self.client.ocr.process(
+                document=models.DocumentURLChunk(document_url=signed_url.url),
+                model=OCR_MODEL,
+                include_image_base64=True
+            )
+        finally:
+            # Pulisci il file temporaneo su Mistral
+            self.client.files.delete(file_id=uploaded_file.id)
+        return ocr_response.pages
+
+def make_ocr_provider_factory(providers_config: Dict) -> OCRProviderFactory:
+    """Provider OCR scelto in `providers.ocr` di config.json: "mistral" (default) o "fake"."""
+    name = providers_config.get("ocr", "mistral")
+    if name == "mistral":
+        return MistralOCRProvider
+    if name == "fake":
+        from .fake_providers import FakeOCRProvider, FakeProviderOptions
+        options = FakeProviderOptions.from_dict(providers_config.get("fake_ocr", {}))
+        return lambda mistral_api_key: FakeOCRProvider(options)
+    raise ValueError(f"Provider OCR sconosciuto: '{name}'.")
+
+class OCRCancelled(Exception):
+    """La richiesta che attendeva l'OCR è stata annullata: il thread smette di lavorare."""
+
+def _check_cancelled(cancelled: Optional[threading.Event]) -> None:
+    if cancelled is not None and cancelled.is_set():
+        raise OCRCancelled()
+
+@dataclass
+class PdfPart:
+    """Un intervallo di pagine del PDF originale (first_page è 0-based)."""
+    first_page: int
+    num_pages: int
+    pdf_bytes: bytes
+
+    @property
+    def label(self) -> str:
+        if not self.num_pages:
+            return "tutte"
+        return f"{self.first_page + 1}-{self.first_page + self.num_pages}"
+
+def cleanup_attachment_dirs(max_age_seconds: float, referenced: Iterable[str] = ()) -> int:
+    """
+    Elimina le cartelle allegati delle richieste di chunking più vecchie di `max_age_seconds`
+    che nessun job usa più: quelle che contengono un percorso di `referenced` (gli allegati
+    dei job nello store) restano finché il job esiste. Le cartelle che iniziano con "_"
+    (cache e dati interni) non vengono toccate.
+    """
+    root = TEMP_ATTACHMENT_DIR.resolve()
+    in_use = set()
+    for path_str in referenced:
+        try:
+            in_use.add(Path(path_str).resolve().relative_to(root).parts[0])
+        except (ValueError, IndexError):
+            continue
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for request_dir in TEMP_ATTACHMENT_DIR.iterdir():
+        if request_dir.name.startswith("_") or request_dir.name in in_use or not request_dir.is_dir():
+            continue
+        if request_dir.stat().st_mtime < cutoff:
+            shutil.rmtree(request_dir, ignore_errors=True)
+            removed += 1
+    return removed
+
+def remove_request_attachments(request_id: str) -> None:
+    """Elimina la cartella allegati di una richiesta di chunking non andata a buon fine."""
+    shutil.rmtree(TEMP_ATTACHMENT_DIR / clean_filename(request_id), ignore_errors=True)
 
 def clean_filename(name: str) -> str:
     """Rimuove caratteri non validi per un nome di file o cartella."""
     name = re.sub(r'[<>:"/\\|?*]', '_', name)
     return name
 
-def save_image(base64_str: str, img_id: str, output_dir: Path) -> str | None:
-    """Decodifica e salva un'immagine base64, restituendo il nome del file."""
+def save_image(base64_str: str, img_id: str, output_dir: Path, blob_store: BlobStore | None = None) -> str | None:
+    """
+    Decodifica un'immagine base64, la salva nel `blob_store` (una sola copia per contenuto)
+    e la collega in `output_dir`. Restituisce il nome del file, derivato dall'hash: la stessa
+    immagine ripetuta in più pagine compare una sola volta negli allegati.
+    """
+    blob_store = blob_store or BLOB_STORE
     try:
         if "data:" in base64_str:
             header, base64_data = base64_str.split(",", 1)
@@ -30,71 +166,240 @@ def save_image(base64_str: str, img_id: str, output_dir: Path) -> str | None:
             ext = "jpg" # Default
 
         image_data = base64.b64decode(base64_data)
-        clean_id = clean_filename(img_id)
-        output_filename = f"{clean_id}.{ext}"
-        full_path = output_dir / output_filename
-
-        with open(full_path, "wb") as f:
-            f.write(image_data)
-        return output_filename
-    except (IOError, binascii.Error, ValueError) as e:
+        blob_path = blob_store.put(image_data, clean_filename(ext))
+        return blob_store.link_into(blob_path, output_dir)
+    except (IOError, binascii.Error, ValueError, IndexError) as e:
         logger.error(f"Errore nel salvataggio dell'immagine {img_id}: {e}")
         return None
 
-def process_pdf_to_markdown(pdf_bytes: bytes, file_name: str, job_id: str, mistral_api_key: str) -> Tuple[str, Path]:
+def save_page_images(
+    pages, output_dir: Path, image_prefix: str = "", blob_store: BlobStore | None = None, max_workers: int = 4
+) -> List[Dict[str, str]]:
+    """
+    Decodifica e salva in parallelo le immagini di tutte le pagine OCR.
+    Restituisce, per ogni pagina, la mappa `{img_id: nome_file}` delle immagini salvate.
+    """
+    jobs = [(page_idx, img) for page_idx, page in enumerate(pages) for img in page.images or []]
+    saved: List[Dict[str, str]] = [{} for _ in pages]
+    if not jobs:
+        return saved
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs))), thread_name_prefix="ocr-img") as pool:
+        futures = [
+            pool.submit(save_image, img.image_base64, f"{image_prefix}{img.id}", output_dir, blob_store)
+            for _, img in jobs
+        ]
+        for (page_idx, img), future in zip(jobs, futures):
+            saved_filename = future.result()
+            if saved_filename:
+                saved[page_idx][img.id] = saved_filename
+    return saved
+
+def render_page(page: Dict, cleaned_file_stem: str) -> str:
+    """Sostituisce in un'unica passata tutti i placeholder `![id](id)` delle immagini della pagina."""
+    markdown_page = page["markdown"]
+    images = page["images"]
+    if not images:
+        return markdown_page
+    # Sintassi Obsidian-friendly per lo zip finale
+    replacements = {
+        f"![{img_id}]({img_id})": f"![[Allegati/{cleaned_file_stem}/{saved_filename}]]"
+        for img_id, saved_filename in images.items()
+    }
+    # Alternative più lunghe prima: un placeholder non può "rubare" l'inizio di un altro.
+    pattern = re.compile("|".join(map(re.escape, sorted(replacements, key=len, reverse=True))))
+    return pattern.sub(lambda match: replacements[match.group(0)], markdown_page)
+
+def render_pages(pages: List[Dict], cleaned_file_stem: str) -> str:
+    """Sostituisce i placeholder delle immagini con link Obsidian-friendly e unisce le pagine."""
+    return "\n\n".join(render_page(page, cleaned_file_stem) for page in pages)
+
+def _write_pdf_part(reader: PdfReader, first_page: int, num_pages: int) -> bytes:
+    writer = PdfWriter()
+    for page_idx in range(first_page, first_page + num_pages):
+        writer.add_page(reader.pages[page_idx])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def _split_range(reader: PdfReader, first_page: int, num_pages: int, max_bytes: int) -> List[PdfPart]:
+    part_bytes = _write_pdf_part(reader, first_page, num_pages)
+    # Se la parte è ancora troppo grande la dimezziamo (una pagina singola resta com'è).
+    if len(part_bytes) <= max_bytes or num_pages == 1:
+        return [PdfPart(first_page, num_pages, part_bytes)]
+    half = num_pages // 2
+    return (_split_range(reader, first_page, half, max_bytes)
+            + _split_range(reader, first_page + half, num_pages - half, max_bytes))
+
+def split_pdf(pdf_bytes: bytes, options: OCROptions) -> List[PdfPart]:
+    """
+    Divide un PDF che supera la soglia di dimensione o di pagine in intervalli di pagine.
+    I PDF piccoli vengono restituiti come un'unica parte, senza essere riscritti.
+    """
+    max_bytes = int(options.max_chunk_size_mb * 1024 * 1024)
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        total_pages = len(reader.pages)
+    except Exception as e:
+        # pypdf non riesce a leggerlo: lo mandiamo intero e lasciamo decidere all'OCR.
+        logger.warning(f"Impossibile analizzare il PDF per la divisione in parti: {e}")
+        return [PdfPart(0, 0, pdf_bytes)]
+    if len(pdf_bytes) <= max_bytes and total_pages <= options.max_pages_per_chunk:
+        return [PdfPart(0, total_pages, pdf_bytes)]
+
+    # Stima delle pagine per parte dalla dimensione media di una pagina.
+    avg_page_bytes = max(1, len(pdf_bytes) // max(1, total_pages))
+    pages_per_part = max(1, min(options.max_pages_per_chunk, max_bytes // avg_page_bytes))
+    parts = []
+    for first_page in range(0, total_pages, pages_per_part):
+        num_pages = min(pages_per_part, total_pages - first_page)
+        parts.extend(_split_range(reader, first_page, num_pages, max_bytes))
+    return parts
+
+def run_ocr(
+    provider: OCRProvider, pdf_bytes: bytes, file_name: str, output_dir: Path, image_prefix: str = "",
+    blob_store: BlobStore | None = None, image_workers: int = 4, cancelled: Optional[threading.Event] = None
+) -> List[Dict]:
+    """
+    Esegue l'OCR del PDF con il `provider` e salva le immagini in `output_dir` (tramite il blob store,
+    con `image_workers` thread). Restituisce le pagine come `[{"markdown": ..., "images": {img_id: nome_file}}]`.
+    `image_prefix` distingue nei log le immagini di parti diverse dello stesso PDF.
+    """
+    with stage_timer("ocr"):
+        ocr_pages = provider.process(pdf_bytes, file_name)
+    _check_cancelled(cancelled)
+    with stage_timer("image_save"):
+        saved_images = save_page_images(ocr_pages, output_dir, image_prefix, blob_store, image_workers)
+    return [
+        {"markdown": page.markdown, "images": images}
+        for page, images in zip(ocr_pages, saved_images)
+    ]
+
+def _ocr_part_with_retries(
+    provider: OCRProvider, part: PdfPart, file_name: str, output_dir: Path, image_prefix: str, options: OCROptions,
+    fail_soft: bool = True, cancelled: Optional[threading.Event] = None
+) -> List[Dict]:
+    """
+    OCR di un singolo intervallo di pagine; in caso di errore ritenta solo questo intervallo.
+    Con `fail_soft` un intervallo che continua a fallire diventa una pagina di errore
+    invece di far fallire l'intero file.
+    """
+    for attempt in range(options.max_retries + 1):
+        _check_cancelled(cancelled)
+        try:
+            return run_ocr(
+                provider, part.pdf_bytes, file_name, output_dir, image_prefix,
+                image_workers=options.image_workers, cancelled=cancelled
+            )
+        except OCRCancelled:
+            raise
+        except Exception as e:
+            ERRORS.inc(stage="ocr", kind=type(e).__name__)
+            if attempt == options.max_retries:
+                if not fail_soft:
+                    raise
+                logger.error(f"OCR delle pagine {part.label} di '{file_name}' fallito dopo {attempt + 1} tentativi: {e}")
+                error_markdown = f"## ERRORE OCR (pagine {part.label})\n\nImpossibile processare queste pagine di '{file_name}'.\n\nDettagli: {e}"
+                return [{"markdown": error_markdown, "images": {}, "error": True}]
+            delay = options.retry_backoff_seconds * (2 ** attempt)
+            RETRIES.inc(stage="ocr", reason="backoff")
+            logger.warning(f"OCR delle pagine {part.label} di '{file_name}' fallito ({e}). Nuovo tentativo tra {delay:.0f}s.")
+            if cancelled is not None:
+                cancelled.wait(delay)
+            else:
+                time.sleep(delay)
+
+def ocr_pdf(
+    provider: OCRProvider, pdf_bytes: bytes, file_name: str, output_dir: Path, options: OCROptions,
+    cancelled: Optional[threading.Event] = None
+) -> List[Dict]:
+    """
+    OCR dell'intero PDF. Se il file supera le soglie di `options` viene diviso in intervalli
+    di pagine processati in parallelo; le pagine vengono poi riassemblate nell'ordine originale.
+    Con `cancelled` impostato le parti non ancora iniziate non vengono più inviate.
+    """
+    parts = split_pdf(pdf_bytes, options)
+    if len(parts) == 1:
+        return _ocr_part_with_retries(provider, parts[0], file_name, output_dir, "", options, fail_soft=False, cancelled=cancelled)
+
+    logger.info(f"'{file_name}' diviso in {len(parts)} parti per l'OCR ({', '.join(p.label for p in parts)}).")
+    with ThreadPoolExecutor(max_workers=options.max_parallel_parts, thread_name_prefix="ocr-part") as pool:
+        futures = [
+            pool.submit(
+                _ocr_part_with_retries, provider, part, file_name, output_dir, f"p{part.first_page + 1}-", options,
+                cancelled=cancelled
+            )
+            for part in parts
+        ]
+        pages = []
+        for future in futures:
+            pages.extend(future.result())
+    return pages
+
+def process_pdf_to_markdown(
+    pdf_bytes: bytes, file_name: str, job_id: str, mistral_api_key: str,
+    ocr_cache: OCRCache | None = None, options: OCROptions | None = None,
+    provider_factory: OCRProviderFactory | None = None, cancelled: Optional[threading.Event] = None
+) -> Tuple[str, Path]:
     """
     Converte un PDF in Markdown, estrae le immagini, le salva in una cartella temporanea
     specifica per il job e aggiorna i link nel markdown.
+    Se è disponibile una `ocr_cache` e il PDF è già stato processato, l'OCR viene saltato
+    e le immagini in cache vengono collegate nella cartella del job.
+    L'OCR è eseguito dal provider creato da `provider_factory` (default: Mistral).
     """
-    if not mistral_api_key:
-        raise ValueError("MISTRAL_API_KEY non configurata.")
+    provider = (provider_factory or MistralOCRProvider)(mistral_api_key)
+    options = options or OCROptions()
 
-    client = Mistral(api_key=mistral_api_key)
-    
     # Crea una directory unica per gli allegati di questo file in questo job
     cleaned_file_stem = clean_filename(Path(file_name).stem)
     attachments_path = TEMP_ATTACHMENT_DIR / job_id / cleaned_file_stem
     attachments_path.mkdir(parents=True, exist_ok=True)
 
     try:
-        logger.info(f"Processando '{file_name}' con OCR (Job: {job_id}).")
-        
-        # Carica il file e ottieni l'URL firmato
-        uploaded_file = client.files.upload(
-            file={"file_name": file_name, "content": pdf_bytes},
-            purpose="ocr"
-        )
-        signed_url = client.files.get_signed_url(file_id=uploaded_file.id, expiry=1)
-
-        # Esegui l'OCR, questa volta chiedendo le immagini
-        ocr_response = client.ocr.process(
-            document=models.DocumentURLChunk(document_url=signed_url.url),
-            model="mistral-ocr-latest",
-            include_image_base64=True
-        )
+        pdf_hash = pdf_content_hash(pdf_bytes)
+        pages = ocr_cache.get(pdf_hash, provider.model_name, attachments_path) if ocr_cache else None
+        if pages is not None:
+            logger.info(f"OCR di '{file_name}' trovato in cache (Job: {job_id}).")
+        else:
+            logger.info(f"Processando '{file_name}' con OCR (Job: {job_id}).")
+            pages = ocr_pdf(provider, pdf_bytes, file_name, attachments_path, options, cancelled)
+            # Gli intervalli falliti non vanno in cache: al prossimo tentativo verranno rifatti.
+            if ocr_cache and not any(page.get("error") for page in pages):
+                ocr_cache.put(pdf_hash, provider.model_name, pages, attachments_path)
 
-        markdown_pages = []
-        for page in ocr_response.pages:
-            markdown_page = page.markdown
-            if page.images:
-                images_dict = {img.id: img.image_base64 for img in page.images}
-                # Aggiorna il markdown con i link relativi corretti per lo zip finale
-                for img_id, base64_str in images_dict.items():
-                    saved_filename = save_image(base64_str, img_id, attachments_path)
-                    if saved_filename:
-                        placeholder = f"![{img_id}]({img_id})"
-                        # Sintassi Obsidian-friendly per lo zip finale
-                        replacement = f"![[Allegati/{cleaned_file_stem}/{saved_filename}]]"
-                        markdown_page = markdown_page.replace(placeholder, replacement)
-            markdown_pages.append(markdown_page)
-        
-        # Pulisci il file temporaneo su Mistral
-        client.files.delete(file_id=uploaded_file.id)
-
-        full_markdown = "\n\n".join(markdown_pages)
+        # Annullata mentre salvava le immagini: i suoi allegati non servono a nessuno.
+        _check_cancelled(cancelled)
+        full_markdown = render_pages(pages, cleaned_file_stem)
         return full_markdown, attachments_path
 
+    except OCRCancelled:
+        logger.info(f"OCR di '{file_name}' interrotto: richiesta annullata (Job: {job_id}).")
+        shutil.rmtree(attachments_path, ignore_errors=True)
+        raise
     except Exception as e:
         logger.error(f"Errore critico durante l'OCR di '{file_name}': {e}", exc_info=True)
         error_markdown = f"## ERRORE OCR\n\nImpossibile processare il file '{file_name}'.\n\nDettagli: {e}"
         return error_markdown, attachments_path
+
+async def process_pdf_to_markdown_async(
+    pdf_bytes: bytes, file_name: str, job_id: str, mistral_api_key: str,
+    ocr_cache: OCRCache | None = None, executor: Executor | None = None, options: OCROptions | None = None,
+    provider_factory: OCRProviderFactory | None = None
+) -> Tuple[str, Path]:
+    """
+    Versione asincrona di `process_pdf_to_markdown`: le chiamate HTTP bloccanti a Mistral
+    e la decodifica delle immagini girano nell'`executor` (un thread pool limitato),
+    così l'event loop resta libero di servire le altre richieste. Se la richiesta viene
+    annullata il thread non invia altre parti, non salva immagini e rimuove i propri allegati.
+    """
+    loop = asyncio.get_running_loop()
+    cancelled = threading.Event()
+    try:
+        return await loop.run_in_executor(
+            executor,
+            partial(process_pdf_to_markdown, pdf_bytes, file_name, job_id, mistral_api_key, ocr_cache, options,
+                    provider_factory, cancelled)
+        )
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
@@ -0,0 +1,320 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Optional, Set
+
+from .job_scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+# Tipi (per nome, senza importare le librerie dei client) che indicano un errore di quota:
+# google.api_core.exceptions.ResourceExhausted / TooManyRequests.
+RATE_LIMIT_ERROR_TYPES = {"ResourceExhausted", "TooManyRequests"}
+# Frammenti del messaggio usati solo per gli errori senza codice HTTP riconoscibile.
+RATE_LIMIT_ERROR_MARKERS = ("resource_exhausted", "resource exhausted", "rate limit", "too many requests")
+# Codice di stato HTTP all'inizio del messaggio (es. "429 Resource has been exhausted").
+STATUS_CODE_PATTERN = re.compile(r'^\W*([1-5]\d\d)\b')
+
+
+def error_status_code(error: BaseException) -> Optional[int]:
+    """
+    Codice di stato HTTP di un errore del client: l'attributo `code` delle eccezioni
+    google.api_core, `status_code` di httpx/Mistral oppure il codice con cui inizia il messaggio.
+    """
+    for attribute in ("code", "status_code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int) and 100 <= value < 600:
+            return int(value)
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    if isinstance(value, int) and 100 <= value < 600:
+        return value
+    match = STATUS_CODE_PATTERN.match(str(error))
+    return int(match.group(1)) if match else None
+
+
+def error_type_names(error: BaseException) -> Set[str]:
+    """Nomi delle classi dell'eccezione, comprese le classi base."""
+    return {cls.__name__ for cls in type(error).__mro__}
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    Restituisce True se l'eccezione indica che abbiamo superato la quota del modello (HTTP 429).
+    Un errore con un altro codice (es. un 403 di fatturazione che cita la "quota") non lo è.
+    """
+    if error_type_names(error) & RATE_LIMIT_ERROR_TYPES:
+        return True
+    status = error_status_code(error)
+    if status is not None:
+        return status == 429
+    text = str(error).lower()
+    return any(marker in text for marker in RATE_LIMIT_ERROR_MARKERS)
+
+
+@dataclass
+class RateLimits:
+    """Limiti configurati per un singolo modello."""
+    rpm: float = 15.0
+    tpm: float = 1_000_000.0
+    max_concurrency: int = 14
+    # Richieste che possono partire a raffica dopo un periodo di inattività.
+    # Con 1 le chiamate vengono distanziate in modo uniforme (60s / RPM).
+    burst: float = 1.0
+    # Limite minimo sotto il quale l'AIMD non scende mai (richieste al minuto).
+    min_rpm: float = 1.0
+    # Incremento additivo dopo ogni successo e fattore moltiplicativo dopo un 429.
+    additive_increase: float = 0.5
+    multiplicative_decrease: float = 0.5
+
+    @classmethod
+    def from_dict(cls, data: Dict, base: Optional["RateLimits"] = None) -> "RateLimits":
+        values = dict(vars(base)) if base else {}
+        values.update({k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+        return cls(**values)
+
+
+@dataclass
+class RateLimitLease:
+    """Permesso concesso dal limiter. `waited` è il tempo passato in coda, in secondi."""
+    model_name: str
+    estimated_tokens: int
+    waited: float = 0.0
+
+
+@dataclass
+class _ModelState:
+    limits: RateLimits
+    current_rpm: float
+    request_tokens: float
+    token_tokens: float
+    last_refill: float
+    semaphore: asyncio.Semaphore
+    # Turno di ammissione: chi lo tiene attende lo slot di concorrenza e i token, gli altri
+    # aspettano nella coda della propria priorità.
+    turn_held: bool = False
+    waiters: Dict[str, Deque[asyncio.Future]] = field(
+        default_factory=lambda: {"interactive": deque(), "bulk": deque()}
+    )
+    interactive_streak: int = 0
+    throttled: int = 0
+    total_wait: float = 0.0
+    requests: int = 0
+    # Richieste in coda per questo modello (e API key), usate per stimare l'attesa.
+    waiting: int = 0
+
+
+class RateLimiter:
+    """
+    Scheduler globale basato su token bucket, condiviso da tutti i job del processo.
+    Per ogni modello applica tre limiti: richieste al minuto (RPM), token al minuto (TPM)
+    e numero massimo di chiamate concorrenti. Il ritmo effettivo delle richieste segue
+    una politica AIMD: cresce lentamente dopo ogni successo e si dimezza dopo un 429.
+    Con più API key ogni coppia (modello, key) ha un budget separato: `key_limits`
+    permette di sovrascrivere i limiti del modello per una singola key (es. una key a pagamento).
+    Le richieste in attesa vengono ammesse come nello scheduler: prima quelle "interactive",
+    ma una "bulk" ogni `interactive_weight` interattive, così la priorità resta valida anche
+    quando la quota è il collo di bottiglia.
+    """
+    def __init__(
+        self, default_limits: Optional[RateLimits] = None, model_limits: Optional[Dict[str, RateLimits]] = None,
+        key_limits: Optional[Dict[str, Dict]] = None, interactive_weight: int = 3
+    ):
+        self.default_limits = default_limits or RateLimits()
+        self.model_limits: Dict[str, RateLimits] = dict(model_limits or {})
+        self.key_limits: Dict[str, Dict] = dict(key_limits or {})
+        self.interactive_weight = interactive_weight
+        self._states: Dict[str, _ModelState] = {}
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "RateLimiter":
+        """Costruisce il limiter dalla sezione `rate_limits` di config.json."""
+        default_limits = RateLimits.from_dict(config.get("default", {}))
+        model_limits = {
+            model_name: RateLimits.from_dict(limits, base=default_limits)
+            for model_name, limits in config.get("models", {}).items()
+        }
+        return cls(default_limits, model_limits, config.get("keys", {}), config.get("interactive_weight", 3))
+
+    @staticmethod
+    def lane_name(model_name: str, key_id: Optional[str] = None) -> str:
+        """Nome del budget: il modello, oppure `modello@key` quando si usano più API key."""
+        return model_name if key_id is None else f"{model_name}@{key_id}"
+
+    def _get_state(self, model_name: str, key_id: Optional[str] = None) -> _ModelState:
+        lane = self.lane_name(model_name, key_id)
+        state = self._states.get(lane)
+        if state is None:
+            limits = self.model_limits.get(model_name, self.default_limits)
+            if key_id in self.key_limits:
+                limits = RateLimits.from_dict(self.key_limits[key_id], base=limits)
+            state = _ModelState(
+                limits=limits,
+                current_rpm=limits.rpm,
+                request_tokens=1.0,
+                token_tokens=limits.tpm,
+                last_refill=time.monotonic(),
+                semaphore=asyncio.Semaphore(limits.max_concurrency),
+            )
+            self._states[lane] = state
+        return state
+
+    def _refill(self, state: _ModelState) -> None:
+        now = time.monotonic()
+        elapsed = now - state.last_refill
+        state.last_refill = now
+        capacity = max(1.0, min(state.limits.burst, state.current_rpm))
+        state.request_tokens = min(capacity, state.request_tokens + elapsed * state.current_rpm / 60.0)
+        state.token_tokens = min(state.limits.tpm, state.token_tokens + elapsed * state.limits.tpm / 60.0)
+
+    async def _take(self, state: _ModelState, tokens: int) -> None:
+        # Una richiesta più grande dell'intero budget TPM non verrebbe mai servita.
+        tokens = min(tokens, state.limits.tpm)
+        while True:
+            self._refill(state)
+            if state.request_tokens >= 1.0 and state.token_tokens >= tokens:
+                state.request_tokens -= 1.0
+                state.token_tokens -= tokens
+                return
+            wait_requests = max(0.0, (1.0 - state.request_tokens) * 60.0 / state.current_rpm)
+            wait_tokens = max(0.0, (tokens - state.token_tokens) * 60.0 / state.limits.tpm)
+            await asyncio.sleep(max(wait_requests, wait_tokens, 0.01))
+
+    async def _wait_turn(self, state: _ModelState, priority: Priority) -> None:
+        if not state.turn_held and not any(state.waiters.values()):
+            state.turn_held = True
+            return
+        future = asyncio.get_running_loop().create_future()
+        queue = state.waiters[priority]
+        queue.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                if future in queue:
+                    queue.remove(future)
+            else:
+                # Il turno era già stato passato a noi: lo cediamo al prossimo.
+                self._pass_turn(state)
+            raise
+
+    def _next_waiters(self, state: _ModelState) -> Optional[Deque[asyncio.Future]]:
+        interactive, bulk = state.waiters["interactive"], state.waiters["bulk"]
+        if interactive and (not bulk or state.interactive_streak < self.interactive_weight):
+            state.interactive_streak += 1
+            return interactive
+        if bulk:
+            state.interactive_streak = 0
+            return bulk
+        return None
+
+    def _pass_turn(self, state: _ModelState) -> None:
+        while True:
+            queue = self._next_waiters(state)
+            if queue is None:
+                state.turn_held = False
+                return
+            future = queue.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+
+    async def _admit(self, state: _ModelState, tokens: int, priority: Priority) -> None:
+        """
+        Ammette una richiesta: una alla volta, in ordine di priorità, attende uno slot di
+        concorrenza e poi i token. Il semaforo viene preso dentro il turno, così nemmeno
+        l'attesa di uno slot libero è FIFO tra priorità diverse.
+        """
+        await self._wait_turn(state, priority)
+        try:
+            await state.semaphore.acquire()
+            try:
+                await self._take(state, tokens)
+            except BaseException:
+                state.semaphore.release()
+                raise
+        finally:
+            self._pass_turn(state)
+
+    def acquire(
+        self, model_name: str, estimated_tokens: int = 0, key_id: Optional[str] = None,
+        priority: Priority = "interactive"
+    ) -> "_LeaseContext":
+        """
+        Attende un permesso per `model_name` (sul budget della API key `key_id`, se indicata),
+        con la priorità del job che fa la richiesta.
+        Va usato come context manager asincrono: l'esito della chiamata (successo o errore
+        di quota) aggiorna il ritmo AIMD.
+        """
+        return _LeaseContext(self, model_name, estimated_tokens, key_id, priority)
+
+    def estimated_wait(self, model_name: str, key_id: Optional[str] = None) -> float:
+        """Stima in secondi dell'attesa per una nuova richiesta, contando quelle già in coda."""
+        state = self._get_state(model_name, key_id)
+        self._refill(state)
+        interval = 60.0 / state.current_rpm
+        return max(0.0, (1.0 - state.request_tokens) * interval) + state.waiting * interval
+
+    def _on_success(self, state: _ModelState) -> None:
+        state.current_rpm = min(state.limits.rpm, state.current_rpm + state.limits.additive_increase)
+
+    def _on_throttled(self, state: _ModelState, model_name: str) -> None:
+        state.throttled += 1
+        state.current_rpm = max(state.limits.min_rpm, state.current_rpm * state.limits.multiplicative_decrease)
+        # Svuotiamo il bucket: la quota lato server è già esaurita.
+        state.request_tokens = 0.0
+        logger.warning(f"Quota superata per '{model_name}': RPM effettivo ridotto a {state.current_rpm:.1f}")
+
+    def stats(self) -> Dict[str, Dict]:
+        """Restituisce una fotografia dello stato di ogni modello (o coppia `modello@key`)."""
+        return {
+            model_name: {
+                "configured_rpm": state.limits.rpm,
+                "current_rpm": round(state.current_rpm, 2),
+                "tpm": state.limits.tpm,
+                "max_concurrency": state.limits.max_concurrency,
+                "requests": state.requests,
+                "throttled": state.throttled,
+                "avg_wait_seconds": round(state.total_wait / state.requests, 3) if state.requests else 0.0,
+            }
+            for model_name, state in self._states.items()
+        }
+
+
+class _LeaseContext:
+    def __init__(
+        self, limiter: RateLimiter, model_name: str, estimated_tokens: int, key_id: Optional[str] = None,
+        priority: Priority = "interactive"
+    ):
+        self.limiter = limiter
+        self.model_name = model_name
+        self.estimated_tokens = estimated_tokens
+        self.key_id = key_id
+        self.priority = priority
+        self.state: Optional[_ModelState] = None
+
+    async def __aenter__(self) -> RateLimitLease:
+        start = time.monotonic()
+        self.state = self.limiter._get_state(self.model_name, self.key_id)
+        self.state.waiting += 1
+        try:
+            await self.limiter._admit(self.state, self.estimated_tokens, self.priority)
+        finally:
+            self.state.waiting -= 1
+        waited = time.monotonic() - start
+        self.state.requests += 1
+        self.state.total_wait += waited
+        return RateLimitLease(self.model_name, self.estimated_tokens, waited)
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        try:
+            if exc is None:
+                self.limiter._on_success(self.state)
+            elif is_rate_limit_error(exc):
+                self.limiter._on_throttled(self.state, self.limiter.lane_name(self.model_name, self.key_id))
+        finally:
+            self.state.semaphore.release()
+        return False
@@ -0,0 +1,68 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+@dataclass
+class DedupStats:
+    """Chiamate LLM risparmiate da un job: unità duplicate nel job e richieste condivise con altri job."""
+    duplicate_units: int = 0
+    coalesced_calls: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "total": self.duplicate_units + self.coalesced_calls,
+            "duplicate_units": self.duplicate_units,
+            "coalesced_calls": self.coalesced_calls,
+        }
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Unisce le richieste identiche in corso nello stesso momento (singleflight): la prima
+    esegue la chiamata, le altre con la stessa chiave ne attendono il risultato (o l'errore).
+    La chiamata gira in un task separato, così l'annullamento di un job non interrompe
+    quella condivisa con gli altri; viene annullata solo se non la attende più nessuno.
+    """
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.started = 0
+        self.shared = 0
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Esegue (o si unisce a) la chiamata per `key`. Restituisce il risultato e se era condivisa."""
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(call()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._finish(key, flight))
+            self.started += 1
+        else:
+            self.shared += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self._finish(key, flight)
+                flight.task.cancel()
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "started": self.started, "shared": self.shared}
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional["SingleFlight"]:
+        """Dalla sezione `request_dedup` di config.json (None se `coalesce_in_flight` è disattivato)."""
+        return cls() if config.get("coalesce_in_flight", True) else None
@@ -0,0 +1,82 @@
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Sequence, TextIO, Tuple, Union
+
+UnitKey = Tuple[int, str]
+RESULT_SEPARATOR = "\n---\n"
+
+
+def iter_output_parts(prompt_names: Sequence[str], order_mode: str, num_chunks: int) -> Iterator[Union[str, UnitKey]]:
+    """
+    Sequenza delle parti del markdown di un file, nell'ordine di `order_mode`: testi fissi
+    (separatori, titoli dei prompt) e chiavi `(chunk_idx, prompt_name)` dei risultati.
+    """
+    if order_mode == "chunk":
+        for chunk_idx in range(1, num_chunks + 1):
+            for prompt_name in prompt_names:
+                yield (chunk_idx, prompt_name)
+                yield RESULT_SEPARATOR
+    else:  # order_mode == "prompt"
+        for prompt_name in prompt_names:
+            yield f"# Risultati per Prompt: {prompt_name}\n\n"
+            for chunk_idx in range(1, num_chunks + 1):
+                yield (chunk_idx, prompt_name)
+                yield RESULT_SEPARATOR
+
+
+class OrderedResultWriter:
+    """
+    Scrive il markdown di un file su `sink` mentre arrivano i risultati (chunk, prompt), in
+    qualsiasi ordine. A ogni risultato viene scritto (e reso leggibile con un flush) il
+    prefisso più lungo già completo; in memoria restano solo i risultati arrivati prima dei
+    precedenti. I chunk in `empty_chunks` non riceveranno risultati e restano vuoti.
+    Thread-safe: `add` può essere chiamata da thread diversi.
+    """
+    def __init__(
+        self, sink: TextIO, prompt_names: Sequence[str], order_mode: str, num_chunks: int,
+        empty_chunks: Iterable[int] = ()
+    ):
+        self.sink = sink
+        self.empty_chunks = frozenset(empty_chunks)
+        self._parts = iter_output_parts(list(prompt_names), order_mode, num_chunks)
+        self._next: Optional[Union[str, UnitKey]] = next(self._parts, None)
+        self._pending: Dict[UnitKey, str] = {}
+        self._started = False
+        self._lock = threading.Lock()
+        self.max_pending = 0
+
+    def add(self, key: UnitKey, response: str) -> None:
+        with self._lock:
+            self._pending[key] = response
+            self.max_pending = max(self.max_pending, len(self._pending))
+            self._advance()
+
+    def add_many(self, results: Iterable[Tuple[UnitKey, str]]) -> None:
+        with self._lock:
+            self._pending.update(results)
+            self.max_pending = max(self.max_pending, len(self._pending))
+            self._advance()
+
+    def _advance(self, fill_missing: bool = False) -> None:
+        pieces = []
+        while self._next is not None:
+            part = self._next
+            if isinstance(part, tuple):
+                if part in self._pending:
+                    part = self._pending.pop(part)
+                elif part[0] in self.empty_chunks or fill_missing:
+                    part = ""
+                else:
+                    break
+            # Le parti sono unite da "\n", come nel vecchio "\n".join(lines).
+            pieces.append(f"\n{part}" if self._started else part)
+            self._started = True
+            self._next = next(self._parts, None)
+        if pieces:
+            self.sink.write("".join(pieces))
+            self.sink.flush()
+
+    def close(self) -> None:
+        """Completa il file: i risultati mai arrivati restano vuoti. Non chiude `sink`."""
+        with self._lock:
+            self._advance(fill_missing=True)
+            self._pending.clear()
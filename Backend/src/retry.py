@@ -0,0 +1,54 @@
+import random
+from dataclasses import dataclass
+from typing import Dict
+
+from .rate_limiter import error_status_code, error_type_names, is_rate_limit_error
+
+# Tipi (per nome, senza importare le librerie dei client) degli errori temporanei:
+# 5xx e timeout di google.api_core, errori di rete e timeout di httpx.
+TRANSIENT_ERROR_TYPES = {
+    "ServerError", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "GatewayTimeout",
+    "BadGateway", "TransportError", "TimeoutException",
+}
+# Codici HTTP non 5xx per cui ha senso ritentare.
+TRANSIENT_STATUS_CODES = {408, 429}
+# Frasi usate solo per gli errori senza codice HTTP riconoscibile.
+TRANSIENT_ERROR_MARKERS = (
+    "service unavailable", "temporarily unavailable", "overloaded", "deadline exceeded",
+    "timed out", "timeout", "connection reset", "connection refused", "connection aborted",
+)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    True se ha senso ritentare la chiamata: quota, timeout, errori 5xx o di rete. Un errore
+    con un codice 4xx diverso da 408/429 è permanente, qualunque cosa dica il messaggio.
+    """
+    if is_rate_limit_error(error) or isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if error_type_names(error) & TRANSIENT_ERROR_TYPES:
+        return True
+    status = error_status_code(error)
+    if status is not None:
+        return status >= 500 or status in TRANSIENT_STATUS_CODES
+    text = str(error).lower()
+    return any(marker in text for marker in TRANSIENT_ERROR_MARKERS)
+
+
+@dataclass
+class RetryPolicy:
+    """Tentativi con backoff esponenziale e jitter ("full jitter") per gli errori temporanei."""
+    max_attempts: int = 4
+    base_delay_seconds: float = 2.0
+    max_delay_seconds: float = 60.0
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RetryPolicy":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+    def delay(self, attempt: int) -> float:
+        """Attesa prima del tentativo successivo a `attempt` (0-based)."""
+        return random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * (2 ** attempt)))
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        return attempt + 1 < self.max_attempts and is_transient_error(error)
@@ -1,11 +1,157 @@
 import re
-from typing import List
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
+
+# Separatori di riga: a capo e tag <br>. Dividere con un'unica scansione su entrambi
+# equivale a sostituire i <br> con "\n" e poi dividere, senza copie intermedie del testo.
+LINE_BREAK_PATTERN = re.compile(r'\n|<br\s*/?>', re.IGNORECASE)
+NUMBERED_HEADER_PATTERN = re.compile(r'^\d+(\.\d+)+\.?\s')
+# Possibile tag <br> incompleto in fondo a un blocco: va completato con il blocco successivo.
+PARTIAL_BREAK_TAG_PATTERN = re.compile(r'<(?:b(?:r\s*/?)?)?\Z', re.IGNORECASE)
+
+# Una regola riceve la riga senza spazi iniziali/finali (mai vuota) e restituisce
+# la riga riformattata, oppure None se non si applica. Vince la prima regola che si applica.
+LineRule = Callable[[str], Optional[str]]
+
+
+def all_caps_h1_rule(stripped_line: str) -> Optional[str]:
+    """H1: riga TUTTA MAIUSCOLA, breve (1-10 parole) e non una frase."""
+    if not (stripped_line.isupper() and stripped_line.lower() != stripped_line):
+        return None
+    if stripped_line.endswith(('.', ':', ',')):
+        return None
+    # Al massimo 11 pezzi: basta per sapere se le parole sono più di 10.
+    if len(stripped_line.split(None, 10)) > 10:
+        return None
+    return f"# {stripped_line}"
+
+
+def numbered_h2_rule(stripped_line: str) -> Optional[str]:
+    """H2: numerazione a più livelli come "1.1" o "2.4."."""
+    if NUMBERED_HEADER_PATTERN.match(stripped_line):
+        return f"## {stripped_line}"
+    return None
+
+
+DEFAULT_RULES: Sequence[LineRule] = (all_caps_h1_rule, numbered_h2_rule)
+
+
+def iter_source_lines(text: str) -> Iterator[str]:
+    """Righe del testo, considerando anche i tag <br> come a capo."""
+    position = 0
+    for match in LINE_BREAK_PATTERN.finditer(text):
+        yield text[position:match.start()]
+        position = match.end()
+    yield text[position:]
+
+
+def iter_source_lines_from_blocks(blocks: Iterable[str]) -> Iterator[str]:
+    """
+    Come `iter_source_lines`, ma su un testo che arriva a blocchi (es. upload decodificato
+    in modo incrementale). Le righe sono identiche a quelle del testo intero: un a capo o
+    un tag <br> a cavallo tra due blocchi viene riconosciuto dopo l'arrivo del secondo.
+    """
+    # La riga in corso resta a pezzi e si esamina solo il blocco nuovo (più l'eventuale tag
+    # incompleto del precedente): il costo resta lineare anche senza a capo.
+    line_parts: List[str] = []
+    carry = ""
+    for block in blocks:
+        if not block:
+            continue
+        text = carry + block
+        tag_start = text.rfind("<")
+        limit = tag_start if tag_start >= 0 and PARTIAL_BREAK_TAG_PATTERN.match(text, tag_start) else len(text)
+        position = 0
+        for match in LINE_BREAK_PATTERN.finditer(text, 0, limit):
+            line_parts.append(text[position:match.start()])
+            yield "".join(line_parts)
+            line_parts.clear()
+            position = match.end()
+        if position < limit:
+            line_parts.append(text[position:limit])
+        carry = text[limit:]
+    yield from iter_source_lines("".join(line_parts) + carry)
+
+
+class HeaderRebalancer:
+    """
+    Declassa a H2 gli header H1 troppo vicini tra loro, riga per riga.
+    Un H1 viene di nuovo accettato dopo più di `reset_threshold` righe non-H1.
+    """
+    def __init__(self, reset_threshold: int = 40):
+        self.reset_threshold = reset_threshold
+        self.h1_seen_recently = False
+        self.lines_since_last_h1 = 0
+
+    def feed(self, line: str, stripped_line: str) -> str:
+        # Logica di reset
+        if self.lines_since_last_h1 > self.reset_threshold:
+            self.h1_seen_recently = False
+
+        if stripped_line.startswith('# '):
+            if self.h1_seen_recently:
+                # Declassa a H2 aggiungendo un '#'
+                return f"#{line}"
+            self.h1_seen_recently = True
+            self.lines_since_last_h1 = 0
+            return line
+
+        if self.h1_seen_recently:
+            self.lines_since_last_h1 += 1
+        return line
+
+
+class TextNormalizer:
+    """
+    Normalizzazione in un'unica passata riga per riga: formattazione degli header grezzi
+    con le regole `rules` e ribilanciamento degli H1. Le regole sono estendibili senza
+    aggiungere passate sul testo.
+    """
+    def __init__(self, rules: Sequence[LineRule] = DEFAULT_RULES, reset_threshold: int = 40):
+        self.rules = tuple(rules)
+        self.reset_threshold = reset_threshold
+
+    def iter_lines(self, lines: Iterable[str]) -> Iterator[str]:
+        """Normalizza un iteratore di righe, restituendo le righe normalizzate."""
+        rules = self.rules
+        rebalancer = HeaderRebalancer(self.reset_threshold)
+        for line in lines:
+            stripped_line = line.strip()
+            if not stripped_line:
+                rebalancer.feed("", "")
+                yield ""
+                continue
+            for rule in rules:
+                formatted = rule(stripped_line)
+                if formatted is not None:
+                    line = stripped_line = formatted
+                    break
+            yield rebalancer.feed(line, stripped_line)
+
+    def normalize(self, text: str) -> str:
+        if not text or not text.strip():
+            return ""
+        return self._join(self.iter_lines(iter_source_lines(text)))
+
+    def normalize_blocks(self, blocks: Iterable[str]) -> str:
+        """Come `normalize`, per un testo che arriva a blocchi: non serve mai il testo grezzo intero."""
+        return self._join(self.iter_lines(iter_source_lines_from_blocks(blocks)))
+
+    @staticmethod
+    def _join(lines: Iterable[str]) -> str:
+        lines = list(lines)
+        # Un testo fatto solo di <br> e spazi diventa vuoto.
+        if not any(lines):
+            return ""
+        return "\n".join(lines)
+
+
+DEFAULT_NORMALIZER = TextNormalizer()
+
 
 def rebalance_headers(text: str, reset_threshold: int = 40) -> str:
     """
     Analizza un testo Markdown e declassa gli header H1 troppo vicini tra loro
-    per creare una gerarchia più logica. Questa funzione viene chiamata dopo
-    la formattazione iniziale degli header.
+    per creare una gerarchia più logica.
 
     Args:
         text (str): Il testo Markdown di input, già parzialmente formattato.
@@ -17,78 +163,14 @@ def rebalance_headers(text: str, reset_threshold: int = 40) -> str:
     """
     if not text or not text.strip():
         return ""
+    rebalancer = HeaderRebalancer(reset_threshold)
+    return "\n".join(rebalancer.feed(line, line.strip()) for line in text.split('\n'))
 
-    lines = text.split('\n')
-    processed_lines = []
-    h1_seen_recently = False
-    lines_since_last_h1 = 0
-
-    for line in lines:
-        stripped_line = line.strip()
-
-        # Logica di reset
-        if lines_since_last_h1 > reset_threshold:
-            h1_seen_recently = False
-
-        # Analisi della riga
-        is_h1 = stripped_line.startswith('# ') and not stripped_line.startswith('##')
-
-        if is_h1:
-            if h1_seen_recently:
-                # Declassa a H2 aggiungendo un '#'
-                processed_lines.append(f"#{line}")
-            else:
-                # Mantieni come H1 e aggiorna lo stato
-                processed_lines.append(line)
-                h1_seen_recently = True
-                lines_since_last_h1 = 0
-        else:
-            # Riga normale, incrementa il contatore se necessario
-            processed_lines.append(line)
-            if h1_seen_recently:
-                 lines_since_last_h1 += 1
-
-    return "\n".join(processed_lines)
 
 def normalize_text(text: str) -> str:
     """
-    Funzione principale che orchestra il processo di normalizzazione in due fasi:
+    Funzione principale che orchestra il processo di normalizzazione, in un'unica passata:
     1. Identifica e formatta gli header grezzi.
     2. Ribalancia la gerarchia degli header per una maggiore coerenza.
     """
-    if not text or not text.strip():
-        return ""
-
-    # Fase 0: Pulizia preliminare
-    text = re.sub(r'<br\s*/?>', '\n', text, flags=re.IGNORECASE)
-
-    # Fase 1: Identificazione e formattazione degli header
-    lines = text.split('\n')
-    formatted_lines = []
-    for line in lines:
-        stripped_line = line.strip()
-        if not stripped_line:
-            formatted_lines.append("")
-            continue
-
-        word_count = len(stripped_line.split())
-        
-        # Heuristic for H1: ALL CAPS, short, not a sentence.
-        is_all_caps = stripped_line.isupper() and stripped_line.lower() != stripped_line
-        if is_all_caps and 1 <= word_count <= 10 and not stripped_line.endswith(('.', ':', ',')):
-            formatted_lines.append(f"# {stripped_line}")
-            continue
-
-        # Heuristic for H2: Multi-level numbering like "1.1", "2.4."
-        if re.match(r'^\d+(\.\d+)+\.?\s', stripped_line):
-            formatted_lines.append(f"## {stripped_line}")
-            continue
-
-        formatted_lines.append(line)
-    
-    formatted_text = "\n".join(formatted_lines)
-
-    # Fase 2: Ribilanciamento degli header appena creati
-    rebalanced_text = rebalance_headers(formatted_text)
-    
-    return rebalanced_text
\ No newline at end of file
+    return DEFAULT_NORMALIZER.normalize(text)
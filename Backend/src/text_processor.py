@@ -1,90 +1,415 @@
 import asyncio
+import io
 import logging
+import uuid
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, OrderedDict, Tuple, List
-from .llm_handler import get_llm, call_llm_with_prompt_async
+from typing import Any, Awaitable, Callable, Dict, OrderedDict, TextIO, Tuple, List
+from .llm_handler import (
+    LLMClientPool, DEFAULT_MODEL_NAME, DEFAULT_TEMPERATURE,
+    call_llm_with_prompt_async, call_llm_async, compile_prompt, format_prompt
+)
+from .llm_router import LLMRouter, parse_api_keys
+from .batching import BatchItem, BatchMode, build_batch_prompt, group_items, parse_batch_response
+from .llm_cache import ResponseCache, make_cache_key
+from .metrics import ERRORS, LLM_CALLS_SAVED, LLM_INFLIGHT, RETRIES, observe_stage, stage_timer
+from .rate_limiter import RateLimiter, is_rate_limit_error
+from .request_dedup import DedupStats, SingleFlight
+from .result_assembler import OrderedResultWriter
+from .retry import RetryPolicy
+from .token_estimator import TokenEstimator
+from .job_scheduler import JobScheduler, Priority, current_priority
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
-# SEMAFORO PER IL RATE LIMITING
-# Limite Gemini: 15 req/min. Stiamo a 14 per sicurezza.
-# Questo limiterà a 14 le chiamate concorrenti in un dato istante.
-RATE_LIMIT_SEMAPHORE = asyncio.Semaphore(14)
+# RATE LIMITER GLOBALE
+# Limite Gemini di default: 15 req/min. Il limiter viene condiviso da tutti i job del
+# processo; api/main.py lo sostituisce con quello configurato in config.json.
+DEFAULT_RATE_LIMITER = RateLimiter()
+
+# Scheduler di default: distribuisce le chiamate tra i job con una coda limitata.
+DEFAULT_SCHEDULER = JobScheduler()
+
+# Politica di retry di default per gli errori temporanei (quota, timeout, 5xx).
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+# Prefisso dei risultati di chunk che non è stato possibile processare.
+CHUNK_ERROR_PREFIX = "ERRORE: Impossibile processare il chunk."
+
+# Callback invocata a ogni (chunk, prompt) completato: (chiave, risposta, fallito).
+ResultCallback = Callable[[Tuple[int, str], str, bool], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class ProcessingOptions:
+    """
+    Come elaborare i chunk di un file: servizi condivisi (rate limiter, cache, scheduler,
+    retry, client e API key), dati del job (id, priorità, callback `on_result`, risultati di un
+    checkpoint in `completed_results`), richieste raggruppate (`batch_mode`), deduplicazione e
+    file di output (`output_path`: il markdown viene scritto lì e al posto del testo si
+    restituisce il percorso).
+    """
+    rate_limiter: RateLimiter | None = None
+    cache: ResponseCache | None = None
+    bypass_cache: bool = False
+    scheduler: JobScheduler | None = None
+    retry_policy: RetryPolicy | None = None
+    llm_pool: LLMClientPool | None = None
+    router: LLMRouter | None = None
+    token_estimator: TokenEstimator | None = None
+    job_id: str | None = None
+    priority: Priority = "interactive"
+    on_result: ResultCallback | None = None
+    completed_results: Dict[Tuple[int, str], str] | None = None
+    batch_mode: BatchMode = "off"
+    batch_max_items: int = 8
+    batch_max_tokens: int = 12000
+    dedup_units: bool = True
+    coalescer: SingleFlight | None = None
+    dedup_stats: DedupStats | None = None
+    output_path: Path | None = None
+
+
+def _open_output(path: Path) -> TextIO:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return open(path, "w", encoding="utf-8")
+
+def is_error_result(response: str) -> bool:
+    return response.startswith(CHUNK_ERROR_PREFIX)
+
+def estimate_prompt_tokens(prompt_text: str, chunk: str, token_estimator: TokenEstimator | None = None) -> int:
+    """
+    Stima dei token di input per il rate limiter: con lo stimatore del modello se disponibile,
+    altrimenti circa 4 caratteri per token.
+    """
+    if token_estimator is not None:
+        return token_estimator.estimate(prompt_text) + token_estimator.estimate(chunk) + 1
+    return (len(prompt_text) + len(chunk)) // 4 + 1
+
+async def _call_with_retries(
+    call: Callable[[Any], Awaitable[str]], model_config: Dict, estimated_tokens: int, label: str,
+    rate_limiter: RateLimiter, retry_policy: RetryPolicy, router: LLMRouter
+) -> Tuple[str, str]:
+    """
+    Esegue `call(llm)` passando dal rate limiter globale, sulla coppia (modello, API key)
+    scelta dal `router`. Un errore di quota passa subito a un'altra coppia disponibile;
+    gli altri errori temporanei (o la quota esaurita ovunque) vengono ritentati con backoff
+    esponenziale e jitter, e ogni tentativo ripassa dal limiter.
+    Restituisce la risposta e il modello che l'ha prodotta.
+    """
+    attempt = 0
+    tried = set()
+    route = router.pick_any(model_config)
+    while True:
+        try:
+            llm = await router.client(route, model_config)
+            async with rate_limiter.acquire(
+                route.model_name, estimated_tokens, router.limiter_key(route), current_priority.get()
+            ) as lease:
+                observe_stage("rate_limiter_wait", lease.waited)
+                logging.info(
+                    f"Processing {label} su {route.model_name} ({route.key_id}) "
+                    f"(tentativo {attempt + 1}, attesa in coda: {lease.waited:.2f}s)"
+                )
+                router.record_request(route, estimated_tokens)
+                LLM_INFLIGHT.inc()
+                try:
+                    with stage_timer("llm_call"):
+                        response = await call(llm)
+                finally:
+                    LLM_INFLIGHT.dec()
+            router.record_success(route)
+            return response, route.model_name
+        except Exception as e:
+            quota_exceeded = is_rate_limit_error(e)
+            router.record_error(route, quota_exceeded)
+            ERRORS.inc(stage="llm", kind="quota" if quota_exceeded else type(e).__name__)
+            if quota_exceeded:
+                tried.add(route)
+                next_route = router.pick(model_config, exclude=tried)
+                if next_route is not None:
+                    router.record_failover(route, next_route)
+                    RETRIES.inc(stage="llm", reason="failover")
+                    route = next_route
+                    continue
+            if not retry_policy.should_retry(e, attempt):
+                raise
+            RETRIES.inc(stage="llm", reason="backoff")
+            delay = retry_policy.delay(attempt)
+            attempt += 1
+            logging.warning(
+                f"Errore temporaneo su {label} ({e}); "
+                f"nuovo tentativo {attempt + 1}/{retry_policy.max_attempts} tra {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+            tried.clear()
+            route = router.pick_any(model_config)
+
+def unit_content_key(model_config: Dict, prompt_text: str, chunk: str, batch_mode: BatchMode = "off") -> str:
+    """
+    Identità del lavoro di un'unità (chunk, prompt): modello, temperatura, prompt formattato e chunk.
+    È anche la chiave della cache delle risposte. Le risposte estratte da una richiesta raggruppata
+    hanno una chiave distinta (con `batch_mode`): il modello non ha visto il prompt singolo.
+    """
+    formatted_prompt = format_prompt(prompt_text, chunk)
+    if batch_mode != "off":
+        formatted_prompt = f"[batch_mode={batch_mode}]\n{formatted_prompt}"
+    return make_cache_key(
+        model_config.get("model_name", DEFAULT_MODEL_NAME), model_config.get("temperature", DEFAULT_TEMPERATURE),
+        formatted_prompt, chunk
+    )
 
 async def process_single_chunk_with_limiter(
-    llm: "Gemini", chunk_idx: int, total_chunks: int, chunk: str, prompt_name: str, prompt_text: str, file_name: str
+    router: LLMRouter, chunk_idx: int, total_chunks: int, chunk: str, prompt_name: str, prompt_text: str, file_name: str,
+    model_config: Dict, rate_limiter: RateLimiter, cache: ResponseCache | None = None, bypass_cache: bool = False,
+    retry_policy: RetryPolicy | None = None, token_estimator: TokenEstimator | None = None,
+    coalescer: SingleFlight | None = None, dedup_stats: DedupStats | None = None
 ) -> Tuple[Tuple[int, str], str]:
     """
-    Wrapper per una singola chiamata API che usa il semaforo per il rate limiting.
+    Wrapper per una singola chiamata API che passa dal rate limiter globale
+    (sulla API key e sul modello scelti dal `router`).
+    Se la risposta è già in cache la restituisce senza consumare quota; con un `coalescer`
+    una richiesta identica già in corso (anche di un altro job) viene attesa invece di ripeterla.
+    Gli errori temporanei vengono ritentati con backoff esponenziale e jitter;
+    ogni tentativo ripassa dal rate limiter.
     Restituisce una tupla con la chiave e il risultato per un facile riassemblaggio.
     """
-    async with RATE_LIMIT_SEMAPHORE:
-        logging.info(f"Processing chunk {chunk_idx}/{total_chunks} di '{file_name}' con prompt '{prompt_name}'")
+    model_name = model_config.get("model_name", DEFAULT_MODEL_NAME)
+    retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+    try:
+        cache_key = unit_content_key(model_config, prompt_text, chunk)
+        if cache is not None:
+            if not bypass_cache:
+                cached_response = await asyncio.to_thread(cache.get, cache_key)
+                if cached_response is not None:
+                    logging.info(f"Cache hit per chunk {chunk_idx}/{total_chunks} di '{file_name}' con prompt '{prompt_name}'")
+                    return (chunk_idx, prompt_name), cached_response
+
+        async def call() -> str:
+            response, used_model = await _call_with_retries(
+                lambda llm: call_llm_with_prompt_async(llm, prompt_text, chunk),
+                model_config, estimate_prompt_tokens(prompt_text, chunk, token_estimator),
+                f"chunk {chunk_idx}/{total_chunks} di '{file_name}' con prompt '{prompt_name}'",
+                rate_limiter, retry_policy, router
+            )
+            # La chiamata salva da sé la risposta: se è condivisa, anche quando il job che l'ha
+            # avviata viene annullato. Le risposte di un modello di riserva non vanno in cache
+            # come se fossero del modello richiesto.
+            if cache is not None and used_model == model_name:
+                await asyncio.to_thread(cache.set, cache_key, response)
+            return response
+
+        if coalescer is None:
+            response = await call()
+        else:
+            response, shared = await coalescer.run(cache_key, call)
+            if shared:
+                logging.info(f"Chunk {chunk_idx}/{total_chunks} di '{file_name}' con prompt '{prompt_name}': richiesta identica già in corso, risposta condivisa")
+                LLM_CALLS_SAVED.inc(reason="coalesced")
+                if dedup_stats is not None:
+                    dedup_stats.coalesced_calls += 1
+        return (chunk_idx, prompt_name), response
+    except Exception as e:
+        logging.error(f"Errore durante l'elaborazione del chunk {chunk_idx} per '{file_name}': {e}")
+        return (chunk_idx, prompt_name), f"{CHUNK_ERROR_PREFIX} Dettagli: {e}"
+
+async def process_batch_with_limiter(
+    router: LLMRouter, items: List[BatchItem], total_chunks: int, file_name: str,
+    model_config: Dict, rate_limiter: RateLimiter, cache: ResponseCache | None = None, bypass_cache: bool = False,
+    retry_policy: RetryPolicy | None = None, token_estimator: TokenEstimator | None = None,
+    coalescer: SingleFlight | None = None, dedup_stats: DedupStats | None = None, batch_mode: BatchMode = "prompts"
+) -> List[Tuple[Tuple[int, str], str]]:
+    """
+    Elabora più coppie (chunk, prompt) con un'unica richiesta a sezioni delimitate.
+    Le coppie già in cache (come richieste singole o raggruppate) non vengono inviate; quelle
+    la cui risposta non si riesce a estrarre (o se la richiesta raggruppata fallisce)
+    vengono rielaborate singolarmente.
+    """
+    def single(item: BatchItem):
+        return process_single_chunk_with_limiter(
+            router, item.chunk_idx, total_chunks, item.chunk, item.prompt_name, item.prompt_text, file_name,
+            model_config, rate_limiter, cache, bypass_cache, retry_policy, token_estimator, coalescer, dedup_stats
+        )
+
+    results: Dict[Tuple[int, str], str] = {}
+    batch_cache_keys: Dict[Tuple[int, str], str] = {}
+    pending = items
+    if cache is not None:
+        batch_cache_keys = {item.key: unit_content_key(model_config, item.prompt_text, item.chunk, batch_mode) for item in items}
+        if not bypass_cache:
+            def lookup() -> Dict[Tuple[int, str], str | None]:
+                return {
+                    item.key: cache.get(unit_content_key(model_config, item.prompt_text, item.chunk))
+                    or cache.get(batch_cache_keys[item.key])
+                    for item in items
+                }
+            cached = await asyncio.to_thread(lookup)
+            results.update({key: response for key, response in cached.items() if response is not None})
+            pending = [item for item in items if item.key not in results]
+
+    if len(pending) == 1:
+        key, response = await single(pending[0])
+        results[key] = response
+    elif pending:
+        model_name = model_config.get("model_name", DEFAULT_MODEL_NAME)
+        batch_prompt = build_batch_prompt(pending)
+        label = f"gruppo di {len(pending)} richieste di '{file_name}' (chunk {pending[0].chunk_idx}-{pending[-1].chunk_idx})"
+        parsed: Dict[int, str] = {}
+        used_model = None
         try:
-            response = await call_llm_with_prompt_async(llm, prompt_text, chunk)
-            # Aggiungiamo un piccolo delay dopo ogni chiamata per non essere troppo aggressivi.
-            # Rilascia il semaforo dopo 4 secondi (60s / 15 req = 4s/req).
-            await asyncio.sleep(4)
-            return (chunk_idx, prompt_name), response
+            response, used_model = await _call_with_retries(
+                lambda llm: call_llm_async(llm, batch_prompt), model_config,
+                estimate_prompt_tokens(batch_prompt, "", token_estimator), label,
+                rate_limiter, retry_policy or DEFAULT_RETRY_POLICY, router
+            )
+            parsed = parse_batch_response(response, len(pending))
         except Exception as e:
-            logging.error(f"Errore durante l'elaborazione del chunk {chunk_idx} per '{file_name}': {e}")
-            return (chunk_idx, prompt_name), f"ERRORE: Impossibile processare il chunk. Dettagli: {e}"
+            logging.error(f"Errore nella richiesta raggruppata ({label}): {e}")
+
+        for index, item in enumerate(pending):
+            if index in parsed:
+                results[item.key] = parsed[index]
+                if item.key in batch_cache_keys and used_model == model_name:
+                    await asyncio.to_thread(cache.set, batch_cache_keys[item.key], parsed[index])
+        fallback = [item for index, item in enumerate(pending) if index not in parsed]
+        if fallback:
+            logging.warning(f"{len(fallback)}/{len(pending)} risposte non estratte da {label}: richieste singole.")
+            ERRORS.inc(len(fallback), stage="llm_batch", kind="unparsed")
+            results.update(dict(await asyncio.gather(*(single(item) for item in fallback))))
+
+    return [(item.key, results[item.key]) for item in items]
 
 async def process_chunks_async(
     chunks: List[str], file_name: str, prompts: OrderedDict,
-    model_config: Dict, google_api_key: str, order_mode: str = "chunk"
-) -> Tuple[str, str]:
+    model_config: Dict, google_api_key: str, order_mode: str = "chunk",
+    options: ProcessingOptions | None = None
+) -> Tuple[str, str | Path]:
     """
-    Elabora una lista di chunk di testo in modo asincrono e concorrente,
-    rispettando il rate limiting.
+    Elabora una lista di chunk di testo in modo asincrono e concorrente, rispettando il
+    rate limiting. Le chiamate passano dallo scheduler, `on_result` viene chiamata appena
+    ogni coppia (chunk, prompt) è pronta e il markdown viene composto nell'ordine di
+    `order_mode` man mano.
     """
+    options = options or ProcessingOptions()
+    rate_limiter = options.rate_limiter or DEFAULT_RATE_LIMITER
+    router = options.router or LLMRouter(parse_api_keys([google_api_key]), rate_limiter=rate_limiter, llm_pool=options.llm_pool)
+    scheduler = options.scheduler or DEFAULT_SCHEDULER
+    job_id = options.job_id or str(uuid.uuid4())
+    cache, bypass_cache = options.cache, options.bypass_cache
+    retry_policy, token_estimator = options.retry_policy, options.token_estimator
     logging.info(f"Inizio elaborazione ASINCRONA per {len(chunks)} chunk di: {file_name}")
     
     if not chunks:
         logging.warning(f"Nessun chunk fornito per il file '{file_name}'.")
         return f"{Path(file_name).stem}.md", "# ATTENZIONE: Nessun contenuto da processare."
 
-    llm = get_llm(model_config, google_api_key)
+    for prompt_text in prompts.values():
+        compile_prompt(prompt_text)
+    # Crea subito il client principale: una configurazione non valida fa fallire il file, non ogni chunk.
+    await router.client(router.pick_any(model_config), model_config)
     
-    # Creiamo una lista di tutte le "task" da eseguire (una per ogni chunk/prompt)
-    tasks = []
+    async def notify(group_results: List[Tuple[Tuple[int, str], str]]) -> None:
+        if options.on_result is not None:
+            for key, response in group_results:
+                await options.on_result(key, response, is_error_result(response))
+
+    async def on_sink(func: Callable[..., Any], *args) -> None:
+        # La scrittura su file resta fuori dall'event loop; quella in memoria no.
+        if options.output_path is not None:
+            await asyncio.to_thread(func, *args)
+        else:
+            func(*args)
+
+    async def write(group_results: List[Tuple[Tuple[int, str], str]]) -> None:
+        await on_sink(writer.add_many, group_results)
+
+    async def run_and_notify(group: List[BatchItem]) -> None:
+        if len(group) == 1:
+            item = group[0]
+            group_results = [await process_single_chunk_with_limiter(
+                router, item.chunk_idx, total_chunks, item.chunk, item.prompt_name, item.prompt_text, file_name,
+                model_config, rate_limiter, cache, bypass_cache, retry_policy, token_estimator, options.coalescer, options.dedup_stats
+            )]
+        else:
+            group_results = await process_batch_with_limiter(
+                router, group, total_chunks, file_name,
+                model_config, rate_limiter, cache, bypass_cache, retry_policy, token_estimator, options.coalescer, options.dedup_stats,
+                options.batch_mode
+            )
+        # La risposta di un'unità vale anche per i suoi duplicati.
+        group_results += [(duplicate, response) for key, response in group_results for duplicate in duplicates.get(key, ())]
+        await write(group_results)
+        await notify(group_results)
+
+    # Le unità di lavoro (una per ogni chunk/prompt, o per ogni gruppo in modalità batch)
+    # vengono create dallo scheduler solo quando le manda in esecuzione.
     total_chunks = len(chunks)
+    completed_results = options.completed_results or {}
+    items: List[BatchItem] = []
+    # Unità rappresentativa -> posizioni con lo stesso identico lavoro.
+    duplicates: Dict[Tuple[int, str], List[Tuple[int, str]]] = {}
+    first_by_content: Dict[str, Tuple[int, str]] = {}
     for chunk_idx, chunk in enumerate(chunks, start=1):
         if not chunk.strip(): continue # Salta chunk vuoti
         for prompt_name, prompt_text in prompts.items():
-            tasks.append(
-                process_single_chunk_with_limiter(llm, chunk_idx, total_chunks, chunk, prompt_name, prompt_text, file_name)
-            )
+            key = (chunk_idx, prompt_name)
+            if options.dedup_units:
+                first = first_by_content.setdefault(unit_content_key(model_config, prompt_text, chunk), key)
+                if first != key:
+                    if key not in completed_results:
+                        duplicates.setdefault(first, []).append(key)
+                    continue
+            if key not in completed_results:
+                items.append(BatchItem(chunk_idx, prompt_name, prompt_text, chunk))
 
-    # Eseguiamo tutte le task in concorrenza.
-    # `asyncio.gather` aspetterà che tutte siano completate.
-    results_list = await asyncio.gather(*tasks)
-    
-    # Riconvertiamo la lista di risultati in un dizionario
-    results = dict(results_list)
+    saved_units = sum(len(keys) for keys in duplicates.values())
+    if saved_units:
+        logging.info(f"'{file_name}': {saved_units} unità duplicate, elaborate una volta sola.")
+        LLM_CALLS_SAVED.inc(saved_units, reason="duplicate")
+        if options.dedup_stats is not None:
+            options.dedup_stats.duplicate_units += saved_units
+    # Duplicati di unità già completate in un'esecuzione precedente: la risposta c'è già.
+    reused_results = [
+        (duplicate, completed_results[first]) for first in list(duplicates)
+        if first in completed_results for duplicate in duplicates.pop(first)
+    ]
 
-    output_content = compile_results_to_string(results, prompts, order_mode, len(chunks))
     output_filename = f"{Path(file_name).stem}.md"
+    if options.output_path is not None:
+        sink = await asyncio.to_thread(_open_output, options.output_path)
+    else:
+        sink = io.StringIO()
+    try:
+        writer = OrderedResultWriter(
+            sink, list(prompts.keys()), order_mode, total_chunks,
+            empty_chunks=[chunk_idx for chunk_idx, chunk in enumerate(chunks, start=1) if not chunk.strip()]
+        )
+        await write([*completed_results.items(), *reused_results])
+        await notify(reused_results)
+
+        count_tokens = token_estimator.estimate if token_estimator is not None else (lambda text: len(text) // 4 + 1)
+        def iter_units():
+            for group in group_items(iter(items), options.batch_mode, options.batch_max_items, options.batch_max_tokens, count_tokens):
+                yield lambda group=group: run_and_notify(group)
+
+        # I risultati arrivano al writer man mano: le unità non restituiscono nulla da raccogliere.
+        await scheduler.submit(job_id, iter_units(), options.priority).wait()
+        await on_sink(writer.close)
+        if writer.max_pending:
+            logging.info(f"'{file_name}': al massimo {writer.max_pending} risultati in attesa di quelli precedenti.")
+    finally:
+        if options.output_path is not None:
+            await asyncio.to_thread(sink.close)
+
     logging.info(f"Elaborazione ASINCRONA di '{file_name}' completata.")
-    return output_filename, output_content
+    return output_filename, options.output_path if options.output_path is not None else sink.getvalue()
 
 def compile_results_to_string(
     results: Dict[Tuple[int, str], str], prompts: OrderedDict, order_mode: str, num_chunks: int
 ) -> str:
     """Compila i risultati in una singola stringa Markdown."""
-    lines = []
-    # Usiamo num_chunks passato come argomento invece di calcolarlo
-    if order_mode == "chunk":
-        for chunk_idx in range(1, num_chunks + 1):
-            for prompt_name in prompts.keys():
-                response = results.get((chunk_idx, prompt_name), "")
-                lines.append(response)
-                lines.append("\n---\n")
-    else: # order_mode == "prompt"
-        for prompt_name in prompts.keys():
-            lines.append(f"# Risultati per Prompt: {prompt_name}\n\n")
-            for chunk_idx in range(1, num_chunks + 1):
-                response = results.get((chunk_idx, prompt_name), "")
-                lines.append(response)
-                lines.append("\n---\n")
-    return "\n".join(lines)
+    buffer = io.StringIO()
+    writer = OrderedResultWriter(buffer, list(prompts.keys()), order_mode, num_chunks)
+    writer.add_many(results.items())
+    writer.close()
+    return buffer.getvalue()
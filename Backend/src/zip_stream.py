@@ -0,0 +1,178 @@
+import os
+import time
+import uuid
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional
+
+# Formati già compressi: ricomprimerli con deflate costa CPU senza ridurre la dimensione.
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif", ".zip", ".gz", ".7z", ".mp3", ".mp4"}
+
+READ_BLOCK_SIZE = 256 * 1024
+
+
+@dataclass
+class ZipEntry:
+    """
+    Un file da inserire nell'archivio: contenuto in memoria (`data`), file su disco (`path`)
+    oppure una funzione che restituisce i blocchi del contenuto (`blocks`, con `size` stimata).
+    """
+    arcname: str
+    data: Optional[bytes] = None
+    path: Optional[Path] = None
+    blocks: Optional[Callable[[], Iterator[bytes]]] = None
+    size: int = 0
+
+    def iter_blocks(self) -> Iterator[bytes]:
+        if self.data is not None:
+            for offset in range(0, len(self.data), READ_BLOCK_SIZE):
+                yield self.data[offset:offset + READ_BLOCK_SIZE]
+        elif self.path is not None:
+            with open(self.path, "rb") as src:
+                while block := src.read(READ_BLOCK_SIZE):
+                    yield block
+        else:
+            yield from self.blocks()
+
+    def total_size(self) -> int:
+        if self.data is not None:
+            return len(self.data)
+        if self.path is not None:
+            return self.path.stat().st_size
+        return self.size
+
+
+class _StreamSink:
+    """
+    File-like non riposizionabile su cui scrive `zipfile`: accumula i byte prodotti
+    finché non vengono prelevati con `drain`. `zipfile` rileva l'assenza di `seek`
+    e usa i data descriptor, quindi ogni voce può essere emessa appena compressa.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def collect_attachment_entries(attachment_paths: List[str]) -> List[ZipEntry]:
+    """Elenca i file delle cartelle allegati come voci `Allegati/<cartella>/<file>`."""
+    entries = []
+    allegati_root = Path("Allegati")
+    for path_str in attachment_paths:
+        path = Path(path_str)
+        if path.is_dir():
+            for file_path in path.rglob('*'):
+                if file_path.is_file():
+                    entries.append(ZipEntry(arcname=str(allegati_root / path.name / file_path.name), path=file_path))
+    return entries
+
+
+def _zip_info(entry: ZipEntry) -> zipfile.ZipInfo:
+    if entry.path is not None:
+        zinfo = zipfile.ZipInfo.from_file(entry.path, arcname=entry.arcname)
+    else:
+        zinfo = zipfile.ZipInfo(entry.arcname, date_time=time.localtime()[:6])
+        zinfo.external_attr = 0o644 << 16
+    suffix = Path(entry.arcname).suffix.lower()
+    zinfo.compress_type = zipfile.ZIP_STORED if suffix in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+    return zinfo
+
+
+def iter_zip(entries: Iterable[ZipEntry], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Genera un archivio ZIP a blocchi: ogni voce viene emessa mentre viene compressa,
+    senza mai tenere in memoria più di qualche blocco dell'archivio.
+    """
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        for entry in entries:
+            zinfo = _zip_info(entry)
+            with zf.open(zinfo, "w", force_zip64=entry.total_size() > zipfile.ZIP64_LIMIT // 2) as dest:
+                for block in entry.iter_blocks():
+                    dest.write(block)
+                    if sink.pending() >= chunk_size:
+                        yield sink.drain()
+            if sink.pending() >= chunk_size:
+                yield sink.drain()
+    # Directory centrale finale.
+    yield sink.drain()
+
+
+class ArchiveSpool:
+    """
+    Copia dell'archivio prodotto durante il primo download, per servire i download successivi
+    senza ricomprimere nulla. Resta in memoria finché è piccolo; superato `spill_threshold`
+    byte viene riversato in un file temporaneo. A fine archivio viene sempre salvato in
+    `final_path` (con un rename atomico), così è disponibile a tutti i worker.
+    """
+    def __init__(self, final_path: Path, spill_threshold: int):
+        self.final_path = Path(final_path)
+        self.spill_threshold = spill_threshold
+        self._memory = bytearray()
+        self._file: Optional[BinaryIO] = None
+        self._part_path = self.final_path.with_name(f"{self.final_path.name}.{uuid.uuid4().hex}.part")
+
+    def write(self, data: bytes) -> None:
+        if self._file is None and len(self._memory) + len(data) > self.spill_threshold:
+            self.final_path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self._part_path, "wb")
+            self._file.write(self._memory)
+            self._memory = bytearray()
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._memory += data
+
+    def finish(self) -> Path:
+        """Chiude lo spool e restituisce il percorso dell'archivio completo."""
+        if self._file is None:
+            self.final_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._part_path, "wb") as f:
+                f.write(self._memory)
+            self._memory = bytearray()
+        else:
+            self._file.close()
+        os.replace(self._part_path, self.final_path)
+        return self.final_path
+
+    def discard(self) -> None:
+        """Scarta un archivio incompleto (es. client disconnesso a metà download)."""
+        if self._file is not None:
+            self._file.close()
+            self._part_path.unlink(missing_ok=True)
+        self._memory = bytearray()
+
+
+def write_archive(entries: List[ZipEntry], final_path: Path) -> Path:
+    """
+    Scrive l'intero archivio in `final_path` (con un rename atomico a fine scrittura).
+    Funzione bloccante, pensata per un processo worker: le voci devono essere serializzabili
+    (file su disco o `blocks` costruiti con funzioni di modulo).
+    """
+    spool = ArchiveSpool(final_path, spill_threshold=0)
+    try:
+        for block in iter_zip(entries):
+            spool.write(block)
+        return spool.finish()
+    except BaseException:
+        spool.discard()
+        raise
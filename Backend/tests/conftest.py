@@ -0,0 +1,58 @@
+import io
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from pypdf import PdfWriter
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """
+    api.main con i provider simulati, senza cache né pool CPU e con uno store temporaneo
+    (come `configure_app` di bench_end_to_end). La configurazione va impostata prima dell'import.
+    """
+    os.environ.setdefault("GOOGLE_API_KEY", "fake-google-key")
+    os.environ.setdefault("MISTRAL_API_KEY", "fake-mistral-key")
+    from api.config import app_config
+    app_config["providers"] = {
+        "llm": "fake",
+        "ocr": "fake",
+        "fake_llm": {"latency": {"distribution": "fixed", "mean_ms": 1}},
+        "fake_ocr": {"latency": {"distribution": "fixed", "mean_ms": 50}},
+    }
+    app_config["rate_limits"] = {"default": {"rpm": 60000, "tpm": 100_000_000, "max_concurrency": 16}}
+    app_config["llm_cache"] = {"enabled": False}
+    app_config["ocr_cache"] = {"enabled": False}
+    app_config["cpu_pool"] = {"enabled": False}
+    app_config["job_store"] = {**app_config.get("job_store", {}), "root_dir": str(tmp_path_factory.mktemp("jobs"))}
+    from api import main
+    return main
+
+
+@pytest.fixture
+def client(app_module):
+    """Client HTTP sull'app, senza lifespan (niente task periodici né warm-up)."""
+    return TestClient(app_module.app)
+
+
+@pytest.fixture(scope="session")
+def live_client(app_module):
+    """
+    Client con il lifespan avviato: tutte le richieste girano sullo stesso event loop, così
+    gli eventi pubblicati (anche con `live_client.portal.call`) svegliano long-poll e SSE.
+    Un solo loop per tutta la sessione, come nel server: rate limiter e scheduler sono
+    globali e le loro primitive asyncio restano legate al loop su cui sono state usate.
+    """
+    with TestClient(app_module.app) as test_client:
+        yield test_client
+
+
+def make_pdf(num_pages: int = 1) -> bytes:
+    """PDF con `num_pages` pagine vuote, per l'OCR simulato."""
+    writer = PdfWriter()
+    for _ in range(num_pages):
+        writer.add_blank_page(width=200, height=200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
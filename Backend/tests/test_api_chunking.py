@@ -0,0 +1,36 @@
+import time
+
+from src.ocr_handler import TEMP_ATTACHMENT_DIR
+
+from conftest import make_pdf
+
+
+def _request_dirs():
+    return {path.name for path in TEMP_ATTACHMENT_DIR.iterdir() if not path.name.startswith("_")}
+
+
+def test_chunk_returns_files_in_upload_order(client):
+    files = [
+        ("files", ("b.txt", "Secondo file. " * 20, "text/plain")),
+        ("files", ("a.pdf", make_pdf(2), "application/pdf")),
+    ]
+    response = client.post("/chunk", files=files, data={"max_words": 50, "min_words": 10})
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["file_name"] for item in body] == ["b.txt", "a.pdf"]
+    assert body[1]["attachment_path"] and all(body[1]["chunks"])
+
+
+def test_failed_file_cancels_the_others_and_removes_attachments(client):
+    before = _request_dirs()
+    files = [
+        ("files", ("lento.pdf", make_pdf(6), "application/pdf")),
+        ("files", ("rotto.txt", b"\xff\xfe\xfa non UTF-8", "text/plain")),
+    ]
+    response = client.post("/chunk", files=files)
+    assert response.status_code == 400
+    assert "rotto.txt" in response.json()["detail"]
+
+    # L'OCR del PDF (300 ms simulati) non prosegue e la cartella della richiesta sparisce.
+    time.sleep(0.6)
+    assert _request_dirs() == before
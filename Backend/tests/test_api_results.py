@@ -0,0 +1,169 @@
+import io
+import json
+import threading
+import time
+import uuid
+import zipfile
+
+
+def _create_job(app_module) -> str:
+    job_id = str(uuid.uuid4())
+    app_module.JOB_STORE.create(job_id, "In coda.", {})
+    return job_id
+
+
+def _sse_events(body: str):
+    events = []
+    for block in body.split("\n\n"):
+        data = [line[len("data: "):] for line in block.splitlines() if line.startswith("data: ")]
+        if data:
+            events.append(json.loads("\n".join(data)))
+    return events
+
+
+def _publish_progress(app_module, job_id: str, done: int) -> None:
+    """Come `make_progress_callback`: aggiorna lo store e pubblica l'evento (sul loop dell'app)."""
+    version = app_module.JOB_STORE.update_progress(job_id, {"done": done})
+    return app_module.JOB_EVENTS.publish(job_id, "progress", version, {"done": done})
+
+
+def test_results_etag_returns_304_until_the_job_changes(client, app_module):
+    job_id = _create_job(app_module)
+    first = client.get(f"/results/{job_id}")
+    assert first.status_code == 200
+    assert first.json()["status"] == "pending"
+    etag = first.headers["etag"]
+
+    unchanged = client.get(f"/results/{job_id}", headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.headers["etag"] == etag
+    assert unchanged.content == b""
+
+    app_module.JOB_STORE.update_progress(job_id, {"done": 1})
+    changed = client.get(f"/results/{job_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()["progress"] == {"done": 1}
+
+
+def test_long_poll_without_changes_returns_304_after_wait(client, app_module):
+    job_id = _create_job(app_module)
+    etag = client.get(f"/results/{job_id}").headers["etag"]
+    start = time.monotonic()
+    response = client.get(f"/results/{job_id}", params={"wait": 0.5}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert time.monotonic() - start >= 0.5
+
+
+def test_long_poll_wakes_up_on_status_change(live_client, app_module):
+    job_id = _create_job(app_module)
+    etag = live_client.get(f"/results/{job_id}").headers["etag"]
+    result = {}
+
+    def poll():
+        start = time.monotonic()
+        result["response"] = live_client.get(f"/results/{job_id}", params={"wait": 10}, headers={"If-None-Match": etag})
+        result["elapsed"] = time.monotonic() - start
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    time.sleep(0.3)
+    assert live_client.portal.call(app_module.set_job_status, job_id, "processing", None, ("pending",))
+    poller.join(timeout=5)
+
+    response = result["response"]
+    assert response.status_code == 200
+    assert response.json()["status"] == "processing"
+    assert response.headers["etag"] != etag
+    # Svegliato dall'evento, non dal controllo periodico dello store (ogni secondo) né dal timeout.
+    assert result["elapsed"] < 0.9
+
+
+def test_events_stream_sends_snapshot_progress_and_final_status(live_client, app_module):
+    job_id = _create_job(app_module)
+
+    def drive_job():
+        # Lascia al client il tempo di iscriversi (lo snapshot iniziale arriva comunque).
+        time.sleep(0.3)
+        live_client.portal.call(app_module.set_job_status, job_id, "processing", None, ("pending",))
+        live_client.portal.call(_publish_progress, app_module, job_id, 1)
+        live_client.portal.call(app_module.set_job_status, job_id, "completed")
+
+    driver = threading.Thread(target=drive_job)
+    driver.start()
+    with live_client.stream("GET", f"/jobs/{job_id}/events") as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = response.read().decode("utf-8")
+    driver.join(timeout=5)
+
+    events = _sse_events(body)
+    assert [(e["type"], e.get("status")) for e in events] == [
+        ("snapshot", "pending"), ("status", "processing"), ("progress", None), ("status", "completed"),
+    ]
+    versions = [e["version"] for e in events]
+    assert versions == sorted(versions) and len(set(versions)) == len(versions)
+    assert events[2]["done"] == 1
+    # Ogni evento porta anche `event:` e `id:` (la versione) per EventSource.
+    assert f"event: progress\nid: {events[2]['version']}\n" in body
+
+
+def test_events_stream_of_finished_job_sends_only_the_snapshot(client, app_module):
+    job_id = _create_job(app_module)
+    app_module.JOB_STORE.transition(job_id, ("pending",), "cancelled", "Annullato.")
+    response = client.get(f"/jobs/{job_id}/events")
+    assert [(e["type"], e["status"]) for e in _sse_events(response.text)] == [("snapshot", "cancelled")]
+
+
+def test_unknown_job_is_404(client):
+    assert client.get(f"/results/{uuid.uuid4()}").status_code == 404
+    assert client.get(f"/jobs/{uuid.uuid4()}/events").status_code == 404
+
+
+def _completed_job_with_archive(app_module, tmp_path) -> str:
+    job_id = _create_job(app_module)
+    attachments = tmp_path / "allegati"
+    attachments.mkdir()
+    (attachments / "logo.png").write_bytes(b"\x89PNG" + bytes(range(256)) * 20)
+    app_module.JOB_STORE.save_outputs(job_id, {"a.md": b"# A\n\nprimo", "b.md": b"# B\n\nsecondo"})
+    app_module.JOB_STORE.update_meta(job_id, attachments=[str(attachments)])
+    app_module.JOB_STORE.transition(job_id, ("pending",), "completed")
+    return job_id
+
+
+def test_second_download_is_served_from_the_saved_archive(client, app_module, tmp_path, monkeypatch):
+    job_id = _completed_job_with_archive(app_module, tmp_path)
+    archive_path = app_module.JOB_STORE.archive_path(job_id)
+
+    first = client.get(f"/results/{job_id}")
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "application/zip"
+    assert archive_path.read_bytes() == first.content
+    with zipfile.ZipFile(io.BytesIO(first.content)) as zf:
+        assert zf.read("a.md") == b"# A\n\nprimo"
+        assert zf.getinfo("Allegati/allegati/logo.png").compress_type == zipfile.ZIP_STORED
+
+    # Il secondo download non rielenca né ricomprime nulla.
+    def fail(job):
+        raise AssertionError("archivio rigenerato")
+    monkeypatch.setattr(app_module, "archive_entries", fail)
+    second = client.get(f"/results/{job_id}")
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert second.headers["content-length"] == str(len(first.content))
+
+
+def test_partial_results_serve_the_written_prefix(client, app_module):
+    job_id = _create_job(app_module)
+    assert client.get(f"/results/{job_id}/partial").status_code == 404
+
+    partial = app_module.JOB_STORE.partial_output_path(job_id, 0)
+    partial.parent.mkdir(parents=True, exist_ok=True)
+    partial.write_text("# Doc\n\nprimo risultato\n", encoding="utf-8")
+    response = client.get(f"/results/{job_id}/partial", params={"file_index": 0})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/markdown")
+    assert response.headers["x-job-status"] == "pending"
+    assert response.text == "# Doc\n\nprimo risultato\n"
+    assert client.get(f"/results/{job_id}/partial", params={"file_index": 1}).status_code == 404
+    assert client.get(f"/results/{uuid.uuid4()}/partial").status_code == 404
@@ -0,0 +1,113 @@
+import pytest
+
+from src.fake_providers import FakeLLM
+
+PROMPTS = {
+    "riassunto": "Riassumi il testo seguente.\n\n{text_chunk}",
+    "domande": "Scrivi una domanda sul testo seguente.\n\n{text_chunk}",
+}
+CHUNKS = ["Primo chunk sui dati.", "Secondo chunk sui modelli.", "Terzo chunk sui risultati."]
+
+
+@pytest.fixture
+def llm_prompts(monkeypatch):
+    """Prompt effettivamente inviati all'LLM simulato."""
+    prompts = []
+    original = FakeLLM.acomplete
+
+    async def recording_acomplete(self, prompt):
+        prompts.append(prompt)
+        return await original(self, prompt)
+
+    monkeypatch.setattr(FakeLLM, "acomplete", recording_acomplete)
+    return prompts
+
+
+def _request(chunks, prompts=PROMPTS):
+    return {
+        "files_to_process": [{"file_name": "doc.md", "chunks": chunks, "prompts": prompts}],
+        # La cache LLM è disabilitata nei test; bypass_cache rende esplicito che non conta.
+        "bypass_cache": True,
+    }
+
+
+def _markdown(client, job_id: str) -> str:
+    response = client.get(f"/results/{job_id}")
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/markdown")
+    return response.text
+
+
+def _completed_job(client, llm_prompts, chunks) -> str:
+    # Con TestClient i background task terminano prima che la risposta venga restituita.
+    response = client.post("/process", json=_request(chunks))
+    assert response.status_code == 202
+    assert len(llm_prompts) == len(chunks) * len(PROMPTS)
+    llm_prompts.clear()
+    return response.json()["job_id"]
+
+
+def _sent_units(llm_prompts):
+    """(prompt, chunk) delle chiamate fatte, ricavati dal testo inviato."""
+    units = set()
+    for sent in llm_prompts:
+        for name, template in PROMPTS.items():
+            head = template.split("{text_chunk}")[0]
+            if sent.startswith(head):
+                units.add((name, sent[len(head):]))
+    return units
+
+
+def test_revise_reuses_unchanged_units_and_requeues_only_changed_ones(live_client, llm_prompts):
+    parent_id = _completed_job(live_client, llm_prompts, CHUNKS)
+    parent_markdown = _markdown(live_client, parent_id)
+
+    # Il secondo chunk è corretto, il terzo spostato in testa, e se ne aggiunge uno nuovo.
+    revised_chunks = [CHUNKS[2], CHUNKS[0], "Secondo chunk sui modelli, corretto.", "Quarto chunk nuovo."]
+    response = live_client.post(f"/jobs/{parent_id}/revise", json=_request(revised_chunks))
+
+    assert response.status_code == 202
+    body = response.json()
+    assert body["parent_job_id"] == parent_id
+    assert body["units_reused"] == 4
+    assert body["units_to_process"] == 4
+    assert len(llm_prompts) == 4
+    assert _sent_units(llm_prompts) == {
+        (name, chunk) for name in PROMPTS for chunk in revised_chunks[2:]
+    }
+
+    revision_markdown = _markdown(live_client, body["job_id"])
+    # Le risposte riprese sono identiche a quelle del padre; il padre resta invariato.
+    for line in parent_markdown.splitlines():
+        if line.startswith("Risposta simulata") and "Secondo chunk" not in line:
+            assert line in revision_markdown
+    assert _markdown(live_client, parent_id) == parent_markdown
+
+
+def test_revise_with_changed_prompt_requeues_only_that_prompt(live_client, llm_prompts):
+    parent_id = _completed_job(live_client, llm_prompts, CHUNKS)
+
+    prompts = {**PROMPTS, "domande": "Scrivi due domande sul testo seguente.\n\n{text_chunk}"}
+    response = live_client.post(f"/jobs/{parent_id}/revise", json=_request(CHUNKS, prompts))
+
+    assert response.status_code == 202
+    assert (response.json()["units_reused"], response.json()["units_to_process"]) == (3, 3)
+    assert len(llm_prompts) == 3
+    assert all(sent.startswith("Scrivi due domande") for sent in llm_prompts)
+
+
+def test_revise_without_changes_calls_nothing(live_client, llm_prompts):
+    parent_id = _completed_job(live_client, llm_prompts, CHUNKS)
+
+    response = live_client.post(f"/jobs/{parent_id}/revise", json=_request(CHUNKS))
+
+    assert response.status_code == 202
+    assert (response.json()["units_reused"], response.json()["units_to_process"]) == (6, 0)
+    assert llm_prompts == []
+    assert _markdown(live_client, response.json()["job_id"]) == _markdown(live_client, parent_id)
+
+
+def test_revise_of_active_or_unknown_job_is_rejected(live_client, app_module):
+    assert live_client.post("/jobs/sconosciuto/revise", json=_request(CHUNKS)).status_code == 404
+    app_module.JOB_STORE.create("attivo", "In coda.", {})
+    assert live_client.post("/jobs/attivo/revise", json=_request(CHUNKS)).status_code == 409
@@ -0,0 +1,123 @@
+import random
+
+import pytest
+
+from benchmarks.bench_chunking import make_markdown, make_paragraph
+from benchmarks.legacy_splitter import LegacyHierarchicalSplitter
+from src.chunking_strategy import HierarchicalSplitter, NativeSentencePacker, get_sentence_splitter, get_splitter
+from src.token_estimator import TokenEstimator
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt labore".split()
+
+
+def _prose(rng: random.Random, sentences: int) -> str:
+    parts = []
+    for _ in range(sentences):
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 30)))
+        parts.append(sentence.capitalize() + rng.choice([".", ",", "!", ";", ""]))
+    return " ".join(parts)
+
+
+@pytest.mark.parametrize("sentence_splitter", ["llama_index", "native"])
+@pytest.mark.parametrize("max_tokens", [200, 500])
+def test_token_mode_keeps_chunks_within_budget(sentence_splitter, max_tokens):
+    rng = random.Random(max_tokens)
+    estimator = TokenEstimator()
+    text = "# Titolo\n" + _prose(rng, 400) + "\n\n## Sezione\n\n" + _prose(rng, 50)
+    splitter = get_splitter({"max_tokens": max_tokens, "sentence_splitter": sentence_splitter}, estimator)
+
+    chunks = splitter.split(text)
+
+    assert len(chunks) > 1
+    assert max(estimator.estimate_raw(chunk) for chunk in chunks) <= max_tokens
+
+
+def test_native_packer_wraps_sentences_without_punctuation():
+    estimator = TokenEstimator()
+    text = " ".join(WORDS * 200)
+    packer = NativeSentencePacker(chunk_size=100, chunk_overlap=20, token_estimator=estimator)
+
+    chunks = packer.split_text(text)
+
+    assert len(chunks) > 1
+    assert max(estimator.estimate_raw(chunk) for chunk in chunks) <= 100
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_split_matches_legacy(seed):
+    # Dimensioni e limiti variano con il seed: sezioni minuscole da aggregare e, ogni
+    # 40 sezioni, una sezione lunga che passa dalla divisione semantica. Con `max_words`
+    # sotto la dimensione di un sotto-blocco semantico l'algoritmo originale non termina.
+    rng = random.Random(seed)
+    max_words = rng.choice([800, 1000, 1200])
+    min_words = max_words * rng.choice([1, 2, 3]) // 10
+    text = make_markdown(rng.randint(5_000, 40_000), seed=seed)
+
+    chunks = HierarchicalSplitter(max_words=max_words, min_words=min_words).split(text)
+
+    assert chunks == LegacyHierarchicalSplitter(max_words=max_words, min_words=min_words).split(text)
+
+
+@pytest.mark.parametrize("text", ["", "   \n", "Solo testo senza titoli.", "# Titolo\n", "# A\n\n## B\n\ntesto\n\n# C"])
+def test_split_matches_legacy_on_edge_cases(text):
+    assert HierarchicalSplitter().split(text) == LegacyHierarchicalSplitter().split(text)
+
+
+def _sample_text(shape: str, seed: int) -> str:
+    rng = random.Random(seed)
+    if shape == "prosa":
+        return "\n\n".join(make_paragraph(rng, rng.randint(20, 300)) for _ in range(8))
+    if shape == "paragrafi brevi":
+        return "\n\n".join(make_paragraph(rng, rng.randint(3, 15)) for _ in range(60))
+    return " ".join(rng.choice(WORDS) for _ in range(1500))
+
+
+def _word_spans(text: str, chunks):
+    """Posizione (inizio, fine) di ogni chunk nella sequenza di parole del testo; None se non è contigua."""
+    words = text.split()
+    spans, covered = [], 0
+    for chunk in chunks:
+        chunk_words = chunk.split()
+        starts = [p for p in range(covered + 1) if words[p:p + len(chunk_words)] == chunk_words]
+        if not starts:
+            return words, None
+        spans.append((starts[-1], starts[-1] + len(chunk_words)))
+        covered = max(covered, spans[-1][1])
+    return words, spans
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("shape", ["prosa", "paragrafi brevi", "senza punteggiatura"])
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(100, 0), (100, 20), (300, 50)])
+def test_native_packer_is_equivalent_to_llama_index(seed, shape, chunk_size, chunk_overlap):
+    # Stesso contratto dello splitter di llama_index, misurato con lo stesso stimatore:
+    # budget rispettato, testo coperto tutto e in ordine, sovrapposizione entro il limite.
+    estimator = TokenEstimator()
+    text = _sample_text(shape, seed)
+    counts = {}
+    for kind in ("llama_index", "native"):
+        chunks = get_sentence_splitter(kind, chunk_size, chunk_overlap, estimator).split_text(text)
+        counts[kind] = len(chunks)
+        assert max(estimator.estimate_raw(chunk) for chunk in chunks) <= chunk_size
+
+        words, spans = _word_spans(text, chunks)
+        assert spans is not None, f"{kind}: chunk non contiguo nel testo"
+        assert spans[0][0] == 0 and spans[-1][1] == len(words)
+        for (start, end), (next_start, _) in zip(spans, spans[1:]):
+            assert start <= next_start <= end
+            overlap = " ".join(words[next_start:end])
+            assert not overlap or estimator.estimate_raw(overlap) <= chunk_overlap
+
+    if shape == "senza punteggiatura":
+        # Senza frasi il packer spezza a parole riempiendo i chunk: mai più chunk di llama_index.
+        assert counts["native"] <= counts["llama_index"]
+    else:
+        # Stesse frasi e paragrafi: il numero di chunk differisce solo per gli arrotondamenti.
+        assert abs(counts["native"] - counts["llama_index"]) <= max(2, 0.15 * counts["llama_index"])
+
+
+@pytest.mark.parametrize("text", ["Una frase.", "Prima frase. Seconda frase.\n\nNuovo paragrafo.", "parole senza punto finale"])
+def test_native_packer_matches_llama_index_when_text_fits(text):
+    estimator = TokenEstimator()
+    llama = get_sentence_splitter("llama_index", 100, 20, estimator).split_text(text)
+    assert get_sentence_splitter("native", 100, 20, estimator).split_text(text) == llama == [text]
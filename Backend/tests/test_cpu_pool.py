@@ -0,0 +1,98 @@
+import asyncio
+import logging
+
+from benchmarks.bench_chunking import make_markdown
+from src.cpu_pool import CPUPool, SplitterSpec, _build_splitter, _ping, split_text, split_text_file
+
+
+def test_warm_starts_every_worker(caplog):
+    pool = CPUPool(workers=3)
+    try:
+        with caplog.at_level(logging.INFO, logger="src.cpu_pool"):
+            asyncio.run(pool.warm())
+    finally:
+        pool.shutdown()
+    assert "Pool CPU pronto: 3 processi" in caplog.text
+
+
+def test_disabled_pool_runs_inline():
+    pool = CPUPool(workers=0)
+    assert asyncio.run(pool.run(sum, [1, 2, 3])) == 6
+    assert pool.stats()["inline_tasks"] == 1
+
+
+def _splitter_builds() -> int:
+    """Eseguita nei worker: quante volte il processo ha costruito uno splitter."""
+    return _build_splitter.cache_info().misses
+
+
+def _text(size: int) -> str:
+    # Qualche "\r\n": passando dal file temporaneo il testo deve restare identico.
+    return make_markdown(size, seed=5).replace("\n\n", "\r\n\r\n", 3)
+
+
+def test_large_text_goes_to_the_worker_through_a_temp_file(tmp_path, monkeypatch):
+    pool = CPUPool(workers=1, min_input_bytes=1024, spool_dir=str(tmp_path))
+    spec = SplitterSpec.from_config({"max_words": 200, "min_words": 50, "sentence_splitter": "native"})
+    text = _text(50_000)
+    sent = []
+    original_run = pool.run
+
+    async def recording_run(func, *args):
+        sent.append((func, args))
+        return await original_run(func, *args)
+
+    monkeypatch.setattr(pool, "run", recording_run)
+    try:
+        chunks, timings = asyncio.run(pool.split_text(text, True, spec))
+    finally:
+        pool.shutdown()
+
+    assert (chunks, set(timings)) == (split_text(text, True, spec)[0], {"normalize", "split"})
+    [(func, args)] = sent
+    assert func is split_text_file
+    # Al worker arriva solo il percorso; il file temporaneo viene rimosso.
+    assert not any(isinstance(arg, str) and len(arg) > 1024 for arg in args)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_small_text_is_split_inline():
+    pool = CPUPool(workers=1, min_input_bytes=1024 * 1024)
+    spec = SplitterSpec.from_config({"sentence_splitter": "native"})
+    try:
+        chunks, _ = asyncio.run(pool.split_text(_text(5_000), False, spec))
+    finally:
+        pool.shutdown()
+    assert chunks == split_text(_text(5_000), False, spec)[0]
+    assert pool.stats()["inline_tasks"] == 1 and pool.stats()["tasks"] == 0
+
+
+def test_pool_and_splitter_are_reused_across_requests(tmp_path):
+    spec = SplitterSpec.from_config({"max_words": 300, "min_words": 100, "sentence_splitter": "native"})
+    pool = CPUPool(workers=2, min_input_bytes=1024, spool_dir=str(tmp_path), warm_spec=spec)
+    executor = pool._executor
+    upload = tmp_path / "upload.md"
+    upload.write_text(_text(30_000), encoding="utf-8")
+
+    async def requests():
+        await pool.warm()
+        # `_ping` attende alla barriera del warm-up: risponde ogni worker, una volta ciascuno.
+        pids = set(await asyncio.gather(*(pool.run(_ping, 10) for _ in range(2))))
+        for _ in range(3):
+            await pool.split_text(_text(30_000), True, spec)
+            with open(upload, "rb") as f:
+                await pool.split_upload(f, upload.stat().st_size, True, spec)
+        after = set(await asyncio.gather(*(pool.run(_ping, 10) for _ in range(2))))
+        # Ogni worker ha costruito lo splitter una sola volta (all'avvio), non per richiesta.
+        misses = set(await asyncio.gather(*(pool.run(_splitter_builds) for _ in range(4))))
+        return pids, after, misses
+
+    try:
+        pids, after, misses = asyncio.run(requests())
+    finally:
+        pool.shutdown()
+
+    assert pool._executor is executor
+    assert after == pids and len(pids) == 2
+    assert misses == {1}
+    assert pool.stats()["tasks"] >= 6
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from src.job_scheduler import JobCancelledError, JobScheduler, current_priority
+
+
+def _recording_units(order, label, count):
+    async def unit(index):
+        order.append(label)
+        await asyncio.sleep(0)
+        return f"{label}{index}"
+    return [lambda index=index: unit(index) for index in range(count)]
+
+
+def test_jobs_of_same_priority_take_turns():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent_units=1)
+        order = []
+        first = scheduler.submit("a", _recording_units(order, "a", 4))
+        second = scheduler.submit("b", _recording_units(order, "b", 4))
+        results = await asyncio.gather(first.wait(), second.wait())
+        return order, results
+
+    order, results = asyncio.run(scenario())
+
+    assert order == ["a", "b"] * 4
+    assert results == [["a0", "a1", "a2", "a3"], ["b0", "b1", "b2", "b3"]]
+
+
+def test_bulk_job_is_served_every_interactive_weight_units():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent_units=1, interactive_weight=3)
+        order = []
+        bulk = scheduler.submit("bulk", _recording_units(order, "b", 3), priority="bulk")
+        interactive = scheduler.submit("interactive", _recording_units(order, "i", 9))
+        await asyncio.gather(bulk.wait(), interactive.wait())
+        return order
+
+    order = asyncio.run(scenario())
+
+    assert order == ["i", "i", "i", "b"] * 3
+
+
+def test_cancel_stops_queued_and_running_units():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent_units=2)
+        started, finished = [], []
+        running = asyncio.Event()
+
+        async def slow(index):
+            started.append(index)
+            running.set()
+            await asyncio.sleep(10)
+            finished.append(index)
+
+        batch = scheduler.submit("job", [lambda index=index: slow(index) for index in range(10)])
+        other = scheduler.submit("other", [lambda: asyncio.sleep(0, result="ok")])
+        await running.wait()
+        await asyncio.sleep(0)
+        assert scheduler.cancel("job")
+        with pytest.raises(JobCancelledError):
+            await asyncio.wait_for(batch.wait(), timeout=1)
+        late = scheduler.submit("job", [lambda: asyncio.sleep(0)])
+        with pytest.raises(JobCancelledError):
+            await late.wait()
+        return started, finished, await asyncio.wait_for(other.wait(), timeout=1)
+
+    started, finished, other_results = asyncio.run(scenario())
+
+    assert len(started) <= 2
+    assert finished == []
+    assert other_results == ["ok"]
+
+
+def test_cancel_unknown_job_returns_false():
+    assert JobScheduler().cancel("missing") is False
+
+
+def test_units_see_the_priority_of_their_job():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent_units=2)
+
+        async def unit():
+            return current_priority.get()
+
+        bulk = scheduler.submit("bulk", [unit], priority="bulk")
+        interactive = scheduler.submit("interattivo", [unit])
+        return await bulk.wait() + await interactive.wait()
+
+    assert asyncio.run(scenario()) == ["bulk", "interactive"]
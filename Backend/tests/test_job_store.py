@@ -0,0 +1,111 @@
+import time
+
+from src.job_store import STALE_JOB_DETAIL, JobStore
+
+
+def test_transitions_are_conditional_on_current_status(tmp_path):
+    store = JobStore(tmp_path)
+    store.create("job", detail="creato", meta={})
+
+    assert store.transition("job", ("pending",), "processing") is not None
+    assert store.transition("job", ("pending",), "processing") is None
+    assert store.transition("job", ("pending", "processing"), "cancelled", "annullato") is not None
+    job = store.get("job")
+    assert (job["status"], job["detail"]) == ("cancelled", "annullato")
+    assert job["finished_at"] is not None
+
+
+def test_progress_is_rejected_once_the_job_is_cancelled(tmp_path):
+    store = JobStore(tmp_path)
+    store.create("job", detail="", meta={})
+    version = store.update_progress("job", {"done": 1})
+    assert version == store.version("job")
+
+    store.transition("job", ("pending",), "cancelled")
+
+    assert store.update_progress("job", {"done": 2}) is None
+    assert store.get("job")["progress"] == {"done": 1}
+
+
+def test_checkpoints_keep_only_successful_units_for_resume(tmp_path):
+    store = JobStore(tmp_path)
+    store.create("job", detail="", meta={})
+    store.save_unit("job", 0, 1, "P", "ok", failed=False)
+    store.save_unit("job", 0, 2, "P", "errore", failed=True)
+    store.save_units("job", 1, {(1, "P"): "ripreso"})
+
+    assert store.completed_units("job", 0) == {(1, "P"): "ok"}
+    assert store.completed_units("job", 1) == {(1, "P"): "ripreso"}
+    assert store.count_units("job") == {"saved": 3, "failed": 1}
+
+
+def test_outputs_round_trip_and_index_uncompressed_size(tmp_path):
+    store = JobStore(tmp_path)
+    store.create("job", detail="", meta={})
+    partial = store.partial_output_path("job", 0)
+    partial.parent.mkdir(parents=True)
+    partial.write_text("dal disco " * 1000, encoding="utf-8")
+
+    store.save_outputs("job", {"a.md": b"in memoria", "b.md": partial})
+
+    job = store.get("job")
+    outputs = store.list_outputs(job)
+    assert [name for name, _ in outputs] == ["a.md", "b.md"]
+    assert store.read_output(outputs[1][1]) == ("dal disco " * 1000).encode("utf-8")
+    assert [item["size"] for item in job["meta"]["outputs"]] == [10, 10000]
+    assert not partial.exists()
+
+
+def test_referenced_attachments_lists_every_job(tmp_path):
+    store = JobStore(tmp_path)
+    store.create("a", detail="", meta={"attachments": ["/tmp/x/doc"]})
+    store.create("b", detail="", meta={"save_chunks_mode": False})
+
+    assert store.referenced_attachments() == {"/tmp/x/doc"}
+
+
+def _age(store: JobStore, job_id: str, seconds: float) -> None:
+    """Simula un job che non riceve aggiornamenti né heartbeat da `seconds` secondi."""
+    past = time.time() - seconds
+    store._conn.execute("UPDATE jobs SET updated_at = ?, heartbeat_at = ? WHERE job_id = ?", (past, past, job_id))
+
+
+def test_slow_job_of_a_live_worker_is_not_failed(tmp_path):
+    store = JobStore(tmp_path, stale_after_seconds=60)
+    store.create("job", detail="", meta={})
+    store.transition("job", ("pending",), "processing")
+    _age(store, "job", 600)
+
+    # Nessun avanzamento da 10 minuti, ma il worker che lo esegue è vivo.
+    assert store.heartbeat() == 1
+    assert store.fail_stale() == []
+    assert store.get("job")["status"] == "processing"
+
+
+def test_job_of_a_dead_worker_is_failed_once(tmp_path):
+    dead_worker = JobStore(tmp_path, stale_after_seconds=60)
+    dead_worker.create("job", detail="", meta={})
+    dead_worker.transition("job", ("pending",), "processing")
+    _age(dead_worker, "job", 600)
+
+    # Un altro processo manda il proprio heartbeat: non tiene in vita i job altrui.
+    live_worker = JobStore(tmp_path, stale_after_seconds=60)
+    assert live_worker.heartbeat() == 0
+    failed = live_worker.fail_stale()
+
+    assert failed == [("job", live_worker.version("job"))]
+    job = live_worker.get("job")
+    assert (job["status"], job["detail"]) == ("failed", STALE_JOB_DETAIL)
+    assert live_worker.fail_stale() == []
+
+
+def test_resumed_job_belongs_to_the_worker_that_resumes_it(tmp_path):
+    first = JobStore(tmp_path, stale_after_seconds=60)
+    first.create("job", detail="", meta={})
+    first.transition("job", ("pending",), "failed")
+
+    second = JobStore(tmp_path, stale_after_seconds=60)
+    second.transition("job", ("failed",), "pending")
+    _age(second, "job", 600)
+    assert second.heartbeat() == 1
+    assert second.fail_stale() == []
@@ -0,0 +1,103 @@
+import asyncio
+import sqlite3
+
+from src.llm_cache import ResponseCache
+from src.llm_handler import LLMClientPool
+from src.llm_router import LLMRouter, parse_api_keys
+from src.rate_limiter import RateLimiter, RateLimits
+from src.text_processor import process_single_chunk_with_limiter, unit_content_key
+
+from test_text_processor import CountingLLM
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _cache(tmp_path, monkeypatch, **options):
+    clock = Clock()
+    monkeypatch.setattr("src.llm_cache.time.time", clock)
+    return ResponseCache(tmp_path / "cache.sqlite3", **options), clock
+
+
+def _actual_size(cache: ResponseCache) -> int:
+    return cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, ttl_seconds=60)
+    cache.set("k", "risposta")
+    clock.now += 59
+    assert cache.get("k") == "risposta"
+    clock.now += 2
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["size_bytes"] == 0
+
+
+def test_least_recently_used_entries_are_evicted_over_max_bytes(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, max_bytes=250)
+    for key in ("a", "b"):
+        cache.set(key, "x" * 100)
+        clock.now += 1
+    assert cache.get("a") is not None  # "a" diventa la più recente
+    clock.now += 1
+    cache.set("c", "x" * 100)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["size_bytes"] == 200 == _actual_size(cache)
+
+
+def test_running_total_follows_replacements_and_deletions(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, ttl_seconds=60)
+    cache.set("k", "x" * 10)
+    cache.set("k", "x" * 30)
+    cache.set("j", "x" * 5)
+    assert cache.stats()["size_bytes"] == 35 == _actual_size(cache)
+    clock.now += 61
+    cache.set("n", "x" * 7)  # la scrittura elimina le voci scadute
+    assert cache.stats()["size_bytes"] == 7 == _actual_size(cache)
+
+
+def test_total_is_seeded_for_caches_created_without_it(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "cache.sqlite3"))
+    conn.execute(
+        "CREATE TABLE responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL,"
+        " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO responses VALUES ('vecchia', 'abc', 3, 0, 0)")
+    conn.commit()
+    conn.close()
+
+    cache = ResponseCache(tmp_path / "cache.sqlite3", ttl_seconds=float("inf"))
+    assert cache.stats()["size_bytes"] == 3
+    cache.set("nuova", "abcd")
+    assert ResponseCache(tmp_path / "cache.sqlite3").stats()["size_bytes"] == 7
+
+
+def test_bypass_cache_calls_the_llm_and_refreshes_the_entry(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+    llm = CountingLLM("modello")
+    limiter = RateLimiter(RateLimits(rpm=60000, burst=100))
+    router = LLMRouter(parse_api_keys(["key"]), rate_limiter=limiter,
+                       llm_pool=LLMClientPool(factory=lambda model_config, google_api_key: llm))
+    model_config = {"model_name": "modello"}
+    prompt = "Riassumi: {text_chunk}"
+    cache.set(unit_content_key(model_config, prompt, "testo"), "vecchia risposta")
+
+    def run(bypass_cache: bool):
+        return asyncio.run(process_single_chunk_with_limiter(
+            router, 1, 1, "testo", "Riassunto", prompt, "doc.md", model_config, limiter, cache, bypass_cache
+        ))[1]
+
+    assert run(bypass_cache=False) == "vecchia risposta"
+    assert llm.prompts == []
+
+    fresh = run(bypass_cache=True)
+    assert fresh != "vecchia risposta" and len(llm.prompts) == 1
+    assert run(bypass_cache=False) == fresh
+    assert len(llm.prompts) == 1
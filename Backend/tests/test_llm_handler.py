@@ -0,0 +1,21 @@
+from google.genai import models, types
+
+from src.llm_handler import LLMClientPool, get_llm
+
+
+def _no_model_metadata_request(monkeypatch):
+    # La creazione del client chiede i metadati del modello: nei test niente rete.
+    monkeypatch.setattr(models.Models, "get", lambda self, model, config=None: types.Model(name=model, output_token_limit=8192))
+
+
+def test_each_api_key_gets_its_own_client(monkeypatch):
+    _no_model_metadata_request(monkeypatch)
+    pool = LLMClientPool()
+    llm_a = pool.get({"model_name": "models/gemini-flash-lite-latest"}, "key-a")
+    llm_b = pool.get({"model_name": "models/gemini-flash-lite-latest"}, "key-b")
+    assert llm_a is not llm_b
+    assert llm_a._client._api_client.api_key == "key-a"
+    assert llm_b._client._api_client.api_key == "key-b"
+    # Creare il secondo client non cambia la key del primo.
+    assert get_llm({}, "key-c")._client._api_client.api_key == "key-c"
+    assert llm_a._client._api_client.api_key == "key-a"
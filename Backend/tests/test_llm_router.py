@@ -0,0 +1,78 @@
+import asyncio
+
+from google.api_core import exceptions as google_exceptions
+
+from src.fake_providers import FakeLLM, FakeProviderOptions, LatencyModel
+from src.llm_handler import LLMClientPool
+from src.llm_router import LLMRoute, LLMRouter, parse_api_keys
+from src.rate_limiter import RateLimiter, RateLimits
+from src.retry import RetryPolicy
+from src.text_processor import process_single_chunk_with_limiter
+
+MODEL = {"model_name": "modello"}
+
+
+class KeyLLM(FakeLLM):
+    """Client finto che ricorda la key con cui è stato creato; `exhausted` simula la quota finita."""
+    def __init__(self, api_key: str, exhausted: bool = False):
+        super().__init__("modello", FakeProviderOptions(latency=LatencyModel(distribution="fixed", mean_ms=1)))
+        self.api_key = api_key
+        self.exhausted = exhausted
+        self.calls = 0
+
+    async def acomplete(self, prompt: str):
+        self.calls += 1
+        if self.exhausted:
+            raise google_exceptions.ResourceExhausted("Resource has been exhausted (e.g. check quota).")
+        return await super().acomplete(prompt)
+
+
+def _router(clients, **options) -> LLMRouter:
+    def factory(model_config, google_api_key):
+        clients[google_api_key] = clients.get(google_api_key) or KeyLLM(google_api_key)
+        return clients[google_api_key]
+    return LLMRouter(
+        parse_api_keys(["key-a", "key-b"]), rate_limiter=RateLimiter(RateLimits(rpm=60000, burst=100)),
+        llm_pool=LLMClientPool(factory=factory), **options
+    )
+
+
+def test_two_keys_reach_two_clients():
+    clients = {}
+    router = _router(clients)
+
+    async def scenario():
+        return [await router.client(LLMRoute("modello", key_id, key), MODEL) for key_id, key in router.api_keys.items()]
+
+    llm_a, llm_b = asyncio.run(scenario())
+    assert (llm_a.api_key, llm_b.api_key) == ("key-a", "key-b")
+    assert llm_a is not llm_b
+
+
+def test_quota_error_fails_over_to_the_other_key():
+    clients = {"key-a": KeyLLM("key-a", exhausted=True)}
+    router = _router(clients, quota_cooldown_seconds=60)
+
+    async def scenario():
+        return await process_single_chunk_with_limiter(
+            router, 1, 1, "testo", "Riassunto", "Riassumi: {text_chunk}", "doc.md", MODEL,
+            router.rate_limiter, retry_policy=RetryPolicy(max_attempts=1)
+        )
+
+    # Prima richiesta su key-a (nessun utilizzo ancora: vince l'ordine), poi il passaggio a key-b.
+    (_, response) = asyncio.run(scenario())
+    assert not response.startswith("ERRORE")
+    assert clients["key-a"].calls == 1 and clients["key-b"].calls == 1
+    stats = router.stats()["keys"]
+    assert stats["key1"]["quota_errors"] == 1 and stats["key1"]["failovers"] == 1
+    assert stats["key2"]["successes"] == 1
+    # key-a resta in pausa: la richiesta successiva va direttamente su key-b.
+    asyncio.run(scenario())
+    assert clients["key-a"].calls == 1 and clients["key-b"].calls == 2
+
+
+def test_stats_never_expose_the_keys():
+    router = _router({})
+    rendered = repr(router.stats())
+    assert "key-a" not in rendered and "key-b" not in rendered
+    assert rendered.count("key_fingerprint") == 2
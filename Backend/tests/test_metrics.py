@@ -0,0 +1,102 @@
+import re
+
+from src.metrics import REGISTRY, MetricsRegistry, forget_job, observe_stage, track_job
+
+# Una riga di campione del formato testo: nome, etichette opzionali, valore.
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\\n]|\\[\\"n])*",?)*\})? \S+$')
+
+
+def test_counter_and_gauge_render_help_type_and_samples():
+    registry = MetricsRegistry()
+    calls = registry.counter("app_calls_total", "Chiamate per esito.", ["outcome"])
+    inflight = registry.gauge("app_inflight", "Chiamate in corso.")
+    calls.inc(outcome="ok")
+    calls.inc(2, outcome="ok")
+    calls.inc(0.5, outcome="errore")
+    inflight.inc()
+    inflight.inc()
+    inflight.dec()
+
+    assert registry.render() == (
+        "# HELP app_calls_total Chiamate per esito.\n"
+        "# TYPE app_calls_total counter\n"
+        'app_calls_total{outcome="errore"} 0.5\n'
+        'app_calls_total{outcome="ok"} 3\n'
+        "# HELP app_inflight Chiamate in corso.\n"
+        "# TYPE app_inflight gauge\n"
+        "app_inflight 1\n"
+    )
+
+
+def test_label_values_and_help_are_escaped():
+    registry = MetricsRegistry()
+    errors = registry.counter("app_errors_total", 'Errori "gravi" \\ su\ndue righe.', ["kind"])
+    errors.inc(kind='Errore "strano" in C:\\tmp\na capo')
+
+    help_line, type_line, sample = registry.render().splitlines()
+    assert help_line == '# HELP app_errors_total Errori "gravi" \\\\ su\\ndue righe.'
+    assert type_line == "# TYPE app_errors_total counter"
+    assert sample == 'app_errors_total{kind="Errore \\"strano\\" in C:\\\\tmp\\na capo"} 1'
+    assert SAMPLE_LINE.match(sample)
+
+
+def test_histogram_renders_cumulative_buckets_sum_and_count():
+    registry = MetricsRegistry()
+    latency = registry.histogram("app_latency_seconds", "Latenza.", ["stage"], buckets=(0.1, 1.0, 0.5))
+    for value in (0.05, 0.1, 0.3, 2.0):
+        latency.observe(value, stage="llm")
+
+    assert registry.render().splitlines() == [
+        "# HELP app_latency_seconds Latenza.",
+        "# TYPE app_latency_seconds histogram",
+        'app_latency_seconds_bucket{stage="llm",le="0.1"} 2',
+        'app_latency_seconds_bucket{stage="llm",le="0.5"} 3',
+        'app_latency_seconds_bucket{stage="llm",le="1"} 3',
+        'app_latency_seconds_bucket{stage="llm",le="+Inf"} 4',
+        'app_latency_seconds_sum{stage="llm"} 2.45',
+        'app_latency_seconds_count{stage="llm"} 4',
+    ]
+
+
+def test_histogram_without_labels_and_metric_without_samples():
+    registry = MetricsRegistry()
+    registry.counter("app_unused_total", "Mai incrementato.")
+    sizes = registry.histogram("app_size_bytes", "Dimensioni.", buckets=(10,))
+    sizes.observe(3)
+
+    assert registry.render().splitlines() == [
+        "# HELP app_unused_total Mai incrementato.",
+        "# TYPE app_unused_total counter",
+        "# HELP app_size_bytes Dimensioni.",
+        "# TYPE app_size_bytes histogram",
+        'app_size_bytes_bucket{le="10"} 1',
+        'app_size_bytes_bucket{le="+Inf"} 1',
+        "app_size_bytes_sum 3",
+        "app_size_bytes_count 1",
+    ]
+
+
+def test_observe_stage_feeds_histogram_and_job_timings():
+    timings = track_job("job-metriche")
+    try:
+        observe_stage("test_stage", 0.2, job_id="job-metriche")
+        observe_stage("test_stage", 0.4, job_id="job-metriche")
+    finally:
+        forget_job("job-metriche")
+
+    lines = REGISTRY.render().splitlines()
+    assert 'textflow_stage_duration_seconds_bucket{stage="test_stage",le="0.25"} 1' in lines
+    assert 'textflow_stage_duration_seconds_bucket{stage="test_stage",le="0.5"} 2' in lines
+    assert 'textflow_stage_duration_seconds_count{stage="test_stage"} 2' in lines
+    assert timings.as_dict() == {"test_stage": {"seconds": 0.6, "count": 2, "avg_seconds": 0.3}}
+
+
+def test_metrics_endpoint_is_valid_text_format(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert "# TYPE textflow_jobs gauge" in lines
+    assert 'textflow_jobs{status="pending"}' in response.text
+    for line in lines:
+        assert line.startswith(("# HELP ", "# TYPE ")) or SAMPLE_LINE.match(line), line
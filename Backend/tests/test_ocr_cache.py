@@ -0,0 +1,124 @@
+import os
+import time
+
+from src import ocr_cache
+from src.blob_store import BlobStore
+from src.ocr_cache import IMAGES_DIR, PAGES_FILE, OCRCache
+
+
+def _job_dir(blob_store: BlobStore, tmp_path, name: str, payloads):
+    """Cartella di un job con le immagini collegate dal blob store, come fa `save_image`."""
+    job_dir = tmp_path / name
+    job_dir.mkdir()
+    images = {}
+    for idx, data in enumerate(payloads):
+        images[f"img-{idx}"] = blob_store.link_into(blob_store.put(data, "png"), job_dir)
+    return job_dir, [{"markdown": f"# {name}", "images": images}]
+
+
+def _actual_size(cache: OCRCache) -> int:
+    return sum(f.stat().st_size for f in cache.cache_dir.rglob("*") if f.is_file() and f.name != ocr_cache.SIZE_FILE)
+
+
+def _set_last_used(cache: OCRCache, pdf_hash: str, timestamp: float) -> None:
+    os.utime(cache._entry_dir(pdf_hash, "ocr") / PAGES_FILE, (timestamp, timestamp))
+
+
+def test_cache_hit_relinks_blobs_into_new_job_dir(tmp_path):
+    blobs = BlobStore(tmp_path / "blobs")
+    cache = OCRCache(tmp_path / "cache")
+    job_dir, pages = _job_dir(blobs, tmp_path, "job-1", [b"logo", b"figura"])
+    cache.put("hash-a", "ocr", pages, job_dir)
+
+    target = tmp_path / "job-2"
+    assert cache.get("hash-a", "ocr", target) == pages
+    for filename in pages[0]["images"].values():
+        linked = target / filename
+        blob = next(blobs.root.glob(f"*/{filename.partition('.')[0]}*"))
+        assert linked.stat().st_ino == blob.stat().st_ino
+        # Blob, cartella del primo job, voce di cache e nuova cartella: un solo contenuto.
+        assert blob.stat().st_nlink == 4
+    assert cache.get("hash-b", "ocr", tmp_path / "job-3") is None
+
+
+def test_lru_evicts_least_recently_used_by_pages_mtime(tmp_path):
+    blobs = BlobStore(tmp_path / "blobs")
+    payload_size = 10_000
+    cache = OCRCache(tmp_path / "cache", max_bytes=int(payload_size * 2.5))
+    now = time.time()
+    for idx, name in enumerate(["a", "b"]):
+        job_dir, pages = _job_dir(blobs, tmp_path, f"job-{name}", [name.encode() * payload_size])
+        cache.put(f"hash-{name}", "ocr", pages, job_dir)
+        _set_last_used(cache, f"hash-{name}", now - 100 + idx)
+    # "a" è la più vecchia per mtime, ma una lettura la rende la più recente.
+    assert cache.get("hash-a", "ocr", tmp_path / "reader") is not None
+
+    job_dir, pages = _job_dir(blobs, tmp_path, "job-c", [b"c" * payload_size])
+    cache.put("hash-c", "ocr", pages, job_dir)
+
+    assert cache._entry_dir("hash-a", "ocr").exists()
+    assert not cache._entry_dir("hash-b", "ocr").exists()
+    assert cache._entry_dir("hash-c", "ocr").exists()
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["size_bytes"] == _actual_size(cache) <= cache.max_bytes
+
+
+def test_put_tracks_size_without_walking_the_cache(tmp_path):
+    blobs = BlobStore(tmp_path / "blobs")
+    cache = OCRCache(tmp_path / "cache")
+    for idx in range(10):
+        job_dir, pages = _job_dir(blobs, tmp_path, f"job-{idx}", [f"img-{idx}".encode() * 100])
+        cache.put(f"hash-{idx}", "ocr", pages, job_dir)
+
+    stats = cache.stats()
+    assert stats["scans"] == 1  # Solo quella all'avvio.
+    assert stats["entries"] == 10
+    assert stats["size_bytes"] == _actual_size(cache)
+
+    # Un secondo processo vede le voci esistenti alla prima scansione.
+    assert OCRCache(tmp_path / "cache").stats()["size_bytes"] == stats["size_bytes"]
+
+
+def test_rescan_picks_up_entries_from_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_cache, "RESCAN_EVERY_PUTS", 2)
+    blobs = BlobStore(tmp_path / "blobs")
+    cache = OCRCache(tmp_path / "cache")
+    other = OCRCache(tmp_path / "cache")
+    job_dir, pages = _job_dir(blobs, tmp_path, "job-other", [b"x" * 500])
+    other.put("hash-other", "ocr", pages, job_dir)
+
+    for idx in range(2):
+        job_dir, pages = _job_dir(blobs, tmp_path, f"job-{idx}", [f"y{idx}".encode() * 500])
+        cache.put(f"hash-{idx}", "ocr", pages, job_dir)
+
+    stats = cache.stats()
+    assert stats["scans"] == 2
+    assert stats["entries"] == 3
+    assert stats["size_bytes"] == _actual_size(cache)
+
+
+def test_blob_gc_removes_only_unlinked_blobs(tmp_path):
+    blobs = BlobStore(tmp_path / "blobs")
+    cache = OCRCache(tmp_path / "cache")
+    shared_dir, shared_pages = _job_dir(blobs, tmp_path, "job-shared", [b"in cache"])
+    cache.put("hash-shared", "ocr", shared_pages, shared_dir)
+    _job_dir(blobs, tmp_path, "job-live", [b"in un job"])
+    orphan = blobs.put(b"orfano", "png")
+
+    # Troppo recenti: anche il blob senza link resta.
+    assert blobs.collect_garbage(min_age_seconds=3600) == 0
+    assert orphan.exists()
+
+    assert blobs.collect_garbage(min_age_seconds=0) == 1
+    assert not orphan.exists()
+    assert blobs.stats()["blobs"] == 2
+
+    # Eliminata la cartella del job, il blob resta finché la voce di cache lo collega.
+    for path in shared_dir.iterdir():
+        path.unlink()
+    assert blobs.collect_garbage(min_age_seconds=0) == 0
+    for path in (cache._entry_dir("hash-shared", "ocr") / IMAGES_DIR).iterdir():
+        path.unlink()
+    assert blobs.collect_garbage(min_age_seconds=0) == 1
+    assert blobs.stats()["blobs"] == 1
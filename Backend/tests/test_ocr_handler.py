@@ -0,0 +1,158 @@
+import collections
+import io
+import threading
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ByteStringObject, NameObject
+
+from src import ocr_handler
+from src.blob_store import BlobStore
+from src.fake_providers import FakeOCRProvider, FakeProviderError, FakeProviderOptions
+from src.ocr_handler import OCROptions, _ocr_part_with_retries, _split_range, ocr_pdf, split_pdf
+
+# La pagina i del PDF di prova è larga BASE_WIDTH + i punti: così ogni parte sa da dove viene.
+BASE_WIDTH = 100
+
+
+def make_pdf(filler_bytes) -> bytes:
+    """PDF con una pagina per elemento di `filler_bytes`; ogni pagina pesa circa quanto indicato."""
+    writer = PdfWriter()
+    for idx, size in enumerate(filler_bytes):
+        page = writer.add_blank_page(width=BASE_WIDTH + idx, height=100)
+        page[NameObject("/Filler")] = ByteStringObject(b"x" * size)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def original_pages(pdf_bytes: bytes):
+    """Numeri (1-based) delle pagine del PDF originale contenute in una parte."""
+    return [int(page.mediabox.width) - BASE_WIDTH + 1 for page in PdfReader(io.BytesIO(pdf_bytes)).pages]
+
+
+class PageTaggingOCR(FakeOCRProvider):
+    """
+    OCR simulato che antepone a ogni pagina il suo numero nel PDF originale e conta le
+    chiamate per intervallo; `failures` indica quante volte far fallire un intervallo.
+    """
+    def __init__(self, failures=None):
+        super().__init__(FakeProviderOptions.from_dict({"latency": {"distribution": "fixed", "mean_ms": 0}}), words_per_page=3)
+        self.failures = dict(failures or {})
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def process(self, pdf_bytes, file_name):
+        numbers = original_pages(pdf_bytes)
+        label = f"{numbers[0]}-{numbers[-1]}"
+        with self._lock:
+            self.calls[label] += 1
+            if self.failures.get(label, 0) > 0:
+                self.failures[label] -= 1
+                raise FakeProviderError("503 Service Unavailable (simulato)")
+        pages = super().process(pdf_bytes, file_name)
+        for page, number in zip(pages, numbers):
+            page.markdown = f"<!-- pagina {number} -->\n{page.markdown}"
+        return pages
+
+
+@pytest.fixture(autouse=True)
+def blob_store(tmp_path, monkeypatch):
+    """Le immagini dell'OCR simulato finiscono in un blob store temporaneo."""
+    store = BlobStore(tmp_path / "blobs")
+    monkeypatch.setattr(ocr_handler, "BLOB_STORE", store)
+    return store
+
+
+def _options(**overrides) -> OCROptions:
+    return OCROptions(**{"max_retries": 2, "retry_backoff_seconds": 0, **overrides})
+
+
+def _write_single_page(pdf: bytes, page_idx: int) -> bytes:
+    return ocr_handler._write_pdf_part(PdfReader(io.BytesIO(pdf)), page_idx, 1)
+
+
+def _tags(pages):
+    return [int(page["markdown"].split()[2]) if not page.get("error") else None for page in pages]
+
+
+def test_small_pdf_is_a_single_part_without_rewriting():
+    pdf = make_pdf([100] * 3)
+    parts = split_pdf(pdf, _options())
+    assert [(p.first_page, p.num_pages) for p in parts] == [(0, 3)]
+    assert parts[0].pdf_bytes is pdf
+
+
+def test_unreadable_pdf_is_sent_whole():
+    parts = split_pdf(b"non un pdf", _options())
+    assert [(p.first_page, p.num_pages, p.label) for p in parts] == [(0, 0, "tutte")]
+
+
+def test_split_by_page_count():
+    parts = split_pdf(make_pdf([100] * 7), _options(max_pages_per_chunk=3))
+    assert [p.label for p in parts] == ["1-3", "4-6", "7-7"]
+    assert [original_pages(p.pdf_bytes) for p in parts] == [[1, 2, 3], [4, 5, 6], [7]]
+
+
+def test_split_by_size():
+    pdf = make_pdf([5000] * 8)
+    page_bytes = len(_write_single_page(pdf, 0))
+    max_bytes = 3 * page_bytes
+    parts = split_pdf(pdf, _options(max_chunk_size_mb=max_bytes / (1024 * 1024)))
+
+    assert len(parts) > 1
+    assert all(len(p.pdf_bytes) <= max_bytes for p in parts)
+    # Intervalli contigui, nell'ordine originale, senza pagine perse.
+    assert [n for p in parts for n in original_pages(p.pdf_bytes)] == list(range(1, 9))
+    assert all(p.first_page + p.num_pages == q.first_page for p, q in zip(parts, parts[1:]))
+
+
+def test_oversized_range_is_halved_down_to_a_single_page():
+    # La quarta pagina da sola supera il limite: resta in una parte a sé, le altre no.
+    pdf = make_pdf([1000] * 3 + [50_000] + [1000] * 4)
+    max_bytes = 20_000
+    parts = _split_range(PdfReader(io.BytesIO(pdf)), 0, 8, max_bytes)
+
+    assert [p.label for p in parts] == ["1-2", "3-3", "4-4", "5-8"]
+    assert len(parts[2].pdf_bytes) > max_bytes
+    assert all(len(p.pdf_bytes) <= max_bytes for p in parts if p.label != "4-4")
+
+
+def test_parts_are_merged_back_in_original_page_order(tmp_path):
+    provider = PageTaggingOCR()
+    (tmp_path / "out").mkdir()
+    pages = ocr_pdf(provider, make_pdf([100] * 7), "doc.pdf", tmp_path / "out", _options(max_pages_per_chunk=2))
+
+    assert sorted(provider.calls) == ["1-2", "3-4", "5-6", "7-7"]
+    assert _tags(pages) == list(range(1, 8))
+    # Tutte le pagine hanno lo stesso logo: un solo file collegato nella cartella di output.
+    assert all(page["images"] for page in pages)
+    filenames = {filename for page in pages for filename in page["images"].values()}
+    assert len(filenames) == 1
+    assert (tmp_path / "out" / filenames.pop()).exists()
+
+
+def test_only_the_failing_range_is_retried(tmp_path):
+    provider = PageTaggingOCR(failures={"3-4": 2})
+    pages = ocr_pdf(provider, make_pdf([100] * 6), "doc.pdf", tmp_path / "out", _options(max_pages_per_chunk=2))
+
+    assert provider.calls == {"1-2": 1, "3-4": 3, "5-6": 1}
+    assert _tags(pages) == list(range(1, 7))
+    assert not any(page.get("error") for page in pages)
+
+
+def test_range_that_keeps_failing_becomes_an_error_page(tmp_path):
+    provider = PageTaggingOCR(failures={"3-4": 10})
+    pages = ocr_pdf(provider, make_pdf([100] * 6), "doc.pdf", tmp_path / "out", _options(max_pages_per_chunk=2))
+
+    assert provider.calls["3-4"] == 3
+    assert _tags(pages) == [1, 2, None, 5, 6]
+    assert "pagine 3-4" in pages[2]["markdown"]
+
+
+def test_single_part_failure_is_raised_without_fail_soft(tmp_path):
+    provider = PageTaggingOCR(failures={"1-3": 10})
+    part = split_pdf(make_pdf([100] * 3), _options())[0]
+    with pytest.raises(FakeProviderError):
+        _ocr_part_with_retries(provider, part, "doc.pdf", tmp_path / "out", "", _options(), fail_soft=False)
+    assert provider.calls["1-3"] == 3
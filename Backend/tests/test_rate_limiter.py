@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from src.fake_providers import FakeProviderError
+from src.rate_limiter import RateLimiter, RateLimits, is_rate_limit_error
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.ResourceExhausted("Resource has been exhausted (e.g. check quota)."),
+    google_exceptions.TooManyRequests("Too many requests"),
+    FakeProviderError("429 Too Many Requests (simulato)"),
+    RuntimeError("rate limit exceeded, retry later"),
+])
+def test_quota_errors_are_rate_limits(error):
+    assert is_rate_limit_error(error)
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.PermissionDenied("Billing quota not enabled for this project."),
+    RuntimeError("403 Forbidden: project has no quota for this model"),
+    google_exceptions.InvalidArgument("input is 1429 tokens too long"),
+    FakeProviderError("503 Service Unavailable (simulato)"),
+])
+def test_other_errors_are_not_rate_limits(error):
+    assert not is_rate_limit_error(error)
+
+
+def _limiter() -> RateLimiter:
+    return RateLimiter(default_limits=RateLimits(rpm=6000, tpm=1_000_000, max_concurrency=2, burst=10))
+
+
+async def _call(limiter: RateLimiter, error: BaseException) -> None:
+    with pytest.raises(type(error)):
+        async with limiter.acquire("modello"):
+            raise error
+
+
+def test_only_rate_limit_errors_halve_the_rate():
+    async def scenario():
+        limiter = _limiter()
+        await _call(limiter, google_exceptions.PermissionDenied("quota di fatturazione"))
+        after_forbidden = limiter.stats()["modello"]
+        await _call(limiter, google_exceptions.ResourceExhausted("quota"))
+        return after_forbidden, limiter.stats()["modello"]
+
+    after_forbidden, after_429 = asyncio.run(scenario())
+
+    assert (after_forbidden["current_rpm"], after_forbidden["throttled"]) == (6000, 0)
+    assert (after_429["current_rpm"], after_429["throttled"]) == (3000, 1)
+
+
+def test_concurrency_is_bounded():
+    async def scenario():
+        limiter = _limiter()
+        active = peak = 0
+
+        async def call():
+            nonlocal active, peak
+            async with limiter.acquire("modello"):
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.02)
+                active -= 1
+
+        await asyncio.gather(*(call() for _ in range(10)))
+        return peak
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_throttled_requests_are_admitted_by_priority():
+    async def scenario():
+        # Una richiesta ogni 50 ms: tutte le altre restano in coda nel limiter.
+        limiter = RateLimiter(RateLimits(rpm=1200, max_concurrency=16), interactive_weight=3)
+        admitted = []
+
+        async def call(name, priority):
+            async with limiter.acquire("modello", priority=priority):
+                admitted.append(name)
+
+        # La prima consuma il bucket; b0 prende il turno e attende il prossimo token.
+        await call("primo", "bulk")
+        tasks = [asyncio.create_task(call(f"b{i}", "bulk")) for i in range(3)]
+        await asyncio.sleep(0)
+        # Le bulk arrivano prima, ma le interattive passano avanti (una bulk ogni tre).
+        tasks += [asyncio.create_task(call(f"i{i}", "interactive")) for i in range(4)]
+        await asyncio.gather(*tasks)
+        return admitted
+
+    assert asyncio.run(scenario()) == ["primo", "b0", "i0", "i1", "i2", "b1", "i3", "b2"]
+
+
+def test_cancelled_waiter_does_not_block_the_queue():
+    async def scenario():
+        limiter = RateLimiter(RateLimits(rpm=1200, max_concurrency=16))
+        admitted = []
+
+        async def call(name, priority="interactive"):
+            async with limiter.acquire("modello", priority=priority):
+                admitted.append(name)
+
+        tasks = [asyncio.create_task(call(name)) for name in ("a", "b", "c")]
+        await asyncio.sleep(0.01)
+        tasks[1].cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Dopo la cancellazione il limiter è di nuovo libero.
+        await asyncio.wait_for(call("d", "bulk"), timeout=1)
+        return admitted
+
+    assert asyncio.run(scenario()) == ["a", "c", "d"]
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from src.request_dedup import SingleFlight
+
+
+def test_identical_concurrent_calls_share_one_execution():
+    async def scenario():
+        flights = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "risposta"
+
+        results = await asyncio.gather(*(flights.run("chiave", call) for _ in range(5)))
+        return calls, results, flights.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["risposta"] * 5
+    assert [shared for _, shared in results] == [False] + [True] * 4
+    assert stats == {"in_flight": 0, "started": 1, "shared": 4}
+
+
+def test_cancelling_the_leader_does_not_cancel_the_shared_call():
+    async def scenario():
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def call():
+            await release.wait()
+            return "risposta"
+
+        leader = asyncio.create_task(flights.run("chiave", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.run("chiave", call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == ("risposta", True)
+
+
+def test_errors_reach_every_waiter():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0)
+            raise RuntimeError("503")
+
+        return await asyncio.gather(*(flights.run("chiave", call) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
@@ -0,0 +1,78 @@
+import io
+import random
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import pytest
+
+from src.result_assembler import OrderedResultWriter
+from src.text_processor import compile_results_to_string
+
+
+def legacy_compile_results_to_string(
+    results: Dict[Tuple[int, str], str], prompts: OrderedDict, order_mode: str, num_chunks: int
+) -> str:
+    """Versione originale, che compone il markdown solo a risultati completi."""
+    lines = []
+    if order_mode == "chunk":
+        for chunk_idx in range(1, num_chunks + 1):
+            for prompt_name in prompts.keys():
+                lines.append(results.get((chunk_idx, prompt_name), ""))
+                lines.append("\n---\n")
+    else:
+        for prompt_name in prompts.keys():
+            lines.append(f"# Risultati per Prompt: {prompt_name}\n\n")
+            for chunk_idx in range(1, num_chunks + 1):
+                lines.append(results.get((chunk_idx, prompt_name), ""))
+                lines.append("\n---\n")
+    return "\n".join(lines)
+
+
+def _random_case(rng: random.Random):
+    num_chunks = rng.randint(0, 6)
+    prompts = OrderedDict((f"P{index}", "{text_chunk}") for index in range(rng.randint(1, 3)))
+    empty_chunks = {chunk_idx for chunk_idx in range(1, num_chunks + 1) if rng.random() < 0.2}
+    results = {
+        (chunk_idx, prompt_name): rng.choice(["", "risposta", "riga\ncon a capo", f"r{chunk_idx}{prompt_name}"])
+        for chunk_idx in range(1, num_chunks + 1) if chunk_idx not in empty_chunks
+        for prompt_name in prompts
+        if rng.random() < 0.9
+    }
+    return num_chunks, prompts, empty_chunks, results
+
+
+@pytest.mark.parametrize("order_mode", ["chunk", "prompt"])
+@pytest.mark.parametrize("seed", range(200))
+def test_writer_matches_legacy_for_any_arrival_order(order_mode, seed):
+    rng = random.Random(seed)
+    num_chunks, prompts, empty_chunks, results = _random_case(rng)
+    arrivals = list(results.items())
+    rng.shuffle(arrivals)
+    sink = io.StringIO()
+    writer = OrderedResultWriter(sink, list(prompts), order_mode, num_chunks, empty_chunks)
+
+    for key, response in arrivals:
+        writer.add(key, response)
+    writer.close()
+
+    assert sink.getvalue() == legacy_compile_results_to_string(results, prompts, order_mode, num_chunks)
+
+
+@pytest.mark.parametrize("order_mode", ["chunk", "prompt"])
+@pytest.mark.parametrize("seed", range(50))
+def test_compile_results_to_string_matches_legacy(order_mode, seed):
+    num_chunks, prompts, _, results = _random_case(random.Random(seed))
+
+    assert compile_results_to_string(results, prompts, order_mode, num_chunks) == \
+        legacy_compile_results_to_string(results, prompts, order_mode, num_chunks)
+
+
+def test_writer_flushes_complete_prefix_only():
+    sink = io.StringIO()
+    writer = OrderedResultWriter(sink, ["A"], "chunk", 3)
+
+    writer.add((2, "A"), "secondo")
+    assert sink.getvalue() == ""
+    writer.add((1, "A"), "primo")
+    assert sink.getvalue() == "primo\n\n---\n\nsecondo\n\n---\n"
+    assert writer.max_pending == 2
@@ -0,0 +1,39 @@
+import httpx
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from src.fake_providers import FakeProviderError
+from src.retry import RetryPolicy, is_transient_error
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.ServiceUnavailable("The model is overloaded."),
+    google_exceptions.InternalServerError("An internal error has occurred."),
+    google_exceptions.DeadlineExceeded("Deadline Exceeded"),
+    google_exceptions.ResourceExhausted("Resource has been exhausted (e.g. check quota)."),
+    FakeProviderError("503 Service Unavailable (simulato)"),
+    httpx.ConnectError("connessione rifiutata"),
+    TimeoutError(),
+    RuntimeError("Read timed out"),
+])
+def test_transient_errors_are_retried(error):
+    assert is_transient_error(error)
+    assert RetryPolicy(max_attempts=4).should_retry(error, attempt=0)
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.InvalidArgument("Request payload size: input is 1500 tokens too long"),
+    google_exceptions.InvalidArgument("API key not valid. Please pass a valid API key. (internal reference 500)"),
+    google_exceptions.PermissionDenied("Connection to this project is not allowed"),
+    RuntimeError("400 input is 1500 tokens too long"),
+    ValueError("Prompt non valido"),
+])
+def test_permanent_errors_are_not_retried(error):
+    assert not is_transient_error(error)
+
+
+def test_retries_stop_at_max_attempts():
+    policy = RetryPolicy(max_attempts=3)
+    error = google_exceptions.ServiceUnavailable("")
+
+    assert [policy.should_retry(error, attempt) for attempt in range(3)] == [True, True, False]
@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+from benchmarks.bench_normalizer import make_ocr_text
+from benchmarks.legacy_normalizer import legacy_normalize_text
+from src.text_normalizer import iter_source_lines, iter_source_lines_from_blocks, normalize_text
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_normalize_text_matches_legacy(seed):
+    text = make_ocr_text(20_000, seed=seed)
+
+    assert normalize_text(text) == legacy_normalize_text(text)
+
+
+@pytest.mark.parametrize("text", ["", "\n", "TITOLO\n\n\n", "1.1 Sezione<br>testo<BR/>", "  \n\t\nRIGA"])
+def test_normalize_text_matches_legacy_on_edge_cases(text):
+    assert normalize_text(text) == legacy_normalize_text(text)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_lines_from_blocks_match_whole_text(seed):
+    rng = random.Random(seed)
+    text = make_ocr_text(5_000, seed=seed)
+    blocks, position = [], 0
+    while position < len(text):
+        size = rng.randint(0, 12)
+        blocks.append(text[position:position + size])
+        position += size
+
+    assert list(iter_source_lines_from_blocks(blocks)) == list(iter_source_lines(text))
+
+
+def test_break_tags_split_across_blocks():
+    text = "uno<br />due<BR>tre\nquattro<b>cinque<br"
+    expected = list(iter_source_lines(text))
+    for first in range(len(text) + 1):
+        for second in range(first, len(text) + 1):
+            blocks = [text[:first], text[first:second], text[second:]]
+            assert list(iter_source_lines_from_blocks(blocks)) == expected
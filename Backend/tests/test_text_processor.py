@@ -0,0 +1,99 @@
+import asyncio
+from collections import OrderedDict
+
+from src.fake_providers import FakeLLM, FakeProviderOptions, LatencyModel
+from src.job_scheduler import JobScheduler
+from src.llm_cache import ResponseCache
+from src.llm_handler import LLMClientPool
+from src.llm_router import LLMRouter, parse_api_keys
+from src.rate_limiter import RateLimiter, RateLimits
+from src.request_dedup import SingleFlight
+from src.text_processor import ProcessingOptions, process_chunks_async, process_single_chunk_with_limiter, unit_content_key
+
+PROMPTS = OrderedDict([("Riassunto", "Riassumi:\n\n{text_chunk}"), ("Domande", "Tre domande su:\n\n{text_chunk}")])
+CHUNKS = ["Primo testo di prova.", "Secondo testo di prova.", "Terzo testo di prova."]
+
+
+class CountingLLM(FakeLLM):
+    def __init__(self, model_name: str):
+        super().__init__(model_name, FakeProviderOptions(latency=LatencyModel(distribution="fixed", mean_ms=1)))
+        self.prompts = []
+
+    async def acomplete(self, prompt: str):
+        self.prompts.append(prompt)
+        return await super().acomplete(prompt)
+
+
+def _run(llm: CountingLLM, cache: ResponseCache, **options):
+    async def scenario():
+        return await process_chunks_async(
+            chunks=CHUNKS, file_name="doc.md", prompts=PROMPTS, model_config={"model_name": "modello"},
+            google_api_key="key", options=ProcessingOptions(
+                rate_limiter=RateLimiter(RateLimits(rpm=60000, burst=100)), cache=cache, scheduler=JobScheduler(),
+                llm_pool=LLMClientPool(factory=lambda model_config, google_api_key: llm), **options
+            )
+        )
+    return asyncio.run(scenario())
+
+
+def test_batched_answers_are_not_served_to_single_requests(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+    batched = CountingLLM("modello")
+    _run(batched, cache, batch_mode="prompts")
+    assert len(batched.prompts) == len(CHUNKS)
+
+    single = CountingLLM("modello")
+    _run(single, cache)
+    assert len(single.prompts) == len(CHUNKS) * len(PROMPTS)
+
+    # Una nuova esecuzione raggruppata trova in cache sia le sue risposte sia quelle singole.
+    batched_again = CountingLLM("modello")
+    _run(batched_again, cache, batch_mode="prompts")
+    assert batched_again.prompts == []
+
+
+def test_shared_call_is_cached_when_the_leading_job_is_cancelled(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+    release = asyncio.Event()
+
+    class SlowLLM(CountingLLM):
+        async def acomplete(self, prompt: str):
+            await release.wait()
+            return await super().acomplete(prompt)
+
+    llm = SlowLLM("modello")
+
+    async def scenario():
+        limiter = RateLimiter(RateLimits(rpm=60000, burst=100))
+        router = LLMRouter(parse_api_keys(["key"]), rate_limiter=limiter,
+                           llm_pool=LLMClientPool(factory=lambda model_config, google_api_key: llm))
+        coalescer = SingleFlight()
+
+        def unit():
+            return process_single_chunk_with_limiter(
+                router, 1, 1, CHUNKS[0], "Riassunto", PROMPTS["Riassunto"], "doc.md", {"model_name": "modello"},
+                limiter, cache, coalescer=coalescer
+            )
+
+        leader = asyncio.create_task(unit())
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(unit())
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        release.set()
+        return await follower
+
+    _, response = asyncio.run(scenario())
+
+    assert len(llm.prompts) == 1
+    assert cache.get(unit_content_key({"model_name": "modello"}, PROMPTS["Riassunto"], CHUNKS[0])) == response
+
+
+def test_output_path_receives_the_markdown(tmp_path):
+    output_path = tmp_path / "parziali" / "doc.md"
+    llm = CountingLLM("modello")
+    file_name, result = _run(llm, None, output_path=output_path)
+    assert file_name == "doc.md"
+    assert result == output_path
+    markdown = output_path.read_text(encoding="utf-8")
+    assert markdown.count("\n---\n") == len(CHUNKS) * len(PROMPTS)
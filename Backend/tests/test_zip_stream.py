@@ -0,0 +1,99 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from src.zip_stream import ArchiveSpool, ZipEntry, collect_attachment_entries, iter_zip, write_archive
+
+
+class NonSeekableSink:
+    """Destinazione come un socket: accetta solo `write`, niente `seek` né `tell`."""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(data)
+        return len(data)
+
+    def seekable(self) -> bool:
+        return False
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+def _attachments(tmp_path):
+    folder = tmp_path / "doc"
+    folder.mkdir()
+    (folder / "figura.png").write_bytes(os.urandom(50_000))
+    (folder / "foto.JPG").write_bytes(os.urandom(20_000))
+    return [str(folder)]
+
+
+def _entries(tmp_path):
+    markdown = ("# Titolo\n\n" + "testo ripetuto " * 5000).encode("utf-8")
+    return [
+        ZipEntry(arcname="doc.md", data=markdown),
+        ZipEntry(arcname="generato.md", blocks=lambda: iter([markdown[:1000], markdown[1000:]]), size=len(markdown)),
+        *collect_attachment_entries(_attachments(tmp_path)),
+    ], markdown
+
+
+def test_images_are_stored_and_text_is_deflated(tmp_path):
+    entries, markdown = _entries(tmp_path)
+    with zipfile.ZipFile(io.BytesIO(b"".join(iter_zip(entries)))) as zf:
+        methods = {info.filename: info.compress_type for info in zf.infolist()}
+        assert zf.read("doc.md") == markdown
+    assert methods == {
+        "doc.md": zipfile.ZIP_DEFLATED,
+        "generato.md": zipfile.ZIP_DEFLATED,
+        "Allegati/doc/figura.png": zipfile.ZIP_STORED,
+        "Allegati/doc/foto.JPG": zipfile.ZIP_STORED,
+    }
+
+
+def test_archive_streamed_to_non_seekable_sink_opens_with_zipfile(tmp_path):
+    entries, markdown = _entries(tmp_path)
+    sink = NonSeekableSink()
+    for block in iter_zip(entries, chunk_size=4096):
+        sink.write(block)
+
+    # Le voci escono a blocchi man mano che vengono compresse, non tutte alla fine.
+    assert len(sink.chunks) > 2
+    with zipfile.ZipFile(io.BytesIO(sink.getvalue())) as zf:
+        assert zf.testzip() is None
+        assert zf.read("generato.md") == markdown
+        assert zf.read("Allegati/doc/figura.png") == (tmp_path / "doc" / "figura.png").read_bytes()
+        # Dimensioni e CRC arrivano nei data descriptor (bit 3), scritti dopo i dati.
+        assert all(info.flag_bits & 0x08 for info in zf.infolist())
+
+
+@pytest.mark.parametrize("spill_threshold", [0, 10 * 1024 * 1024])
+def test_spool_saves_the_streamed_archive(tmp_path, spill_threshold):
+    entries, _ = _entries(tmp_path)
+    final_path = tmp_path / "job" / "archive.zip"
+    spool = ArchiveSpool(final_path, spill_threshold)
+    streamed = b""
+    for block in iter_zip(entries):
+        spool.write(block)
+        streamed += block
+    assert spool.finish() == final_path
+    assert final_path.read_bytes() == streamed
+    assert [p.name for p in final_path.parent.iterdir()] == ["archive.zip"]
+
+
+def test_spool_discard_leaves_no_partial_file(tmp_path):
+    final_path = tmp_path / "archive.zip"
+    spool = ArchiveSpool(final_path, spill_threshold=10)
+    spool.write(b"x" * 100)
+    spool.discard()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_write_archive_matches_streamed_archive(tmp_path):
+    entries, markdown = _entries(tmp_path)
+    path = write_archive(entries, tmp_path / "out" / "archive.zip")
+    with zipfile.ZipFile(path) as zf:
+        assert zf.read("doc.md") == markdown
+        assert len(zf.infolist()) == 4
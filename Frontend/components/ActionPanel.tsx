@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import { useAppStore } from '../store/useAppStore';
-import { getChunks, processMultipleFiles, getJobStatus } from '../services/apiService';
+import { streamChunks, processMultipleFiles, getJobStatus } from '../services/apiService';
 import { PlayIcon } from './icons';
 
 const JobProgressLog = ({ detail }: { detail: string | null }) => { /* ... (INVARIATO) ... */ return null };
@@ -34,10 +34,14 @@ export const ActionPanel = () => {
 
   const handleChunking = async () => {
     if (store.uploadedFiles.length === 0) return;
-    store.startChunking();
+    store.startChunking(store.uploadedFiles.length);
     try {
-      const results = await getChunks(store.uploadedFiles, store.chunkingConfig, store.normalizeText);
-      store.setChunkFiles(results);
+      // Ogni file compare nell'editor appena pronto, senza attendere gli altri.
+      await streamChunks(store.uploadedFiles, store.chunkingConfig, store.normalizeText, {
+        onFile: store.addChunkFile,
+        onFileError: store.failChunkingFile,
+      });
+      store.finishChunking();
     } catch (e) {
       store.failChunking(e);
     }
@@ -80,16 +84,19 @@ export const ActionPanel = () => {
             onClick={handleStartProcessing}
             disabled={
               store.chunkFiles.length === 0 ||
+              store.chunkingPending > 0 ||
               ( !store.preprocessingOnly && !store.saveChunksMode && Object.keys(store.selectedPrompts).length === 0 )
             }
             className="w-full sm:w-auto flex items-center justify-center gap-2 px-8 py-4 bg-brand-600 text-white font-bold text-lg rounded-lg shadow-md hover:bg-brand-700 disabled:bg-slate-400"
           >
             <PlayIcon />
-            2. Start Pipeline ({store.chunkFiles.length} file/s)
+            {store.chunkingPending > 0
+              ? `Splitting... (${store.chunkFiles.length} ready, ${store.chunkingPending} pending)`
+              : `2. Start Pipeline (${store.chunkFiles.length} file/s)`}
           </button>
         )}
       </div>
-      {store.chunkingError && <p className="text-sm text-red-600 mt-2 text-center">{store.chunkingError}</p>}
+      {store.chunkingError && <p className="text-sm text-red-600 mt-2 text-center whitespace-pre-line">{store.chunkingError}</p>}
       {store.error && <p className="text-sm text-red-600 mt-2 text-center">{store.error}</p>}
     </div>
   );
@@ -1,30 +1,60 @@
 import type { LLMConfig, ChunkingConfig } from '../types';
 import type { ChunkFile } from '../store/useAppStore';
 
-export const getChunks = async (
+export interface ChunkStreamHandlers {
+    onFile: (fileIndex: number, file: Omit<ChunkFile, 'chunkNames'>) => void;
+    onFileError: (fileIndex: number, fileName: string, message: string) => void;
+}
+
+// Il backend risponde in NDJSON: una riga per file appena il suo chunking è concluso,
+// così il primo file si può già modificare mentre gli altri sono ancora in elaborazione.
+export const streamChunks = async (
     files: File[],
     config: ChunkingConfig,
-    normalize: boolean
-): Promise<Array<Omit<ChunkFile, 'chunkNames'>>> => {
+    normalize: boolean,
+    handlers: ChunkStreamHandlers
+): Promise<void> => {
     const formData = new FormData();
     files.forEach(file => formData.append('files', file));
     formData.append('max_words', String(config.max_words));
     formData.append('min_words', String(config.min_words));
     formData.append('normalize_text_flag', String(normalize));
 
-    const response = await fetch('/api/chunk', { method: 'POST', body: formData });
+    const response = await fetch('/api/chunk/stream', { method: 'POST', body: formData });
 
-    if (!response.ok) {
+    if (!response.ok || !response.body) {
         const error = await response.json().catch(() => ({ detail: 'Failed to get chunks from server.' }));
         throw new Error(error.detail);
     }
-    const data = await response.json();
-    // Assicurati di mappare il nuovo campo
-    return data.map((item: any) => ({ 
-        fileName: item.file_name, 
-        chunks: item.chunks, 
-        attachment_path: item.attachment_path 
-    }));
+
+    const handleLine = (line: string) => {
+        if (!line.trim()) return;
+        const item = JSON.parse(line);
+        if (item.error) {
+            handlers.onFileError(item.file_index, item.file_name, item.error);
+        } else {
+            handlers.onFile(item.file_index, {
+                fileName: item.file_name,
+                chunks: item.chunks,
+                attachment_path: item.attachment_path
+            });
+        }
+    };
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            handleLine(buffer.slice(0, newline));
+            buffer = buffer.slice(newline + 1);
+        }
+    }
+    handleLine(buffer + decoder.decode());
 };
 
 export const processMultipleFiles = async (
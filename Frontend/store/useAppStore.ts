@@ -30,6 +30,9 @@ interface AppState {
   currentFileIndex: number;
   chunkingStatus: 'idle' | 'loading' | 'loaded' | 'error';
   chunkingError: string | null;
+  // File ancora in chunking e posizione nell'upload di ogni elemento di chunkFiles.
+  chunkingPending: number;
+  chunkFileOrder: number[];
 }
 
 const initialState: AppState = {
@@ -52,6 +55,8 @@ const initialState: AppState = {
   currentFileIndex: 0,
   chunkingStatus: 'idle',
   chunkingError: null,
+  chunkingPending: 0,
+  chunkFileOrder: [],
 };
 
 const state: AppState = { ...initialState };
@@ -84,28 +89,48 @@ const actions = {
   setSaveChunksMode: (isOn: boolean) => { state.saveChunksMode = isOn; if (isOn) state.preprocessingOnly = false; },
 
   // --- LOGICA DI CHUNKING PER FILE MULTIPLI ---
-  startChunking: () => {
+  startChunking: (totalFiles: number) => {
     state.chunkingStatus = 'loading';
     state.chunkingError = null;
     state.chunkFiles = [];
+    state.chunkFileOrder = [];
+    state.currentFileIndex = 0;
+    state.chunkingPending = totalFiles;
     actions.resetJobState();
   },
   failChunking: (error: any) => {
-    state.chunkingStatus = 'error';
+    // I file già arrivati restano modificabili.
+    state.chunkingStatus = state.chunkFiles.length > 0 ? 'loaded' : 'error';
+    state.chunkingPending = 0;
     state.chunkingError = error instanceof Error ? error.message : String(error);
   },
-  setChunkFiles: (files: Omit<ChunkFile, 'chunkNames'>[]) => {
-    state.chunkFiles = files.map(file => {
-      const dotIndex = file.fileName.lastIndexOf('.');
-      const fileStem = dotIndex > 0 ? file.fileName.substring(0, dotIndex) : file.fileName;
-      return {
-        ...file,
-        chunkNames: file.chunks.map((_, idx) => `${fileStem} - PT. ${idx + 1}`)
-      };
+  // I file arrivano in ordine di completamento: ognuno viene inserito nella sua posizione
+  // dell'upload, mantenendo selezionato il file che l'utente sta già modificando.
+  addChunkFile: (uploadIndex: number, file: Omit<ChunkFile, 'chunkNames'>) => {
+    const dotIndex = file.fileName.lastIndexOf('.');
+    const fileStem = dotIndex > 0 ? file.fileName.substring(0, dotIndex) : file.fileName;
+    const position = state.chunkFileOrder.filter(index => index < uploadIndex).length;
+    const chunkFiles = [...state.chunkFiles];
+    chunkFiles.splice(position, 0, {
+      ...file,
+      chunkNames: file.chunks.map((_, idx) => `${fileStem} - PT. ${idx + 1}`)
     });
-    state.currentFileIndex = 0;
+    state.chunkFiles = chunkFiles;
+    state.chunkFileOrder = [...state.chunkFileOrder];
+    state.chunkFileOrder.splice(position, 0, uploadIndex);
+    if (chunkFiles.length > 1 && position <= state.currentFileIndex) state.currentFileIndex++;
+    state.chunkingPending = Math.max(0, state.chunkingPending - 1);
     state.chunkingStatus = 'loaded';
   },
+  failChunkingFile: (uploadIndex: number, fileName: string, message: string) => {
+    state.chunkingPending = Math.max(0, state.chunkingPending - 1);
+    state.chunkingError = [state.chunkingError, `${fileName}: ${message}`].filter(Boolean).join('\n');
+    if (state.chunkingPending === 0 && state.chunkFiles.length === 0) state.chunkingStatus = 'error';
+  },
+  finishChunking: () => {
+    state.chunkingPending = 0;
+    if (state.chunkFiles.length === 0) state.chunkingStatus = 'error';
+  },
 
   // --- NAVIGAZIONE E MODIFICA DEI CHUNK ---
   goToNextFile: () => { if (state.currentFileIndex < state.chunkFiles.length - 1) state.currentFileIndex++; },
@@ -179,7 +204,7 @@ const actions = {
 
   // --- AZIONI DI RESET ---
   resetJobState: () => { state.jobStatus = 'idle'; state.error = null; state.results = null; state.jobId = null; state.jobDetail = null; },
-  fullReset: () => { state.chunkFiles = []; state.currentFileIndex = 0; state.chunkingStatus = 'idle'; state.chunkingError = null; actions.resetJobState(); },
+  fullReset: () => { state.chunkFiles = []; state.chunkFileOrder = []; state.chunkingPending = 0; state.currentFileIndex = 0; state.chunkingStatus = 'idle'; state.chunkingError = null; actions.resetJobState(); },
 };
 
 Object.keys(actions).forEach(key => { const a = (actions as any)[key]; (actions as any)[key] = (...args: any[]) => { a(...args); notify(); }; });